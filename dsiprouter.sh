@@ -1173,6 +1173,8 @@ function configureKamailioDB() {
     # Update schema for dr_rules table
     withRootDBConn --db="$KAM_DB_NAME" mysql \
         < ${PROJECT_DSIP_DEFAULTS_DIR}/dr_rules.sql
+    # the reflected schema cached by the GUI no longer matches
+    rm -f ${DSIP_LIB_DIR}/schema.cache
 
     # Update schema for dispatcher table
     withRootDBConn --db="$KAM_DB_NAME" mysql \
@@ -1193,6 +1195,8 @@ function configureKamailioDB() {
     # Install schema for custom LCR logic
     withRootDBConn --db="$KAM_DB_NAME" mysql \
         < ${PROJECT_DSIP_DEFAULTS_DIR}/dsip_lcr.sql
+    withRootDBConn --db="$KAM_DB_NAME" mysql \
+        < ${PROJECT_DSIP_DEFAULTS_DIR}/dsip_lcr_index.sql
 
     # Install schema for custom MaintMode logic
     withRootDBConn --db="$KAM_DB_NAME" mysql \
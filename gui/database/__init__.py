@@ -6,11 +6,11 @@ import sqlalchemy.engine
 if sys.path[0] != '/etc/dsiprouter/gui':
     sys.path.insert(0, '/etc/dsiprouter/gui')
 
-import os, inspect
+import os, threading, pickle, hashlib
 from collections import OrderedDict
 from enum import Enum
 from datetime import datetime, timedelta
-from sqlalchemy import create_engine, MetaData, Table, Column, String, exc as sql_exceptions
+from sqlalchemy import create_engine, bindparam, MetaData, Column, String, exc as sql_exceptions
 from sqlalchemy.orm import registry, sessionmaker, scoped_session
 from sqlalchemy.sql import text
 import settings
@@ -37,6 +37,21 @@ if settings.KAM_DB_TYPE == "mysql":
 DB_ENGINE_NAME = 'global_db_engine'
 SESSION_LOADER_NAME = 'global_session_loader'
 
+# process-wide DB objects, keyed by the names above
+# populated once by createValidEngine() / createSessionObjects() so lookups are a dict access
+_db_registry = {}
+_db_registry_lock = threading.RLock()
+
+# reflected tables are cached here between runs, keyed by the dSIPRouter version and a fingerprint of their columns
+SCHEMA_CACHE_FILE = '/var/lib/dsiprouter/schema.cache'
+# tables mapped by createSessionObjects()
+REFLECTED_TABLES = (
+    'dr_gateways', 'address', 'dr_rules', 'subscriber', 'dsip_domain_mapping', 'dsip_multidomain_mapping',
+    'dsip_lcr', 'uacreg', 'dr_gw_lists', 'domain', 'domain_attrs', 'dispatcher', 'dsip_endpoint_lease',
+    'dsip_maintmode', 'dsip_calllimit', 'dsip_notification', 'dsip_hardfwd', 'dsip_failfwd', 'dsip_cdrinfo',
+    'dsip_certificates', 'dsip_dnid_enrich_lnp', 'dsip_user',
+)
+
 
 class Gateways(object):
     """
@@ -556,30 +571,34 @@ def createValidEngine(uri_list):
     :raise:             SQLAlchemyError if all connections fail
     """
 
-    # globals from the top-level module
-    caller_globals = dict(inspect.getmembers(inspect.stack()[-1][0]))["f_globals"]
-
-    if DB_ENGINE_NAME in caller_globals:
-        return caller_globals[DB_ENGINE_NAME]
+    db_engine = _db_registry.get(DB_ENGINE_NAME, None)
+    if db_engine is not None:
+        return db_engine
 
     errors = []
 
-    for conn_uri in uri_list:
-        try:
-            db_engine = create_engine(conn_uri,
-                echo=settings.DEBUG,
-                echo_pool=settings.DEBUG,
-                pool_recycle=300,
-                pool_size=10,
-                isolation_level="READ UNCOMMITTED",
-                connect_args={"connect_timeout": 5})
-            # test connection
-            _ = db_engine.connect()
-            # conn good return it
-            caller_globals[DB_ENGINE_NAME] = db_engine
-            return caller_globals[DB_ENGINE_NAME]
-        except Exception as ex:
-            errors.append(ex)
+    with _db_registry_lock:
+        # another thread may have created it while we waited
+        if DB_ENGINE_NAME in _db_registry:
+            return _db_registry[DB_ENGINE_NAME]
+
+        for conn_uri in uri_list:
+            try:
+                db_engine = create_engine(conn_uri,
+                    echo=settings.DEBUG,
+                    echo_pool=settings.DEBUG,
+                    pool_recycle=300,
+                    pool_size=10,
+                    isolation_level="READ UNCOMMITTED",
+                    connect_args={"connect_timeout": 5})
+                # test connection
+                with db_engine.connect():
+                    pass
+                # conn good return it
+                _db_registry[DB_ENGINE_NAME] = db_engine
+                return db_engine
+            except Exception as ex:
+                errors.append(ex)
 
     # we failed to return good connection raise exceptions
     if settings.DEBUG:
@@ -597,53 +616,207 @@ def startSession():
     This method uses a singleton pattern to grab the global session loader and start a session
     """
 
-    # globals from the top-level module
-    caller_globals = dict(inspect.getmembers(inspect.stack()[-1][0]))["f_globals"]
-
-    if SESSION_LOADER_NAME in caller_globals:
-        return caller_globals[SESSION_LOADER_NAME]()
+    session_loader = _db_registry.get(SESSION_LOADER_NAME, None)
+    if session_loader is not None:
+        return session_loader()
 
     db_engine, session_loader = createSessionObjects()
     return session_loader()
 
 
+def getDBEngine():
+    """
+    Get the process-wide DB engine, creating the DB objects if they do not exist yet
+
+    :return:    DB engine
+    :rtype:     :class:`sqlalchemy.engine.Engine`
+    """
+
+    db_engine = _db_registry.get(DB_ENGINE_NAME, None)
+    if db_engine is not None:
+        return db_engine
+
+    db_engine, session_loader = createSessionObjects()
+    return db_engine
+
+
 def createSessionObjects():
     """
     Create the DB engine and session factory
 
+    The objects are created once per process, later calls return the registered objects
+
     :return:    Session factory and DB Engine
     :rtype:     (:class:`sqlalchemy.orm.Session`,:class:`sqlalchemy.engine.Engine`)
     """
 
+    with _db_registry_lock:
+        if SESSION_LOADER_NAME in _db_registry:
+            return _db_registry[DB_ENGINE_NAME], _db_registry[SESSION_LOADER_NAME]
+
+        db_engine, session_loader = _createSessionObjects()
+        _db_registry[SESSION_LOADER_NAME] = session_loader
+        return db_engine, session_loader
+
+
+def loadSchemaCache(key):
+    """
+    Load the reflected tables cached by a previous startup
+
+    :param key:         key of the current schema, as returned by :func:`getSchemaCacheKey`
+    :type key:          tuple
+    :return:            the cached metadata or None if there is no valid cache
+    :rtype:             :class:`sqlalchemy.MetaData`|None
+    """
+
+    try:
+        with open(SCHEMA_CACHE_FILE, 'rb') as fp:
+            cache = pickle.load(fp)
+        if cache['key'] != key:
+            return None
+        return cache['metadata']
+    except FileNotFoundError:
+        return None
+    except Exception as ex:
+        IO.logwarn('ignoring unreadable schema cache {}: {}'.format(SCHEMA_CACHE_FILE, str(ex)))
+        return None
+
+
+def saveSchemaCache(key, metadata):
+    """
+    Cache the reflected tables so the next startup can skip reflection
+
+    :param key:         key of the schema the tables were reflected from, as returned by :func:`getSchemaCacheKey`
+    :type key:          tuple
+    :param metadata:    the reflected tables
+    :type metadata:     :class:`sqlalchemy.MetaData`
+    :return:            None
+    :rtype:             None
+    """
+
+    tmp_file = '{}.{}'.format(SCHEMA_CACHE_FILE, os.getpid())
+    try:
+        with open(os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as fp:
+            pickle.dump({'key': key, 'metadata': metadata}, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        # atomic so other processes never read a partial cache
+        os.replace(tmp_file, SCHEMA_CACHE_FILE)
+    except Exception as ex:
+        IO.logwarn('could not write schema cache {}: {}'.format(SCHEMA_CACHE_FILE, str(ex)))
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+
+
+def invalidateSchemaCache():
+    """
+    Remove the cached tables, required after schema changes the column fingerprint does not cover, such as indexes
+
+    :return:    None
+    :rtype:     None
+    """
+
+    try:
+        os.remove(SCHEMA_CACHE_FILE)
+    except FileNotFoundError:
+        pass
+
+
+def getSchemaFingerprint(db_engine):
+    """
+    Hash the column definitions of the reflected tables
+
+    A single query on information_schema, much cheaper than reflecting the tables,
+    so schema changes made without a version change still invalidate the cache.
+
+    :param db_engine:   engine to query the schema with
+    :type db_engine:    :class:`sqlalchemy.engine.Engine`
+    :return:            hex digest of the column definitions
+    :rtype:             str
+    """
+
+    with db_engine.connect() as conn:
+        rows = conn.execute(
+            text("""SELECT TABLE_NAME, COLUMN_NAME, ORDINAL_POSITION, COLUMN_TYPE, IS_NULLABLE, COLUMN_DEFAULT, COLUMN_KEY, EXTRA
+                FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = :schema AND TABLE_NAME IN :tables
+                ORDER BY TABLE_NAME, ORDINAL_POSITION""").bindparams(bindparam('tables', expanding=True)),
+            {'schema': db_engine.url.database, 'tables': list(REFLECTED_TABLES)}
+        ).all()
+    return hashlib.sha256(repr([tuple(row) for row in rows]).encode('utf-8')).hexdigest()
+
+
+def getSchemaCacheKey(db_engine):
+    """
+    :param db_engine:   engine the tables are reflected with
+    :type db_engine:    :class:`sqlalchemy.engine.Engine`
+    :return:            key the schema cache is only valid for
+    :rtype:             tuple
+    """
+
+    return (settings.VERSION, sqlalchemy.__version__, db_engine.url.host, db_engine.url.database, REFLECTED_TABLES,
+            getSchemaFingerprint(db_engine))
+
+
+def reflectTables(db_engine):
+    """
+    Get the tables used by the ORM, from the schema cache when it is valid
+
+    Tables missing from the cache are reflected and the cache is rewritten
+
+    :param db_engine:   engine to reflect the tables with
+    :type db_engine:    :class:`sqlalchemy.engine.Engine`
+    :return:            the reflected tables
+    :rtype:             :class:`sqlalchemy.MetaData`
+    """
+
+    key = getSchemaCacheKey(db_engine)
+    metadata = loadSchemaCache(key)
+    if metadata is None:
+        metadata = MetaData(schema=db_engine.url.database)
+
+    missing = [table for table in REFLECTED_TABLES if metadata.tables.get('{}.{}'.format(metadata.schema, table)) is None]
+    if len(missing) > 0:
+        metadata.reflect(bind=db_engine, only=missing, extend_existing=True)
+        saveSchemaCache(key, metadata)
+
+    return metadata
+
+
+def _createSessionObjects():
     db_engine = createValidEngine(createDBURI())
 
-    mapper = registry(metadata=MetaData(schema=db_engine.url.database))
-
-    dr_gateways = Table('dr_gateways', mapper.metadata, autoload_replace=True, autoload_with=db_engine)
-    address = Table('address', mapper.metadata, autoload_replace=True, autoload_with=db_engine)
-    outboundroutes = Table('dr_rules', mapper.metadata, autoload_replace=True, autoload_with=db_engine)
-    inboundmapping = Table('dr_rules', mapper.metadata, autoload_replace=True, autoload_with=db_engine)
-    subscriber = Table('subscriber', mapper.metadata, autoload_replace=True, autoload_with=db_engine)
-    dsip_domain_mapping = Table('dsip_domain_mapping', mapper.metadata, autoload_replace=True, autoload_with=db_engine)
-    dsip_multidomain_mapping = Table('dsip_multidomain_mapping', mapper.metadata, autoload_replace=True, autoload_with=db_engine)
-    # fusionpbx_mappings = Table('dsip_fusionpbx_mappings', mapper.metadata, autoload_replace=True, autoload_with=db_engine)
-    dsip_lcr = Table('dsip_lcr', mapper.metadata, autoload_replace=True, autoload_with=db_engine)
-    uacreg = Table('uacreg', mapper.metadata, autoload_replace=True, autoload_with=db_engine)
-    dr_gw_lists = Table('dr_gw_lists', mapper.metadata, autoload_replace=True, autoload_with=db_engine)
-    # dr_groups = Table('dr_groups', mapper.metadata, autoload_replace=True, autoload_with=db_engine)
-    domain = Table('domain', mapper.metadata, autoload_replace=True, autoload_with=db_engine)
-    domain_attrs = Table('domain_attrs', mapper.metadata, autoload_replace=True, autoload_with=db_engine)
-    dispatcher = Table('dispatcher', mapper.metadata, autoload_replace=True, autoload_with=db_engine)
-    dsip_endpoint_lease = Table('dsip_endpoint_lease', mapper.metadata, autoload_replace=True, autoload_with=db_engine)
-    dsip_maintmode = Table('dsip_maintmode', mapper.metadata, autoload_replace=True, autoload_with=db_engine)
-    dsip_calllimit = Table('dsip_calllimit', mapper.metadata, autoload_replace=True, autoload_with=db_engine)
-    dsip_notification = Table('dsip_notification', mapper.metadata, autoload_replace=True, autoload_with=db_engine)
-    dsip_hardfwd = Table('dsip_hardfwd', mapper.metadata, autoload_replace=True, autoload_with=db_engine)
-    dsip_failfwd = Table('dsip_failfwd', mapper.metadata, autoload_replace=True, autoload_with=db_engine)
-    dsip_cdrinfo = Table('dsip_cdrinfo', mapper.metadata, autoload_replace=True, autoload_with=db_engine)
-    dsip_certificates = Table('dsip_certificates', mapper.metadata, autoload_replace=True, autoload_with=db_engine)
-    dsip_dnid_enrichment = Table('dsip_dnid_enrich_lnp', mapper.metadata, autoload_replace=True, autoload_with=db_engine)
-    dsip_user = Table('dsip_user', mapper.metadata, autoload_replace=True, autoload_with=db_engine)
+    mapper = registry(metadata=reflectTables(db_engine))
+
+    def getTable(name):
+        return mapper.metadata.tables['{}.{}'.format(mapper.metadata.schema, name)]
+
+    dr_gateways = getTable('dr_gateways')
+    address = getTable('address')
+    # inbound and outbound routes share dr_rules
+    dr_rules = getTable('dr_rules')
+    outboundroutes = dr_rules
+    inboundmapping = dr_rules
+    subscriber = getTable('subscriber')
+    dsip_domain_mapping = getTable('dsip_domain_mapping')
+    dsip_multidomain_mapping = getTable('dsip_multidomain_mapping')
+    # fusionpbx_mappings = getTable('dsip_fusionpbx_mappings')
+    dsip_lcr = getTable('dsip_lcr')
+    uacreg = getTable('uacreg')
+    dr_gw_lists = getTable('dr_gw_lists')
+    # dr_groups = getTable('dr_groups')
+    domain = getTable('domain')
+    domain_attrs = getTable('domain_attrs')
+    dispatcher = getTable('dispatcher')
+    dsip_endpoint_lease = getTable('dsip_endpoint_lease')
+    dsip_maintmode = getTable('dsip_maintmode')
+    dsip_calllimit = getTable('dsip_calllimit')
+    dsip_notification = getTable('dsip_notification')
+    dsip_hardfwd = getTable('dsip_hardfwd')
+    dsip_failfwd = getTable('dsip_failfwd')
+    dsip_cdrinfo = getTable('dsip_cdrinfo')
+    dsip_certificates = getTable('dsip_certificates')
+    dsip_dnid_enrichment = getTable('dsip_dnid_enrich_lnp')
+    dsip_user = getTable('dsip_user')
 
     # dr_gw_lists_alias = select([
     #     dr_gw_lists.c.id.label("drlist_id"),
@@ -688,6 +861,23 @@ def createSessionObjects():
     return db_engine, session_loader
 
 
+def getRulesGwgroupidSQL(alias='r'):
+    """
+    Get the SQL of the carrier / endpoint group id of a dr_rules row
+
+    The indexed gwgroupid column only exists once the v0.74 schema migration ran,
+    until then the id is computed from the gwlist, which can not use an index.
+
+    :param alias:   alias of the dr_rules table in the query
+    :type alias:    str
+    :return:        the SQL expression
+    :rtype:         str
+    """
+    if hasattr(OutboundRoutes, 'gwgroupid'):
+        return '{}.gwgroupid'.format(alias)
+    return "REPLACE({}.gwlist, '#', '')".format(alias)
+
+
 # TODO: change to the global define pattern instead of instantiating dummy objects
 class DummySession():
     """
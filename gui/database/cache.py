@@ -0,0 +1,170 @@
+# make sure the generated source files are imported instead of the template ones
+import sys
+if sys.path[0] != '/etc/dsiprouter/gui':
+    sys.path.insert(0, '/etc/dsiprouter/gui')
+
+import threading, time
+from sqlalchemy import event, inspect as sql_inspect
+from sqlalchemy.orm import Session
+from database import getDBEngine, GatewayGroups, Gateways, dSIPNotification, dSIPMultiDomainMapping
+from shared import strFieldsToDict
+
+# seconds a cached table is trusted, in case it was changed by another process
+RECORD_CACHE_TTL = 60
+
+
+class RecordCache():
+    """
+    Read-through cache of a small table, typically one whose description field holds "k:v,k:v" fields
+
+    The whole table is loaded on first use and kept as dicts keyed by primary key,
+    with the parsed description fields, if any, stored under 'fields'. Writes through the ORM
+    invalidate the cache when they are committed, the TTL covers any other writers.
+    Records are shared between callers and must not be modified.
+    """
+
+    def __init__(self, model, key, ttl=RECORD_CACHE_TTL):
+        """
+        :param model:   mapped class of the table
+        :type model:    type
+        :param key:     name of the primary key attribute, or names for a composite key
+        :type key:      str|tuple
+        :param ttl:     seconds before the table is loaded again
+        :type ttl:      int|float
+        """
+        self.model = model
+        self.key = key
+        self.ttl = ttl
+        self._records = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._records = None
+
+    def _load(self):
+        # use a separate session, the thread's session belongs to the caller
+        with Session(bind=getDBEngine()) as db:
+            records = {}
+            column_keys = [attr.key for attr in sql_inspect(self.model).column_attrs]
+            for row in db.query(self.model).all():
+                record = {key: getattr(row, key) for key in column_keys}
+                record['fields'] = strFieldsToDict(record.get('description', None) or '')
+                if isinstance(self.key, tuple):
+                    records[tuple(record[key] for key in self.key)] = record
+                else:
+                    records[record[self.key]] = record
+            return records
+
+    def _getRecords(self):
+        with self._lock:
+            if self._records is None or time.monotonic() - self._loaded_at > self.ttl:
+                self._records = self._load()
+                self._loaded_at = time.monotonic()
+            return self._records
+
+    def get(self, key, default=None):
+        """
+        Get a record by its primary key
+
+        :param key:         primary key of the record, a tuple for a composite key
+        :type key:          int|str|tuple
+        :param default:     returned if the record does not exist
+        :type default:      object
+        :return:            the record
+        :rtype:             dict
+        """
+        try:
+            key = tuple(int(k) for k in key) if isinstance(key, tuple) else int(key)
+        except (ValueError, TypeError):
+            return default
+        return self._getRecords().get(key, default)
+
+    def all(self):
+        """
+        :return:    all the records
+        :rtype:     list[dict]
+        """
+        return list(self._getRecords().values())
+
+    def filterByType(self, type):
+        """
+        Get the records with a type field in their description, equivalent to the "%type:<type>%" filter
+
+        :param type:    the type, such as settings.FLT_CARRIER or settings.FLT_PBX
+        :type type:     int|str
+        :return:        the matching records
+        :rtype:         list[dict]
+        """
+        type = str(type)
+        return [record for record in self._getRecords().values() if record['fields'].get('type', None) == type]
+
+    def getName(self, key, default=''):
+        """
+        Get the name field of a record
+
+        :param key:         primary key of the record
+        :type key:          int|str
+        :param default:     returned if the record or name does not exist
+        :type default:      str
+        :return:            the name
+        :rtype:             str
+        """
+        record = self.get(key)
+        if record is None:
+            return default
+        return record['fields'].get('name', default)
+
+
+gwgroup_cache = RecordCache(GatewayGroups, 'id')
+gateway_cache = RecordCache(Gateways, 'gwid')
+notification_cache = RecordCache(dSIPNotification, ('gwgroupid', 'type'))
+domainmapping_cache = RecordCache(dSIPMultiDomainMapping, 'pbx_id')
+_cached_models = {GatewayGroups: gwgroup_cache, Gateways: gateway_cache, dSIPNotification: notification_cache,
+                  dSIPMultiDomainMapping: domainmapping_cache}
+
+
+def invalidateGatewayCaches():
+    """
+    Drop the cached gateways, gateway groups, notifications and domain mappings, for writes that bypass the ORM
+
+    :return:    None
+    :rtype:     None
+    """
+    gwgroup_cache.invalidate()
+    gateway_cache.invalidate()
+    notification_cache.invalidate()
+    domainmapping_cache.invalidate()
+
+
+# invalidation hooks, the changed tables are tracked on the session until the transaction ends
+
+def _markChanged(session, model):
+    session.info.setdefault('changed_record_caches', set()).add(_cached_models[model])
+
+
+@event.listens_for(Session, 'after_flush')
+def _trackFlushedChanges(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if type(obj) in _cached_models:
+            _markChanged(session, type(obj))
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _trackBulkChanges(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.class_ in _cached_models:
+            _markChanged(orm_execute_state.session, mapper.class_)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidateCommittedChanges(session):
+    for cache in session.info.pop('changed_record_caches', ()):
+        cache.invalidate()
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discardRolledBackChanges(session, previous_transaction):
+    session.info.pop('changed_record_caches', None)
@@ -0,0 +1,113 @@
+# make sure the generated source files are imported instead of the template ones
+import sys
+if sys.path[0] != '/etc/dsiprouter/gui':
+    sys.path.insert(0, '/etc/dsiprouter/gui')
+
+from sqlalchemy.sql import text
+
+# key holding the lengths of all the from prefixes
+LCR_INDEX_LENGTHS_KEY = 'lengths'
+# prefix of the keys holding the to prefix lengths of a from prefix
+LCR_INDEX_FROM_KEY = 'f:'
+# number of digits each length is zero padded to, kamailio slices the lengths with fixed offsets
+LCR_INDEX_LENGTH_WIDTH = 2
+# rows inserted per statement when the index is rebuilt
+LCR_INDEX_INSERT_CHUNK_SIZE = 1000
+
+
+def encodeLengths(lengths):
+    return ''.join('{:0{}d}'.format(length, LCR_INDEX_LENGTH_WIDTH) for length in sorted(lengths, reverse=True))
+
+
+def buildLCRIndex(rules):
+    """
+    Build the longest prefix match index of the LCR rules
+
+    For each from prefix the index holds the lengths of its to prefixes, longest first,
+    and a single key holds the lengths of the from prefixes. Kamailio walks the from lengths,
+    slices the caller with each of them and only checks the to prefixes that exist for that
+    from prefix, so a lookup costs a bounded number of htable gets whatever the number of rules.
+
+    :param rules:   the (pattern, from_prefix) of the dsip_lcr rows, the pattern being "<from_prefix>-<to_prefix>"
+    :type rules:    iterable
+    :return:        the index rows, by key
+    :rtype:         dict
+    """
+    to_lengths = {}
+    for pattern, from_prefix in rules:
+        # kamailio can not slice a prefix of length 0, the GUI always requires a from prefix
+        if len(from_prefix) == 0 or not pattern.startswith(from_prefix + '-'):
+            continue
+        to_lengths.setdefault(from_prefix, set()).add(len(pattern) - len(from_prefix) - 1)
+
+    max_length = 10 ** LCR_INDEX_LENGTH_WIDTH - 1
+    index = {}
+    for from_prefix, lengths in to_lengths.items():
+        if len(from_prefix) > max_length or max(lengths) > max_length:
+            continue
+        index[LCR_INDEX_FROM_KEY + from_prefix] = encodeLengths(lengths)
+    index[LCR_INDEX_LENGTHS_KEY] = encodeLengths(
+        {len(key) - len(LCR_INDEX_FROM_KEY) for key in index})
+    return index
+
+
+def lookupLCRIndex(index, patterns, from_user, to_user):
+    """
+    Resolve the LCR rule of a call from the index, the same way kamailio does
+
+    :param index:       the index, as returned by :func:`buildLCRIndex`
+    :type index:        dict
+    :param patterns:    the carrier group of each pattern
+    :type patterns:     dict
+    :param from_user:   the caller
+    :type from_user:    str
+    :param to_user:     the callee
+    :type to_user:      str
+    :return:            the carrier group of the longest matching rule, None when no rule matches
+    :rtype:             str|None
+    """
+    match, match_length = None, -1
+    from_lengths = index.get(LCR_INDEX_LENGTHS_KEY, '')
+    for i in range(0, len(from_lengths), LCR_INDEX_LENGTH_WIDTH):
+        from_length = int(from_lengths[i:i + LCR_INDEX_LENGTH_WIDTH])
+        if from_length > len(from_user):
+            continue
+        from_prefix = from_user[:from_length]
+        to_lengths = index.get(LCR_INDEX_FROM_KEY + from_prefix, None)
+        if to_lengths is None:
+            continue
+        for j in range(0, len(to_lengths), LCR_INDEX_LENGTH_WIDTH):
+            to_length = int(to_lengths[j:j + LCR_INDEX_LENGTH_WIDTH])
+            if to_length > len(to_user):
+                continue
+            # the to lengths are sorted, the first match is the longest of this from prefix
+            pattern = from_prefix + '-' + to_user[:to_length]
+            if pattern in patterns:
+                if from_length + to_length > match_length:
+                    match, match_length = patterns[pattern], from_length + to_length
+                break
+    return match
+
+
+def updateLCRIndex(db):
+    """
+    Rebuild dsip_lcr_index, the index kamailio loads into the lcrindex htable, from dsip_lcr
+
+    Runs in the caller's transaction, so the index is committed along with the rule changes.
+    The lcrindex htable is reloaded with the tofromprefix htable.
+
+    :param db:      session the dsip_lcr changes were made in
+    :type db:       :class:`sqlalchemy.orm.Session`
+    :return:        number of index rows
+    :rtype:         int
+    """
+    db.flush()
+    rules = db.execute(text('SELECT pattern, from_prefix FROM dsip_lcr')).all()
+    index = buildLCRIndex(rules)
+
+    db.execute(text('DELETE FROM dsip_lcr_index'))
+    rows = [{'key_name': key, 'key_value': value} for key, value in index.items()]
+    for i in range(0, len(rows), LCR_INDEX_INSERT_CHUNK_SIZE):
+        db.execute(text('INSERT INTO dsip_lcr_index (key_name, key_value) VALUES (:key_name, :key_value)'),
+                   rows[i:i + LCR_INDEX_INSERT_CHUNK_SIZE])
+    return len(rows)
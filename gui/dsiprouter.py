@@ -8,12 +8,11 @@ if sys.path[0] != '/etc/dsiprouter/gui':
 import os, json, urllib.parse, glob, datetime, csv, logging, signal, bjoern, secrets, subprocess, time
 from ansi2html import Ansi2HTMLConverter
 from copy import copy
-from importlib import reload
 from flask import Flask, render_template, request, redirect, flash, session, url_for, send_from_directory, Blueprint, Response
 from flask_wtf.csrf import CSRFProtect
 from itsdangerous import URLSafeTimedSerializer
 from pygtail import Pygtail
-from sqlalchemy import func, exc as sql_exceptions
+from sqlalchemy import exc as sql_exceptions
 from sqlalchemy.orm import load_only
 from sqlalchemy.sql import text
 from sqlalchemy.orm.session import close_all_sessions
@@ -25,7 +24,7 @@ from shared import updateConfig, getCustomRoutes, debugException, debugEndpoint,
     stripDictVals, strFieldsToDict, dictToStrFields, allowed_file, showError, IO, objToDict, StatusCodes
 from util.networking import safeUriToHost, safeFormatSipUri, safeStripPort
 from database import DummySession, createSessionObjects, startSession, \
-    DB_ENGINE_NAME, SESSION_LOADER_NAME, settingsToTableFormat, getDsipSettingsTableAsDict, \
+    settingsToTableFormat, getDsipSettingsTableAsDict, \
     Gateways, Address, InboundMapping, OutboundRoutes, Subscribers, dSIPLCR, UAC, GatewayGroups, \
     Domain, DomainAttrs, dSIPMultiDomainMapping, dSIPHardFwd, dSIPFailFwd, updateDsipSettingsTable
 from modules import flowroute
@@ -33,15 +32,19 @@ from modules.domain.domain_routes import domains
 from modules.api.api_routes import api
 from modules.api.mediaserver.routes import mediaserver
 from modules.api.carriergroups.routes import carriergroups, addCarrierGroups
-from modules.api.kamailio.functions import reloadKamailio
+from modules.api.kamailio.functions import reloadKamailio, markKamailioReloadRequired
+from database.cache import gwgroup_cache
+from database.lcr import updateLCRIndex
+from modules.api.inboundmapping.functions import importInboundMappings
 from modules.api.licensemanager.functions import WoocommerceError, licenseToGlobalStateVariable
 from modules.api.licensemanager.routes import license_manager
 from modules.api.auth.routes import user
 from util.security import Credentials, urandomChars, AES_CTR
-from util.ipc import SETTINGS_SHMEM_NAME, STATE_SHMEM_NAME, createSharedMemoryDict, getSharedMemoryDict
+from util.ipc import SETTINGS_SHMEM_NAME, STATE_SHMEM_NAME, createSharedMemoryDict, getSharedMemoryDict, updateSharedMemoryDict
 from util.parse_json import CreateEncoder
 from util.persistence import updatePersistentState, setPersistentState
 from util.pyasync import process
+from util.settings_store import getSettingsStore
 from modules.upgrade import UpdateUtils
 import settings
 
@@ -65,6 +68,9 @@ UPGRADE_OFFSET = f'{UPGRADE_LOG}.offset'
 
 # module variables
 app = Flask(__name__, static_folder="./static", static_url_path="/static")
+settings_store = getSettingsStore(settings)
+# the dsip_settings fields last written to the table, the table is only updated when they change
+synced_settings_fields = None
 app.register_blueprint(domains)
 app.register_blueprint(api)
 app.register_blueprint(mediaserver)
@@ -418,7 +424,7 @@ def addUpdateCarrierGroups():
                     db.query(Address).filter(Address.tag.contains("name:{}-uac".format(name))).delete(synchronize_session=False)
 
         db.commit()
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+        markKamailioReloadRequired('drouting', 'gw2gwgroup', 'gwgroup2lb', 'permissions', 'uac')
         return displayCarrierGroups()
 
     except sql_exceptions.SQLAlchemyError as ex:
@@ -481,7 +487,7 @@ def deleteCarrierGroups():
         Gwgroup.delete(synchronize_session=False)
 
         db.commit()
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+        markKamailioReloadRequired('drouting', 'gw2gwgroup', 'gwgroup2lb', 'permissions', 'uac')
         return displayCarrierGroups()
 
     except sql_exceptions.SQLAlchemyError as ex:
@@ -701,7 +707,7 @@ def addUpdateCarriers():
             Gateway.description = dictToStrFields(gw_fields)
 
         db.commit()
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+        markKamailioReloadRequired('drouting', 'gw2gwgroup', 'permissions')
         return displayCarriers(gwgroup=gwgroup, newgwid=newgwid)
 
     except sql_exceptions.SQLAlchemyError as ex:
@@ -788,7 +794,7 @@ def deleteCarriers():
                 rule.gwlist = ','.join(gwlist)
 
         db.commit()
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+        markKamailioReloadRequired('drouting', 'gw2gwgroup', 'permissions', 'dr_rules')
         return displayCarriers(gwgroup=gwgroup)
 
     except sql_exceptions.SQLAlchemyError as ex:
@@ -960,7 +966,7 @@ def addUpdateEndpointGroups():
             db.add(Gwgroup)
             db.commit()
 
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+        markKamailioReloadRequired('drouting', 'gw2gwgroup', 'gwgroup2lb', 'domain')
         return displayEndpointGroups()
 
     except sql_exceptions.SQLAlchemyError as ex:
@@ -1019,7 +1025,16 @@ def deletePBX():
         domainmultimapping = db.query(dSIPMultiDomainMapping).filter(dSIPMultiDomainMapping.pbx_id == gwid)
         res = domainmultimapping.options(load_only("domain_list", "attr_list")).first()
         if res is not None:
-            # make sure mapping has domains
+            # the domains synced from the PBX are tagged with a created_by attribute
+            did_list = db.execute(
+                text("SELECT DISTINCT did FROM domain_attrs WHERE name='created_by' AND value=:pbx_id"),
+                {'pbx_id': str(gwid)}
+            ).scalars().all()
+            if len(did_list) > 0:
+                db.query(Domain).filter(Domain.did.in_(did_list)).delete(synchronize_session=False)
+                db.query(DomainAttrs).filter(DomainAttrs.did.in_(did_list)).delete(synchronize_session=False)
+
+            # mappings created before the sync tagged its domains list them instead
             if len(res.domain_list) > 0:
                 domains = list(map(int, filter(None, res.domain_list.split(","))))
                 domain = db.query(Domain).filter(Domain.id.in_(domains))
@@ -1030,11 +1045,12 @@ def deletePBX():
                 domainattrs = db.query(DomainAttrs).filter(DomainAttrs.id.in_(attrs))
                 domainattrs.delete(synchronize_session=False)
 
-            # delete the entry in the multi domain mapping table
+            # delete the entry in the multi domain mapping table, which will stop the fusionpbx sync
             domainmultimapping.delete(synchronize_session=False)
+            db.execute(text("DELETE FROM dsip_multidomain_sync WHERE pbx_id=:pbx_id"), {'pbx_id': gwid})
 
         db.commit()
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+        markKamailioReloadRequired('drouting', 'gw2gwgroup', 'permissions', 'domain')
         return displayEndpointGroups()
 
     except sql_exceptions.SQLAlchemyError as ex:
@@ -1081,20 +1097,7 @@ def displayInboundMapping():
         endpoint_filter = "%type:{}%".format(settings.FLT_PBX)
         carrier_filter = "%type:{}%".format(settings.FLT_CARRIER)
 
-        res = db.execute(
-            text("""
-SELECT * FROM (
-    SELECT r.ruleid, r.groupid, r.prefix, r.gwlist, r.description AS rule_description, g.id AS gwgroupid, g.description AS gwgroup_description FROM dr_rules AS r LEFT JOIN dr_gw_lists AS g ON g.id = REPLACE(r.gwlist, '#', '') WHERE r.groupid = :flt_inbound
-) AS t1 LEFT JOIN (
-    SELECT hf.dr_ruleid AS hf_ruleid, hf.dr_groupid AS hf_groupid, hf.did AS hf_fwddid, g.id AS hf_gwgroupid FROM dsip_hardfwd AS hf LEFT JOIN dr_rules AS r ON hf.dr_groupid = r.groupid LEFT JOIN dr_gw_lists AS g ON g.id = REPLACE(r.gwlist, '#', '') WHERE hf.dr_groupid <> :flt_outbound
-    UNION ALL
-    SELECT hf.dr_ruleid AS hf_ruleid, hf.dr_groupid AS hf_groupid, hf.did AS hf_fwddid, NULL AS hf_gwgroupid FROM dsip_hardfwd AS hf LEFT JOIN dr_rules AS r ON hf.dr_ruleid = r.ruleid WHERE hf.dr_groupid = :flt_outbound
-) AS t2 ON t1.ruleid = t2.hf_ruleid LEFT JOIN (
-    SELECT ff.dr_ruleid AS ff_ruleid, ff.dr_groupid AS ff_groupid, ff.did AS ff_fwddid, g.id AS ff_gwgroupid FROM dsip_failfwd AS ff LEFT JOIN dr_rules AS r ON ff.dr_groupid = r.groupid LEFT JOIN dr_gw_lists AS g ON g.id = REPLACE(r.gwlist, '#', '') WHERE ff.dr_groupid <> :flt_outbound
-    UNION ALL
-    SELECT ff.dr_ruleid AS ff_ruleid, ff.dr_groupid AS ff_groupid, ff.did AS ff_fwddid, NULL AS ff_gwgroupid FROM dsip_failfwd AS ff LEFT JOIN dr_rules AS r ON ff.dr_ruleid = r.ruleid WHERE ff.dr_groupid = :flt_outbound
-) AS t3 ON t1.ruleid = t3.ff_ruleid"""), {"flt_inbound": settings.FLT_INBOUND, "flt_outbound": settings.FLT_OUTBOUND})
-
+        # the rules are paged in by the table from /api/v1/inboundmapping/rows
         epgroups = db.query(GatewayGroups).filter(GatewayGroups.description.like(endpoint_filter)).all()
         gwgroups = db.query(GatewayGroups).filter(
             (GatewayGroups.description.like(endpoint_filter)) | (GatewayGroups.description.like(carrier_filter))).all()
@@ -1114,7 +1117,7 @@ SELECT * FROM (
                 debugException(ex)
                 return showError(type="http", code=ex.status_code, msg="Flowroute Credentials Not Valid")
 
-        return render_template('inboundmapping.html', rows=res, gwgroups=gwgroups, epgroups=epgroups, imported_dids=dids, gatewayList=gatewayList)
+        return render_template('inboundmapping.html', gwgroups=gwgroups, epgroups=epgroups, imported_dids=dids, gatewayList=gatewayList)
 
     except sql_exceptions.SQLAlchemyError as ex:
         debugException(ex)
@@ -1503,7 +1506,7 @@ def addUpdateInboundMapping():
                 db.add_all(inserts)
 
         db.commit()
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+        markKamailioReloadRequired('drouting', 'dr_rules', 'inbound_prefixmap', 'inbound_hardfwd', 'inbound_failfwd')
         return displayInboundMapping()
 
     except sql_exceptions.SQLAlchemyError as ex:
@@ -1585,7 +1588,7 @@ def deleteInboundMapping():
 
         db.commit()
 
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+        markKamailioReloadRequired('drouting', 'dr_rules', 'inbound_prefixmap', 'inbound_hardfwd', 'inbound_failfwd')
         return displayInboundMapping()
 
     except sql_exceptions.SQLAlchemyError as ex:
@@ -1611,50 +1614,24 @@ def deleteInboundMapping():
 
 
 def processInboundMappingImport(filename, override_gwgroupid, name, db):
-    try:
-        # Adding
-        f = open(os.path.join(settings.UPLOAD_FOLDER, filename))
-        csv_f = csv.reader(f)
-
-        for row in csv_f:
-            # skip header if present
-            if row[0].startswith("#"):
-                continue
-
-            prefix = row[0]
-            if len(row) > 0:
-                if override_gwgroupid is not None:
-                    gwgroupid = override_gwgroupid
-                else:
-                    gwgroupid = '#{}'.format(row[1]) if '#' not in row[1] else row[1]
-            if len(row) > 1:
-                description = 'name:{}'.format(row[2])
-            else:
-                description = 'name:{}'.format(name)
-
-            IMap = InboundMapping(settings.FLT_INBOUND, prefix, gwgroupid, description)
-            db.add(IMap)
-
-        db.commit()
-
-    except sql_exceptions.SQLAlchemyError as ex:
-        debugException(ex)
-        error = "db"
-        db.rollback()
-        db.flush()
-        return showError(type=error)
-    except http_exceptions.HTTPException as ex:
-        debugException(ex)
-        error = "http"
-        db.rollback()
-        db.flush()
-        return showError(type=error)
-    except Exception as ex:
-        debugException(ex)
-        error = "server"
-        db.rollback()
-        db.flush()
-        return showError(type=error)
+    """
+    Import the inbound mappings from an uploaded csv file
+
+    :param filename:            name of the file in the upload folder
+    :type filename:             str
+    :param override_gwgroupid:  endpoint group to map all DIDs to
+    :type override_gwgroupid:   str|None
+    :param name:                name to use for rows without a name
+    :type name:                 str|None
+    :param db:                  session to import with
+    :type db:                   sqlalchemy.orm.Session
+    :return:                    the import report
+    :rtype:                     dict
+    """
+    with open(os.path.join(settings.UPLOAD_FOLDER, filename), 'r', newline='') as f:
+        report = importInboundMappings(csv.reader(f), db, override_gwgroupid, name)
+    db.commit()
+    return report
 
 
 @app.route('/inboundmappingimport', methods=['POST'])
@@ -1687,9 +1664,9 @@ def importInboundMapping():
         if file and allowed_file(file.filename, ALLOWED_EXTENSIONS=set(['csv'])):
             filename = secure_filename(file.filename)
             file.save(os.path.join(settings.UPLOAD_FOLDER, filename))
-            processInboundMappingImport(filename, gwgroupid, None, db)
-            flash('X number of file were imported')
-            getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+            report = processInboundMappingImport(filename, gwgroupid, None, db)
+            flash('{} DIDs were imported, {} were rejected'.format(report['accepted'], report['rejected']))
+            markKamailioReloadRequired('drouting', 'dr_rules', 'inbound_prefixmap')
             return redirect(url_for('displayInboundMapping', filename=filename))
 
     except sql_exceptions.SQLAlchemyError as ex:
@@ -1771,7 +1748,7 @@ def addUpdateTeleBlock():
 
         updateConfig(settings, teleblock, hot_reload=True)
 
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+        markKamailioReloadRequired('cfg')
         return displayTeleBlock()
 
     except http_exceptions.HTTPException as ex:
@@ -1871,7 +1848,7 @@ def addUpdateTransNexus():
 
         if len(tn_settings) != 0:
             updateConfig(settings, tn_settings, hot_reload=True)
-            getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+            markKamailioReloadRequired('cfg')
 
         return displayTransNexus()
 
@@ -1906,23 +1883,10 @@ def displayOutboundRoutes():
 
         db = startSession()
 
-        carrier_filter = "%type:{}%".format(settings.FLT_CARRIER)
-
-        rows = db.query(OutboundRoutes).filter(
-            (OutboundRoutes.groupid == settings.FLT_OUTBOUND) |
-            ((OutboundRoutes.groupid >= settings.FLT_LCR_MIN) &
-             (OutboundRoutes.groupid < settings.FLT_FWD_MIN))).outerjoin(
-            dSIPLCR, dSIPLCR.dr_groupid == OutboundRoutes.groupid).outerjoin(
-            GatewayGroups, func.REPLACE(OutboundRoutes.gwlist, '#', '') == GatewayGroups.id).add_columns(
-            dSIPLCR.from_prefix, dSIPLCR.cost, dSIPLCR.dr_groupid, OutboundRoutes.ruleid,
-            OutboundRoutes.prefix, OutboundRoutes.routeid, func.REPLACE(OutboundRoutes.gwlist, '#', '').label('gwgroupid'),
-            OutboundRoutes.timerec, OutboundRoutes.priority, OutboundRoutes.description,
-            GatewayGroups.description.label('gwgroup_description'), GatewayGroups.gwlist)
-
-        cgroups = db.query(GatewayGroups).filter(GatewayGroups.description.like(carrier_filter)).all()
+        # the routes are paged in by the table from /api/v1/outboundroutes/rows
 
         # sort carrier groups by name
-        cgroups.sort(key=lambda x: strFieldsToDict(x.description)['name'].lower())
+        cgroups = sorted(gwgroup_cache.filterByType(settings.FLT_CARRIER), key=lambda x: x['fields'].get('name', '').lower())
 
         teleblock = {}
         teleblock["gw_enabled"] = settings.TELEBLOCK_GW_ENABLED
@@ -1931,7 +1895,7 @@ def displayOutboundRoutes():
         teleblock["media_ip"] = settings.TELEBLOCK_MEDIA_IP
         teleblock["media_port"] = settings.TELEBLOCK_MEDIA_PORT
 
-        return render_template('outboundroutes.html', rows=rows, cgroups=cgroups, teleblock=teleblock,
+        return render_template('outboundroutes.html', cgroups=cgroups, teleblock=teleblock,
             custom_routes=getCustomRoutes())
 
     except sql_exceptions.SQLAlchemyError as ex:
@@ -2099,8 +2063,9 @@ def addUpateOutboundRoutes():
                     'routeid': routeid, 'gwlist': gwlist, 'description': description
                 }, synchronize_session=False)
 
+        updateLCRIndex(db)
         db.commit()
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+        markKamailioReloadRequired('drouting', 'dr_rules', 'tofromprefix')
         return displayOutboundRoutes()
 
     except sql_exceptions.SQLAlchemyError as ex:
@@ -2156,9 +2121,10 @@ def deleteOutboundRoute():
         d = db.query(OutboundRoutes).filter(OutboundRoutes.ruleid == ruleid)
         d.delete(synchronize_session=False)
 
+        updateLCRIndex(db)
         db.commit()
 
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+        markKamailioReloadRequired('drouting', 'dr_rules', 'tofromprefix')
         return displayOutboundRoutes()
 
     except sql_exceptions.SQLAlchemyError as ex:
@@ -2283,7 +2249,7 @@ def addUpdateStirShaken():
 
         if len(ss_settings) != 0:
             updateConfig(settings, ss_settings, hot_reload=True)
-            getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+            markKamailioReloadRequired('cfg')
 
         return displayStirShaken()
 
@@ -2600,17 +2566,22 @@ def syncSettings(new_fields={}, update_net=False):
     """
     Synchronize settings.py with shared mem / db
 
+    Only the settings that changed are applied to the loaded settings module and
+    written to shared memory, settings.py is only re-imported when it changed on disk.
+
     :param new_fields:      fields to override when syncing
     :type new_fields:       dict
     :return:                None
     :rtype:                 None
     """
+    global synced_settings_fields
 
+    reloaded = False
     try:
         # sync settings from settings.py
         if settings.LOAD_SETTINGS_FROM == 'file' or settings.DSIP_ID is None:
             # need to grab any changes on disk b4 merging
-            reload(settings)
+            reloaded = settings_store.reloadIfStale()
 
         # if DSIP_ID is not set, generate it
         if settings.DSIP_ID is None:
@@ -2629,8 +2600,10 @@ def syncSettings(new_fields={}, update_net=False):
             fields = settingsToTableFormat(settings)
             fields.update(new_fields)
 
-            # update the table
-            updateDsipSettingsTable(fields)
+            # update the table, unless it already holds these values
+            if dict(fields) != synced_settings_fields:
+                updateDsipSettingsTable(fields)
+                synced_settings_fields = dict(fields)
 
             # revert db specific fields
             if ',' in fields['KAM_DB_HOST']:
@@ -2648,10 +2621,14 @@ def syncSettings(new_fields={}, update_net=False):
         else:
             raise ValueError('invalid value for LOAD_SETTINGS_FROM, acceptable values: "file" or "db"')
 
-        # update and reload settings file
+        # update settings file and the loaded settings
         if len(fields) > 0:
             updateConfig(settings, fields, hot_reload=True)
 
+        # settings.py was changed on disk, the other processes need all of it
+        if reloaded:
+            updateSharedMemoryDict(SETTINGS_SHMEM_NAME, objToDict(settings))
+
     except sql_exceptions.SQLAlchemyError as ex:
         debugException(ex)
         IO.printerr('Could Not Update dsip_settings Database Table')
@@ -2756,6 +2733,7 @@ def intializeGlobalState():
     state['transnexus_license_status'] = licenseToGlobalStateVariable(settings.DSIP_TRANSNEXUS_LICENSE)
     state['msteams_license_status'] = licenseToGlobalStateVariable(settings.DSIP_MSTEAMS_LICENSE)
     state['kam_reload_required'] = state.get('kam_reload_required', False)
+    state['kam_reload_pending'] = state.get('kam_reload_pending', [])
     state['dsip_reload_required'] = state.get('dsip_reload_required', False)
     state['dsip_reload_ongoing'] = state.get('dsip_reload_ongoing', False)
     state['dsip_upgrade_ongoing'] = state.get('dsip_upgrade_ongoing', False)
@@ -2770,8 +2748,6 @@ def initApp(flask_app):
     # load the DB objects into memory
     global global_db_engine, global_session_loader
     global_db_engine, global_session_loader = createSessionObjects()
-    # make sure we did not break the global naming contract with the database module
-    assert DB_ENGINE_NAME in globals() and SESSION_LOADER_NAME in globals()
 
     # Setup the Flask session manager with a random secret key
     if settings.DSIP_SESSION_KEY is None:
@@ -2798,6 +2774,17 @@ def initApp(flask_app):
     # Dynamically update settings
     intializeGlobalSettings()
 
+    # the LCR index may be missing or stale after a restore or an upgrade, rebuild it before kamailio loads it
+    db = startSession()
+    try:
+        updateLCRIndex(db)
+        db.commit()
+    except Exception as ex:
+        IO.logwarn('could not rebuild the LCR index: {}'.format(str(ex)))
+        db.rollback()
+    finally:
+        db.close()
+
     # Reload Kamailio with the settings from dSIPRouter settings config
     reloadKamailio()
 
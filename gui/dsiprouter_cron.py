@@ -10,7 +10,12 @@
 #   fusionpbx
 # supported commands:
 #   api         -   cleanleases
+#   cdr         -   sendreports
 #   cdr         -   sendreport <gwgroupid>
+#   cdr         -   consolidate
+#   cdr         -   rate [<rate_group>]
+#   cdr         -   rollup
+#   cdr         -   lifecycle
 #   fusionpbx   -   sync
 #
 
@@ -31,11 +36,32 @@ if __name__ == '__main__':
             sys.exit(0)
 
     elif mod == 'cdr':
-        if cmd == 'sendreport' and len(args) > 0:
+        if cmd == 'sendreports':
+            from modules.cdr.reports import sendCDRReports
+            sendCDRReports()
+            sys.exit(0)
+        elif cmd == 'sendreport' and len(args) > 0:
             from modules.cdr.cron_functions import sendCdrReport
             gwgroupid = args[0]
             sendCdrReport(gwgroupid)
             sys.exit(0)
+        elif cmd == 'consolidate':
+            from modules.cdr.functions import consolidateCDRS
+            consolidateCDRS()
+            sys.exit(0)
+        elif cmd == 'rate':
+            from modules.cdr.functions import rateCDRS, CDR_RATING_DEFAULT_GROUP
+            rate_group = args[0] if len(args) > 0 else CDR_RATING_DEFAULT_GROUP
+            rateCDRS(rate_group)
+            sys.exit(0)
+        elif cmd == 'rollup':
+            from modules.cdr.functions import rollupCDRS
+            rollupCDRS()
+            sys.exit(0)
+        elif cmd == 'lifecycle':
+            from modules.cdr.lifecycle import manageCDRLifecycle
+            manageCDRLifecycle()
+            sys.exit(0)
 
     elif mod == 'fusionpbx':
         if cmd == 'sync':
@@ -4,29 +4,38 @@ import sys
 if sys.path[0] != '/etc/dsiprouter/gui':
     sys.path.insert(0, '/etc/dsiprouter/gui')
 
-import os, time, random, subprocess, requests, csv, base64, codecs, re, socket, json
+import os, io, time, random, subprocess, requests, csv, base64, codecs, re, socket, json
 from contextlib import closing
 from datetime import datetime
-from flask import Blueprint, jsonify, request, send_file, g
+from flask import Blueprint, jsonify, request, send_file, g, Response, stream_with_context
 from sqlalchemy import exc as sql_exceptions, and_, or_
 from sqlalchemy.sql import text
 from werkzeug import exceptions as http_exceptions
 from werkzeug.utils import secure_filename
 from database import startSession, DummySession, Address, dSIPNotification, dSIPMultiDomainMapping, Gateways, \
     GatewayGroups, Subscribers, dSIPLeases, dSIPMaintModes, dSIPCallLimits, InboundMapping, dSIPCDRInfo, \
-    dSIPCertificates, Dispatcher, dSIPDNIDEnrichment
+    dSIPCertificates, Dispatcher, dSIPDNIDEnrichment, invalidateSchemaCache
+from database.cache import gwgroup_cache, notification_cache, invalidateGatewayCaches
 from shared import allowed_file, dictToStrFields, isCertValid, rowToDict, debugEndpoint, StatusCodes, \
     strFieldsToDict, getRequestData, IO
 from util.pyasync import daemonize
 from util.ipc import STATE_SHMEM_NAME, getSharedMemoryDict
 from modules.api.api_functions import createApiResponse, showApiError
-from modules.api.kamailio.functions import reloadKamailio
+from modules.api.kamailio.functions import reloadKamailio, markKamailioReloadRequired, getPendingKamailioReloads, \
+    clearKamailioReloadRequired, pushHtableUpdates, KAM_RELOAD_ALL
+from modules.api.kamailio.rpc import getKamRPCClient
+from modules.cdr.functions import CDR_SOURCE_CDRS, CDR_SOURCE_ACC, getCDRSummary, buildCDRQuery, buildCDRKeysetFilter, \
+    cdrRowToDict, streamCDRS
+from modules.api.notification.functions import alert_aggregator
+from modules.api.inboundmapping.functions import importInboundMappings, createInboundMappings, updateInboundMappings, \
+    deleteInboundMappings, getInboundMappingsPage
+from modules.api.outboundroutes.functions import importOutboundRoutes, reloadOutboundRoutes, getOutboundRoutesPage
 from util.networking import getExternalIP, hostToIP, safeUriToHost, safeStripPort
-from util.notifications import sendEmail
+from util.notifications import sendEmail, email_dispatcher
 from util.security import AES_CTR, urandomChars, KeyCertPair, api_security
 from util.file_handling import change_owner
 from util import kamtls, letsencrypt
-from util.cron import addTaggedCronjob, updateTaggedCronjob, deleteTaggedCronjob
+from util.cron import deleteTaggedCronjob, isValidCronInterval
 import settings
 
 api = Blueprint('api', __name__)
@@ -42,35 +51,49 @@ def getKamailioStats():
         if (settings.DEBUG):
             debugEndpoint()
 
-        jsonrpc_payload = {"jsonrpc": "2.0", "method": "tm.stats", "id": 1}
-        r = requests.get('http://127.0.0.1:5060/api/kamailio', json=jsonrpc_payload)
-        if r.status_code >= 400:
-            ex = http_exceptions.HTTPException(r.reason)
-            ex.code = r.status_code
-            raise ex
-
         return createApiResponse(
             msg='Successfully retrieved kamailio stats',
-            data=[r.json()['result']],
+            data=[getKamRPCClient().call('tm.stats')],
         )
 
     except Exception as ex:
         return showApiError(ex)
 
 
-@api.route("/api/v1/reload/kamailio", methods=['POST'])
+@api.route("/api/v1/reload/kamailio", methods=['GET', 'POST'])
 @api_security
 def handleReloadKamailio():
+    """
+    Get the kamailio resources waiting to be reloaded or reload them
+
+    A POST reloads everything, as it always did, so it also picks up changes made outside of dSIPRouter.
+    With the incremental query arg set only the resources changed since the last reload are reloaded,
+    in which case nothing is sent to kamailio when nothing is pending.
+    """
     try:
         if (settings.DEBUG):
             debugEndpoint()
 
-        reloadKamailio()
+        if request.method == 'GET':
+            return createApiResponse(
+                msg='Pending kamailio reloads retrieved',
+                data=getPendingKamailioReloads(),
+            )
+
+        # clear before reloading so changes made during the reload stay pending
+        pending = clearKamailioReloadRequired()
+        if request.args.get('incremental', 'false').lower() != 'true':
+            pending = None
+        try:
+            reloadKamailio(pending)
+        except Exception:
+            markKamailioReloadRequired(*[resource for resource in (pending or []) if resource != KAM_RELOAD_ALL])
+            raise
 
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = False
         return createApiResponse(
             msg='Kamailio reload succeeded',
-            kamreload=False,
+            data=pending if pending is not None else [KAM_RELOAD_ALL],
+            kamreload=getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'],
         )
 
     except Exception as ex:
@@ -107,7 +130,7 @@ def handleReloadDsiprouter():
 
             # update globals before we reload so server stores them on teardown
             getSharedMemoryDict(STATE_SHMEM_NAME)['dsip_reload_ongoing'] = True
-            getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = False
+            clearKamailioReloadRequired()
             getSharedMemoryDict(STATE_SHMEM_NAME)['dsip_reload_required'] = False
 
             daemonize(['sudo', 'dsiprouter', 'restart', '-all', '-daemonize'])
@@ -193,7 +216,7 @@ def getEndpointLease():
 
         db.commit()
 
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+        markKamailioReloadRequired('drouting', 'gw2gwgroup')
         return createApiResponse(
             msg='Lease created',
             data=[lease_data],
@@ -235,7 +258,7 @@ def revokeEndpointLease(leaseid):
 
         db.commit()
 
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+        markKamailioReloadRequired('drouting', 'gw2gwgroup')
         return createApiResponse(
             msg='Lease revoked',
             kamreload=True,
@@ -281,7 +304,7 @@ def updateEndpoint(id):
 
         db.commit()
 
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+        markKamailioReloadRequired('drouting', 'gw2gwgroup', 'maintmode')
         return createApiResponse(
             msg='Endpoint updated',
             kamreload=True,
@@ -300,12 +323,68 @@ def updateEndpoint(id):
         db.close()
 
 
+def inboundMappingHtableUpdates(db, old_rules, new_rules):
+    """
+    Build the kamailio htable changes for inbound mapping rules that were changed
+
+    The htables mirror the dsip_prefix_mapping view and the dr_rules table,
+    which are keyed by the prefix of the rule. The dr_rules htable only exists when
+    STIR/SHAKEN is enabled and is shared with the outbound rules, so a removed prefix
+    is pointed at the dr_rules row left with that prefix instead of being deleted.
+
+    :param db:          session the changes were committed with
+    :type db:           :class:`sqlalchemy.orm.Session`
+    :param old_rules:   (ruleid, prefix, priority) of the rules before the change
+    :type old_rules:    list
+    :param new_rules:   the rules after the change
+    :type new_rules:    list[InboundMapping]
+    :return:            list of (htable, key, value) tuples for :func:`pushHtableUpdates`
+    :rtype:             list
+    """
+    updates = []
+    new_prefixes = {rule.prefix for rule in new_rules}
+
+    for _, prefix, _ in old_rules:
+        if prefix not in new_prefixes:
+            updates.append(('inbound_prefixmap', prefix, None))
+            if settings.STIR_SHAKEN_ENABLED:
+                remaining = db.query(InboundMapping.ruleid).filter(InboundMapping.prefix == prefix).order_by(
+                    InboundMapping.ruleid.desc()).first()
+                updates.append(('dr_rules', prefix, str(remaining[0]) if remaining is not None else None))
+    for rule in new_rules:
+        updates.append(('inbound_prefixmap', rule.prefix, '{},{}'.format(rule.ruleid, rule.priority)))
+        if settings.STIR_SHAKEN_ENABLED:
+            updates.append(('dr_rules', rule.prefix, str(rule.ruleid)))
+
+    return updates
+
+
 # TODO: we should optimize this and cleanup reused code
 @api.route("/api/v1/inboundmapping", methods=['GET', 'POST', 'PUT', 'DELETE'])
 @api_security
 def handleInboundMapping():
     """
     Endpoint for Inbound DID Rule Mapping
+
+    POST, PUT and DELETE also accept an array of rules as the request body,
+    the whole batch is validated and applied in a single transaction.
+
+    ===============
+    Request Payload
+    ===============
+
+    .. code-block:: json
+
+        [
+            {
+                did: <string>,
+                servers: [<string>,<string>],
+                name: <string>
+            },
+            ...
+        ]
+
+    PUT items require the ruleid of the rule to update, DELETE items require either a ruleid or a did.
     """
 
     db = DummySession()
@@ -389,6 +468,15 @@ def handleInboundMapping():
         elif request.method == "POST":
             data = getRequestData()
 
+            # create a batch of rules in a single transaction
+            if isinstance(data, list):
+                payload['data'] = createInboundMappings(data, db)
+                db.commit()
+                markKamailioReloadRequired('drouting', 'dr_rules', 'inbound_prefixmap')
+                payload['kamreload'] = True
+                payload['msg'] = 'Rules Created'
+                return createApiResponse(**payload)
+
             # sanity checks
             for arg in data:
                 if arg not in VALID_REQUEST_DATA_ARGS:
@@ -426,7 +514,8 @@ def handleInboundMapping():
             db.add(IMap)
 
             db.commit()
-            getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+            pushHtableUpdates(inboundMappingHtableUpdates(db, [], [IMap]))
+            markKamailioReloadRequired('drouting')
             payload['kamreload'] = getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required']
             payload['msg'] = 'Rule Created'
             return createApiResponse(**payload)
@@ -443,6 +532,15 @@ def handleInboundMapping():
             data = getRequestData()
             updates = {}
 
+            # update a batch of rules in a single transaction
+            if isinstance(data, list):
+                payload['data'] = updateInboundMappings(data, db)
+                db.commit()
+                markKamailioReloadRequired('drouting', 'dr_rules', 'inbound_prefixmap')
+                payload['kamreload'] = True
+                payload['msg'] = 'Rules Updated'
+                return createApiResponse(**payload)
+
             # sanity checks
             for arg in data:
                 if arg not in VALID_REQUEST_DATA_ARGS:
@@ -475,32 +573,34 @@ def handleInboundMapping():
             # update single rule by ruleid
             rule_id = request.args.get('ruleid')
             if rule_id is not None:
-                res = db.query(InboundMapping).filter(InboundMapping.groupid == settings.FLT_INBOUND).filter(
-                    InboundMapping.ruleid == rule_id).update(
-                    updates, synchronize_session=False)
-                if res > 0:
-                    payload['msg'] = 'Rule Updated'
-                else:
-                    payload['msg'] = 'No Matching Rule Found'
+                rules = db.query(InboundMapping).filter(InboundMapping.groupid == settings.FLT_INBOUND).filter(
+                    InboundMapping.ruleid == rule_id)
 
             # update single rule by did
             else:
                 did_pattern = request.args.get('did')
                 if did_pattern is not None:
-                    res = db.query(InboundMapping).filter(InboundMapping.groupid == settings.FLT_INBOUND).filter(
-                        InboundMapping.prefix == did_pattern).update(
-                        updates, synchronize_session=False)
-                    if res > 0:
-                        payload['msg'] = 'Rule Updated'
-                    else:
-                        payload['msg'] = 'No Matching Rule Found'
+                    rules = db.query(InboundMapping).filter(InboundMapping.groupid == settings.FLT_INBOUND).filter(
+                        InboundMapping.prefix == did_pattern)
 
                 # no other options
                 else:
                     raise http_exceptions.BadRequest('One of the following is required: {ruleid, or did}')
 
+            # keep the old keys around so they can be removed from the htables
+            old_rules = [(rule.ruleid, rule.prefix, rule.priority) for rule in rules.all()]
+            res = rules.update(updates, synchronize_session=False)
+            if res > 0:
+                payload['msg'] = 'Rule Updated'
+            else:
+                payload['msg'] = 'No Matching Rule Found'
+
             db.commit()
-            getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+            if res > 0:
+                new_rules = db.query(InboundMapping).filter(
+                    InboundMapping.ruleid.in_([ruleid for ruleid, _, _ in old_rules])).all()
+                pushHtableUpdates(inboundMappingHtableUpdates(db, old_rules, new_rules))
+                markKamailioReloadRequired('drouting')
             payload['kamreload'] = getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required']
             return createApiResponse(**payload)
 
@@ -513,12 +613,21 @@ def handleInboundMapping():
                 if arg not in VALID_REQUEST_ARGS:
                     raise http_exceptions.BadRequest("Request argument not recognized")
 
+            # delete a batch of rules in a single transaction
+            data = getRequestData() if request.content_length else None
+            if isinstance(data, list):
+                deleted = deleteInboundMappings(data, db)
+                db.commit()
+                markKamailioReloadRequired('drouting', 'dr_rules', 'inbound_prefixmap')
+                payload['kamreload'] = True
+                payload['msg'] = '{} Rules Deleted'.format(deleted)
+                return createApiResponse(**payload)
+
             # delete single rule by ruleid
             rule_id = request.args.get('ruleid')
             if rule_id is not None:
                 rule = db.query(InboundMapping).filter(InboundMapping.groupid == settings.FLT_INBOUND).filter(
                     InboundMapping.ruleid == rule_id)
-                rule.delete(synchronize_session=False)
 
             # delete single rule by did
             else:
@@ -526,14 +635,17 @@ def handleInboundMapping():
                 if did_pattern is not None:
                     rule = db.query(InboundMapping).filter(InboundMapping.groupid == settings.FLT_INBOUND).filter(
                         InboundMapping.prefix == did_pattern)
-                    rule.delete(synchronize_session=False)
 
                 # no other options
                 else:
                     raise http_exceptions.BadRequest('One of the following is required: {ruleid, or did}')
 
+            old_rules = [(r.ruleid, r.prefix, r.priority) for r in rule.all()]
+            rule.delete(synchronize_session=False)
+
             db.commit()
-            getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+            pushHtableUpdates(inboundMappingHtableUpdates(db, old_rules, []))
+            markKamailioReloadRequired('drouting')
             payload['kamreload'] = True
             payload['msg'] = 'Rule Deleted'
             return createApiResponse(**payload)
@@ -554,14 +666,260 @@ def handleInboundMapping():
         db.close()
 
 
+@api.route("/api/v1/inboundmapping/import", methods=['POST'])
+@api_security
+def handleInboundMappingImport():
+    """
+    Endpoint for bulk importing Inbound DID Rule Mappings
+
+    The csv is either uploaded as the "file" field of a multipart form or sent as the request body.
+    Each line is: did, endpoint group id, name (optional), the endpoint group can be left out
+    when the gwgroupid query arg is provided. The import is all or nothing on database errors,
+    invalid or duplicate rows are rejected and reported per row.
+
+    Query args: gwgroupid (optional), name (optional)
+    """
+
+    db = DummySession()
+
+    # use a whitelist to avoid possible SQL Injection vulns
+    VALID_REQUEST_ARGS = {'gwgroupid', 'name'}
+
+    try:
+        if (settings.DEBUG):
+            debugEndpoint()
+
+        for arg in request.args:
+            if arg not in VALID_REQUEST_ARGS:
+                raise http_exceptions.BadRequest("Request argument not recognized")
+
+        if 'file' in request.files:
+            stream = request.files['file'].stream
+        else:
+            stream = request.stream
+        csv_fp = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+
+        db = startSession()
+
+        try:
+            report = importInboundMappings(csv.reader(csv_fp), db, request.args.get('gwgroupid'), request.args.get('name'))
+        except ValueError as ex:
+            raise http_exceptions.BadRequest(str(ex))
+        db.commit()
+
+        if report['accepted'] > 0:
+            markKamailioReloadRequired('drouting', 'dr_rules', 'inbound_prefixmap')
+
+        return createApiResponse(
+            msg='{} DIDs imported, {} rejected'.format(report['accepted'], report['rejected']),
+            data=[report],
+        )
+
+    except Exception as ex:
+        db.rollback()
+        db.flush()
+        return showApiError(ex)
+    finally:
+        db.close()
+
+
+@api.route("/api/v1/outboundroutes/import", methods=['POST'])
+@api_security
+def handleOutboundRoutesImport():
+    """
+    Endpoint for bulk importing Outbound Routes from a carrier rate deck
+
+    The csv is either uploaded as the "file" field of a multipart form or sent as the request body.
+    Each line is: prefix, carrier group id, from prefix (optional), cost (optional), priority (optional),
+    name (optional), the carrier group can be left empty when the gwgroupid query arg is provided.
+    The import is all or nothing on database errors, invalid or duplicate rows are rejected and reported.
+    Kamailio is reloaded once when the import is committed, unless the reload query arg is false.
+
+    Query args: gwgroupid (optional), name (optional), reload (optional)
+    """
+
+    db = DummySession()
+
+    # use a whitelist to avoid possible SQL Injection vulns
+    VALID_REQUEST_ARGS = {'gwgroupid', 'name', 'reload'}
+
+    try:
+        if (settings.DEBUG):
+            debugEndpoint()
+
+        for arg in request.args:
+            if arg not in VALID_REQUEST_ARGS:
+                raise http_exceptions.BadRequest("Request argument not recognized")
+
+        if 'file' in request.files:
+            stream = request.files['file'].stream
+        else:
+            stream = request.stream
+        csv_fp = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+
+        db = startSession()
+
+        try:
+            report = importOutboundRoutes(csv.reader(csv_fp), db, request.args.get('gwgroupid'), request.args.get('name'))
+        except ValueError as ex:
+            raise http_exceptions.BadRequest(str(ex))
+        db.commit()
+
+        report['reloaded'] = False
+        if report['inserted'] + report['updated'] > 0:
+            if request.args.get('reload', 'true').lower() == 'true':
+                report['reloaded'] = reloadOutboundRoutes()
+            else:
+                markKamailioReloadRequired('drouting', 'dr_rules', 'tofromprefix')
+
+        return createApiResponse(
+            msg='{} routes inserted, {} updated, {} rejected'.format(report['inserted'], report['updated'], report['rejected']),
+            data=[report],
+            kamreload=getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'],
+        )
+
+    except Exception as ex:
+        db.rollback()
+        db.flush()
+        return showApiError(ex)
+    finally:
+        db.close()
+
+
+# default and upper bound for the page size of the paginated rule views
+RULES_PAGE_DEFAULT_LIMIT = 100
+RULES_PAGE_MAX_LIMIT = 1000
+
+
+def getRulesPageArgs():
+    """
+    Parse the paging, sorting and filtering arguments of a rule view request
+
+    :return:    the keyword arguments of the page functions
+    :rtype:     dict
+    :raises:    werkzeug.exceptions.BadRequest
+    """
+    try:
+        limit = int(request.args.get('limit', RULES_PAGE_DEFAULT_LIMIT))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        raise http_exceptions.BadRequest('limit and offset must be integers')
+    if limit < 1 or limit > RULES_PAGE_MAX_LIMIT:
+        raise http_exceptions.BadRequest('limit must be between 1 and {}'.format(RULES_PAGE_MAX_LIMIT))
+    if offset < 0:
+        raise http_exceptions.BadRequest('offset must not be negative')
+
+    gwgroupid = request.args.get('gwgroupid', None)
+    if gwgroupid is not None and not gwgroupid.lstrip('#').isdigit():
+        raise http_exceptions.BadRequest('gwgroupid must be an integer')
+
+    return {
+        'limit': limit,
+        'offset': offset,
+        'sort': request.args.get('sort', 'ruleid'),
+        'order': request.args.get('order', 'asc').lower(),
+        'search': request.args.get('search', None),
+        'gwgroupid': gwgroupid,
+    }
+
+
+@api.route("/api/v1/outboundroutes/rows", methods=['GET'])
+@api_security
+def getOutboundRoutesRows():
+    """
+    Endpoint for paging through the Outbound Routes view
+
+    Query args: limit (optional), offset (optional), sort (optional), order (optional),
+    search (optional, prefix match), gwgroupid (optional)
+    """
+
+    db = DummySession()
+
+    # use a whitelist to avoid possible SQL Injection vulns
+    VALID_REQUEST_ARGS = {'limit', 'offset', 'sort', 'order', 'search', 'gwgroupid'}
+
+    try:
+        if (settings.DEBUG):
+            debugEndpoint()
+
+        for arg in request.args:
+            if arg not in VALID_REQUEST_ARGS:
+                raise http_exceptions.BadRequest("Request argument not recognized")
+        page_args = getRulesPageArgs()
+
+        db = startSession()
+
+        try:
+            total, rows = getOutboundRoutesPage(db, **page_args)
+        except ValueError as ex:
+            raise http_exceptions.BadRequest(str(ex))
+
+        return createApiResponse(
+            msg='{} of {} routes'.format(len(rows), total),
+            data=[{'total': total, 'offset': page_args['offset'], 'limit': page_args['limit'], 'rows': rows}],
+        )
+
+    except Exception as ex:
+        db.rollback()
+        db.flush()
+        return showApiError(ex)
+    finally:
+        db.close()
+
+
+@api.route("/api/v1/inboundmapping/rows", methods=['GET'])
+@api_security
+def getInboundMappingRows():
+    """
+    Endpoint for paging through the Inbound DID Rule Mapping view
+
+    Query args: limit (optional), offset (optional), sort (optional), order (optional),
+    search (optional, DID prefix match), gwgroupid (optional)
+    """
+
+    db = DummySession()
+
+    # use a whitelist to avoid possible SQL Injection vulns
+    VALID_REQUEST_ARGS = {'limit', 'offset', 'sort', 'order', 'search', 'gwgroupid'}
+
+    try:
+        if (settings.DEBUG):
+            debugEndpoint()
+
+        for arg in request.args:
+            if arg not in VALID_REQUEST_ARGS:
+                raise http_exceptions.BadRequest("Request argument not recognized")
+        page_args = getRulesPageArgs()
+
+        db = startSession()
+
+        try:
+            total, rows = getInboundMappingsPage(db, **page_args)
+        except ValueError as ex:
+            raise http_exceptions.BadRequest(str(ex))
+
+        return createApiResponse(
+            msg='{} of {} rules'.format(len(rows), total),
+            data=[{'total': total, 'offset': page_args['offset'], 'limit': page_args['limit'], 'rows': rows}],
+        )
+
+    except Exception as ex:
+        db.rollback()
+        db.flush()
+        return showApiError(ex)
+    finally:
+        db.close()
+
+
 @api.route("/api/v1/notification/gwgroup", methods=['POST'])
 @api_security
 def handleNotificationRequest():
     """
     Endpoint for Sending Notifications
-    """
 
-    db = DummySession()
+    The alert is handed to the aggregator, which sends it and collapses the repeats
+    into a digest, so no database access or email is made in the request.
+    """
 
     # use a whitelist to avoid possible buffer overflow vulns or crashes
     VALID_REQUEST_DATA_ARGS = {'gwgroupid': int, 'type': int, 'text_body': str,
@@ -571,8 +929,6 @@ def handleNotificationRequest():
         if (settings.DEBUG):
             debugEndpoint()
 
-        db = startSession()
-
         # ============================
         # create and send notification
         # ============================
@@ -595,27 +951,9 @@ def handleNotificationRequest():
         # lookup recipients
         gwgroupid = data.pop('gwgroupid')
         notif_type = data.pop('type')
-        notification_row = db.query(dSIPNotification).filter(dSIPNotification.gwgroupid == gwgroupid).filter(
-            dSIPNotification.type == notif_type).first()
-        if notification_row is None:
-            raise sql_exceptions.SQLAlchemyError('DB Entry Missing for {}'.format(str(gwgroupid)))
-
-        # customize message based on type
         gwid = data.pop('gwid', None)
-        gw_row = db.query(Gateways).filter(Gateways.gwid == gwid).first() if gwid is not None else None
-        gw_name = strFieldsToDict(gw_row.description)['name'] if gw_row is not None else ''
-        gwgroup_row = db.query(GatewayGroups).filter(GatewayGroups.id == gwgroupid).first()
-        gwgroup_name = strFieldsToDict(gwgroup_row.description)['name'] if gwgroup_row is not None else ''
-        if notif_type == dSIPNotification.FLAGS.TYPE_OVERLIMIT.value:
-            data['html_body'] = (
-                '<html><head><style>.error{{border: 1px solid; margin: 10px 0px; padding: 15px 10px 15px 50px; background-color: #FF5555;}}</style></head>'
-                '<body><div class="error"><strong>Call Limit Exceeded in Endpoint Group [{}] on Endpoint [{}]</strong></div></body>').format(
-                gwgroup_name, gw_name)
-        elif notif_type == dSIPNotification.FLAGS.TYPE_GWFAILURE.value:
-            data['html_body'] = (
-                '<html><head><style>.error{{border: 1px solid; margin: 10px 0px; padding: 15px 10px 15px 50px; background-color: #FF5555;}}</style></head>'
-                '<body><div class="error"><strong>Failure Detected in Endpoint Group [{}] on Endpoint [{}]</strong></div></body>').format(
-                gwgroup_name, gw_name)
+        if notification_cache.get((gwgroupid, notif_type)) is None:
+            raise sql_exceptions.SQLAlchemyError('DB Entry Missing for {}'.format(str(gwgroupid)))
 
         # # get attachments if any uploaded
         # data['attachments'] = []
@@ -624,21 +962,29 @@ def handleNotificationRequest():
         #         if upload.filename != '' and isValidFile(upload.filename):
         #             data['attachments'].append(upload)
 
-        # TODO: we only support email at this time, add support for slack
-        if notification_row.method == dSIPNotification.FLAGS.METHOD_EMAIL.value:
-            data['recipients'] = [notification_row.value]
-            sendEmail(**data)
-        elif notification_row.method == dSIPNotification.FLAGS.METHOD_SLACK.value:
-            pass
+        # the emails are sent in the background, emails dropped on a full queue are counted in the metrics
+        if alert_aggregator.record(gwgroupid, gwid, notif_type, data):
+            return createApiResponse(msg='Notification queued')
+        return createApiResponse(msg='Notification added to digest')
+
+    except Exception as ex:
+        return showApiError(ex)
+
+
+@api.route("/api/v1/notification/metrics", methods=['GET'])
+@api_security
+def getNotificationMetrics():
+    try:
+        if (settings.DEBUG):
+            debugEndpoint()
 
-        return createApiResponse(msg='Email Sent')
+        return createApiResponse(
+            msg='Successfully retrieved notification metrics',
+            data=[{'email': email_dispatcher.getMetrics(), 'alerts': alert_aggregator.getMetrics()}],
+        )
 
     except Exception as ex:
-        db.rollback()
-        db.flush()
         return showApiError(ex)
-    finally:
-        db.close()
 
 
 @api.route("/api/v1/endpointgroups/<int:gwgroupid>", methods=['DELETE'])
@@ -712,6 +1058,7 @@ def deleteEndpointGroup(gwgroupid):
 
             # Delete domain mapping, which will stop the fusionpbx sync
             domainmapping.delete(synchronize_session=False)
+            db.execute(text("DELETE FROM dsip_multidomain_sync WHERE pbx_id=:gwgroupid"), {'gwgroupid': gwgroupid})
 
         dispatcher = db.query(Dispatcher).filter(or_(Dispatcher.setid == gwgroupid, Dispatcher.setid == int(gwgroupid) + 1000))
 
@@ -720,7 +1067,7 @@ def deleteEndpointGroup(gwgroupid):
 
         db.commit()
 
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+        markKamailioReloadRequired('drouting', 'permissions', 'dispatcher', 'domain', 'calllimit', 'gw2gwgroup', 'gwgroup2lb')
         return createApiResponse(msg='EndpointGroup deleted', kamreload=True)
 
     except Exception as ex:
@@ -850,25 +1197,17 @@ def listEndpointGroups():
     db = DummySession()
 
     response_data = []
-    typeFilter = "%type:{}%".format(str(settings.FLT_PBX))
 
     try:
         if settings.DEBUG:
             debugEndpoint()
 
-        db = startSession()
-
-        endpointgroups = db.query(GatewayGroups).filter(GatewayGroups.description.like(typeFilter)).all()
-
-        for endpointgroup in endpointgroups:
-            # Grap the description field, which is comma seperated key/value pair
-            fields = strFieldsToDict(endpointgroup.description)
-
+        for endpointgroup in gwgroup_cache.filterByType(settings.FLT_PBX):
             # append summary of endpoint group data
             response_data.append({
-                'gwgroupid': endpointgroup.id,
-                'name': fields['name'],
-                'gwlist': endpointgroup.gwlist
+                'gwgroupid': endpointgroup['id'],
+                'name': endpointgroup['fields'].get('name', ''),
+                'gwlist': endpointgroup['gwlist']
             })
 
         return createApiResponse(
@@ -1026,10 +1365,12 @@ def updateEndpointGroups(gwgroupid=None):
             else:
                 CallLimit = dSIPCallLimits(gwgroupid_str, str(calllimit))
                 db.add(CallLimit)
+            calllimit_update = ('calllimit', gwgroupid_str, calllimit)
         else:
             Calllimit = db.query(dSIPCallLimits).filter(dSIPCallLimits.gwgroupid == gwgroupid)
             if Calllimit is not None:
                 Calllimit.delete(synchronize_session=False)
+            calllimit_update = ('calllimit', gwgroupid_str, None)
 
         # runtime defaults for this route
         strip = request_payload['strip'] if 'strip' in request_payload else 0
@@ -1382,26 +1723,21 @@ def updateEndpointGroups(gwgroupid=None):
                 if 'cdr_send_interval' in request_payload['cdr'] else None
 
             if len(cdr_email) > 0 and len(cdr_send_interval) > 0:
+                if not isValidCronInterval(cdr_send_interval):
+                    raise http_exceptions.BadRequest('invalid cdr send interval')
                 # Try to update
-                if db.query(dSIPCDRInfo).filter(dSIPCDRInfo.gwgroupid == gwgroupid).update(
+                if not db.query(dSIPCDRInfo).filter(dSIPCDRInfo.gwgroupid == gwgroupid).update(
                     {"email": cdr_email, "send_interval": cdr_send_interval},
                     synchronize_session=False):
-                    if not updateTaggedCronjob(gwgroupid, cdr_send_interval):
-                        raise Exception('Crontab entry could not be updated')
-                else:
                     cdrinfo = dSIPCDRInfo(gwgroupid, cdr_email, cdr_send_interval)
                     db.add(cdrinfo)
-                    cron_cmd = '{} cdr sendreport {}'.format((settings.DSIP_PROJECT_DIR + '/gui/dsiprouter_cron.py'),
-                        gwgroupid_str)
-                    if not addTaggedCronjob(gwgroupid, cdr_send_interval, cron_cmd):
-                        raise Exception('Crontab entry could not be created')
             else:
                 # Remove CDR Info
                 cdrinfo = db.query(dSIPCDRInfo).filter(dSIPCDRInfo.gwgroupid == gwgroupid).first()
                 if cdrinfo is not None:
                     db.delete(cdrinfo)
-                    if not deleteTaggedCronjob(gwgroupid):
-                        raise Exception('Crontab entry could not be deleted')
+            # the reports are sent by the cdr sendreports cronjob now, remove the legacy per gwgroup entry
+            deleteTaggedCronjob(gwgroupid)
 
             # Update FusionPBX
 
@@ -1424,10 +1760,14 @@ def updateEndpointGroups(gwgroupid=None):
             elif fusionpbxenabled == 0:
                 db.query(dSIPMultiDomainMapping).filter(dSIPMultiDomainMapping.pbx_id == gwgroupid).delete(
                     synchronize_session=False)
+                # the next sync after re-enabling starts from the domains in kamailio
+                db.execute(text("DELETE FROM dsip_multidomain_sync WHERE pbx_id=:gwgroupid"), {'gwgroupid': gwgroupid})
 
         db.commit()
 
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+        # the call limit is applied in place, the htable does not need a reload
+        pushHtableUpdates([calllimit_update])
+        markKamailioReloadRequired('drouting', 'permissions', 'dispatcher', 'domain', 'gw2gwgroup', 'gwgroup2lb')
         return createApiResponse(
             msg='Endpoint group updated',
             data=[gwgroup_data],
@@ -1743,19 +2083,15 @@ def addEndpointGroups(data=None, endpointGroupType=None, domain=None):
                 if 'cdr_send_interval' in request_payload['cdr'] else ''
 
             if len(cdr_email) > 0 and len(cdr_send_interval) > 0:
-                # create DB entry
+                if not isValidCronInterval(cdr_send_interval):
+                    raise http_exceptions.BadRequest('invalid cdr send interval')
+                # the report is sent by the cdr sendreports cronjob when the interval is due
                 cdrinfo = dSIPCDRInfo(gwgroupid, cdr_email, cdr_send_interval)
                 db.add(cdrinfo)
 
-                # create crontab entry
-                cron_cmd = '{} cdr sendreport {}'.format((settings.DSIP_PROJECT_DIR + '/gui/dsiprouter_cron.py'),
-                    gwgroupid)
-                if not addTaggedCronjob(gwgroupid, cdr_send_interval, cron_cmd):
-                    raise Exception('Crontab entry could not be created')
-
         db.commit()
 
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+        markKamailioReloadRequired('drouting', 'permissions', 'dispatcher', 'domain', 'calllimit', 'gw2gwgroup', 'gwgroup2lb')
         return createApiResponse(
             msg='Endpoint group created',
             data=[gwgroup_data],
@@ -1945,7 +2281,7 @@ def addNumberEnrichment(request_payload=None):
 
         db.commit()
 
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+        markKamailioReloadRequired()
         return createApiResponse(
             msg='Enrichment Rule(s) created',
             data=response_data,
@@ -2078,7 +2414,7 @@ def updateNumberEnrichment(rule_id=None, request_payload=None):
 
         db.commit()
 
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+        markKamailioReloadRequired()
         return createApiResponse(
             msg='Enrichment Rule(s) updated',
             data=response_data,
@@ -2178,7 +2514,7 @@ def deleteNumberEnrichment(rule_id, request_payload=None):
 
         db.commit()
 
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+        markKamailioReloadRequired()
         return createApiResponse(
             msg='Enrichment Rule(s) deleted',
             kamreload=True,
@@ -2386,7 +2722,7 @@ def fetchNumberEnrichment(request_payload=None):
                 'rule_name': strFieldsToDict(rule.description)['name']
             })
 
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+        markKamailioReloadRequired()
         return createApiResponse(
             **response_payload,
             kamreload=True,
@@ -2396,16 +2732,82 @@ def fetchNumberEnrichment(request_payload=None):
         return showApiError(ex, response_payload)
 
 
+# upper bound for the page size of the paginated cdr endpoints
+CDR_PAGE_MAX_LIMIT = 10000
+
+
+def encodeCDRCursor(call_start_time, source, cdr_id):
+    """
+    Create an opaque pagination cursor pointing at a cdr
+
+    :param call_start_time:     start time of the last cdr on the page
+    :type call_start_time:      datetime
+    :param source:              table the last cdr on the page comes from, one of the CDR_SOURCE_* constants
+    :type source:               int
+    :param cdr_id:              id of the last cdr on the page
+    :type cdr_id:               int
+    :return:                    the cursor
+    :rtype:                     str
+    """
+    return base64.urlsafe_b64encode(json.dumps([str(call_start_time), int(source), int(cdr_id)]).encode('utf-8')).decode('utf-8')
+
+
+def decodeCDRCursor(cursor):
+    """
+    Parse a pagination cursor created by :func:`encodeCDRCursor`
+
+    :param cursor:  the cursor
+    :type cursor:   str
+    :return:        the start time, source and id of the cdr the cursor points at
+    :rtype:         tuple
+    :raises:        werkzeug.exceptions.BadRequest
+    """
+    try:
+        call_start_time, source, cdr_id = json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')))
+        if source not in (CDR_SOURCE_CDRS, CDR_SOURCE_ACC):
+            raise ValueError('invalid cdr source')
+        return datetime.fromisoformat(call_start_time), source, int(cdr_id)
+    except Exception:
+        raise http_exceptions.BadRequest('invalid pagination cursor')
+
+
+def getCDRPageArgs():
+    """
+    Parse the pagination arguments of a cdr request
+
+    :return:    the page size and the cursor (start time, source, id) to start after
+    :rtype:     tuple
+    :raises:    werkzeug.exceptions.BadRequest
+    """
+    limit = request.args.get('limit', None)
+    after = request.args.get('after', None)
+
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise http_exceptions.BadRequest('limit must be an integer')
+        if limit < 1 or limit > CDR_PAGE_MAX_LIMIT:
+            raise http_exceptions.BadRequest('limit must be between 1 and {}'.format(CDR_PAGE_MAX_LIMIT))
+    if after is not None:
+        after = decodeCDRCursor(after)
+
+    return limit, after
+
+
 # TODO: standardize response payload (use data param)
 # TODO: stop shadowing builtin functions -> type == builtin
 # return value should be used in an http/flask context
-def generateCDRS(gwgroupid, type=None, email=None, dtfilter=None, cdrfilter=None, nonCompletedCalls=None):
+def generateCDRS(gwgroupid, type=None, email=None, dtfilter=None, cdrfilter=None, nonCompletedCalls=None, limit=None, after=None):
     """
     Generate CDRs Report for a gwgroup
 
+    The csv and ndjson reports are streamed from a server-side cursor,
+    so memory usage stays constant regardless of the number of cdrs.
+
     :param gwgroupid:       gwgroup to generate cdr's for
     :type gwgroupid:        int|str
-    :param type:            type of report (json|csv)
+    :param type:            type of report (json|csv|ndjson)
     :type type:             str
     :param email:           whether the report should be emailed
     :type email:            bool
@@ -2413,6 +2815,10 @@ def generateCDRS(gwgroupid, type=None, email=None, dtfilter=None, cdrfilter=None
     :type dtfilter:         datetime
     :param cdrfilter:       comma seperated cdr id's to include
     :type cdrfilter:        str
+    :param limit:           max number of cdr's to return (page size)
+    :type limit:            int
+    :param after:           cursor (start time, source, id) of the cdr to start after
+    :type after:            tuple
     :return:                returns a json response or file
     :rtype:                 flask.Response
     """
@@ -2441,117 +2847,89 @@ def generateCDRS(gwgroupid, type=None, email=None, dtfilter=None, cdrfilter=None
         if nonCompletedCalls is None:
             nonCompletedCalls = True
 
-        gwgroup = db.query(GatewayGroups).filter(GatewayGroups.id == gwgroupid).first()
+        gwgroup = gwgroup_cache.get(gwgroupid)
         if gwgroup is not None:
-            gwgroupName = strFieldsToDict(gwgroup.description)['name']
+            gwgroupName = gwgroup['fields'].get('name', '')
         else:
             response_payload['status'] = "0"
             response_payload['message'] = "Endpont group doesn't exist"
             return jsonify(response_payload)
 
         if len(cdrfilter) > 0:
-            query = (
-                """SELECT t1.cdr_id, t1.call_start_time, t1.duration AS call_duration, t1.calltype AS call_direction,
-                          t2.id AS src_gwgroupid, substring_index(substring_index(t2.description, 'name:', -1), ',', 1) AS src_gwgroupname,
-                          t3.id AS dst_gwgroupid, substring_index(substring_index(t3.description, 'name:', -1), ',', 1) AS dst_gwgroupname,
-                          t1.src_username, t1.dst_username, t1.src_ip AS src_address, t1.dst_domain AS dst_address, t1.sip_call_id AS call_id
-                FROM cdrs t1
-                JOIN dr_gw_lists t2 ON (t1.src_gwgroupid = t2.id)
-                JOIN dr_gw_lists t3 ON (t1.dst_gwgroupid = t3.id)
-                WHERE (t2.id = '{gwgroupid}' OR t3.id = '{gwgroupid}') AND t1.call_start_time >= '{dtfilter}' AND t1.cdr_id IN ({cdrfilter})
-                ORDER BY t1.call_start_time DESC"""
-            ).format(gwgroupid=gwgroupid, dtfilter=dtfilter, cdrfilter=cdrfilter)
-        else:
-            query = (
-                """SELECT t1.cdr_id, t1.call_start_time, t1.duration AS call_duration, t1.calltype AS call_direction,
-                          t2.id AS src_gwgroupid, substring_index(substring_index(t2.description, 'name:', -1), ',', 1) AS src_gwgroupname,
-                          t3.id AS dst_gwgroupid, substring_index(substring_index(t3.description, 'name:', -1), ',', 1) AS dst_gwgroupname,
-                          t1.src_username, t1.dst_username, t1.src_ip AS src_address, t1.dst_domain AS dst_address, t1.sip_call_id AS call_id
-                FROM cdrs t1
-                JOIN dr_gw_lists t2 ON (t1.src_gwgroupid = t2.id)
-                JOIN dr_gw_lists t3 ON (t1.dst_gwgroupid = t3.id)
-                WHERE (t2.id = '{gwgroupid}' OR t3.id = '{gwgroupid}') AND t1.call_start_time >= '{dtfilter}'
-                ORDER BY t1.call_start_time DESC"""
-            ).format(gwgroupid=gwgroupid, dtfilter=dtfilter)
-
-        if nonCompletedCalls == True:
-            query2 = (
-                """SELECT acc.id AS cdr_id, acc.time, 0, acc.calltype,
-                acc.src_gwgroupid, SUBSTRING_INDEX(SUBSTRING_INDEX(t2.description, 'name:', -1), ',', 1) AS src_gwgroupname,
-                acc.dst_gwgroupid, SUBSTRING_INDEX(SUBSTRING_INDEX(t3.description, 'name:', -1), ',', 1) AS dst_gwgroupname,
-                acc.src_user,acc.dst_user,acc.src_ip,acc.dst_domain,acc.callid
-                FROM acc
-                JOIN dr_gw_lists t2 ON (acc.src_gwgroupid = t2.id)
-                LEFT JOIN dr_gw_lists t3 ON (acc.dst_gwgroupid = t3.id)
-                WHERE (t2.id = :gwgroupid OR t3.id = :gwgroupid) AND acc.time >= :dtfilter
-                ORDER BY acc.time DESC"""
+            # only allow numeric id's, the filter is interpolated into the query
+            cdrfilter = ','.join(str(int(cdr_id)) for cdr_id in cdrfilter.split(','))
+
+        query = buildCDRQuery(cdrfilter, nonCompletedCalls == True, after, limit)
+        query_params = {"gwgroupid": gwgroupid, "dtfilter": dtfilter}
+        if after is not None:
+            query_params['after_time'], query_params['after_id'] = after[0], after[2]
+        if limit is not None:
+            query_params['limit'] = limit
+
+        # stream the report straight from the cursor to the client
+        if type == 'ndjson' or (type == 'csv' and not email):
+            now = time.strftime('%Y%m%d-%H%M%S')
+            filename = secure_filename('{}_{}.{}'.format(gwgroupName, now, type))
+            response = Response(
+                stream_with_context(streamCDRS(db, query, query_params, type)),
+                status=StatusCodes.HTTP_OK,
+                mimetype='text/csv' if type == 'csv' else 'application/x-ndjson',
+                headers={'Content-Disposition': 'attachment; filename={}'.format(filename)}
             )
-            query = "(" + query + ")" + " UNION " + "(" + query2 + ")"
-
-        rows = db.execute(text(query), {"gwgroupid": gwgroupid, "dtfilter": dtfilter})
-        cdrs = []
-        dataFields = ['cdr_id', 'call_start_time', 'call_duration', 'call_direction', 'src_gwgroupid',
-                      'src_gwgroupname', 'dst_gwgroupid', 'dst_gwgroupname', 'src_username',
-                      'dst_username', 'src_address', 'dst_address', 'call_id']
-
-        for row in rows:
-            data = {}
-            data['cdr_id'] = int(row[0])
-            data['call_start_time'] = row[1]
-            data['call_duration'] = str(row[2])
-            data['call_direction'] = row[3]
-            data['src_gwgroupid'] = row[4]
-            data['src_gwgroupname'] = row[5]
-            data['dst_gwgroupid'] = row[6]
-            data['dst_gwgroupname'] = row[7]
-            data['src_username'] = row[8]
-            data['dst_username'] = row[9]
-            data['src_address'] = row[10]
-            data['dst_address'] = row[11]
-            data['call_id'] = row[12]
-
-            cdrs.append(data)
-
-        response_payload['status'] = "200"
-        response_payload['cdrs'] = cdrs
-        response_payload['recordCount'] = len(cdrs)
+            # the response now owns the session, it is closed after the last chunk is sent
+            response.call_on_close(db.close)
+            db = DummySession()
+            return response
 
-        # Convert array of dicts to csv format
+        # Write the report to a file for the email attachment
         if type == "csv":
             now = time.strftime('%Y%m%d-%H%M%S')
             filename = secure_filename('{}_{}.csv'.format(gwgroupName, now))
             csv_file = '/tmp/{}'.format(filename)
             with open(csv_file, 'w', newline='') as csv_fp:
-                if len(cdrs) > 0:
-                    dict_writer = csv.DictWriter(csv_fp, fieldnames=cdrs[0].keys())
-                    dict_writer.writeheader()
-                    dict_writer.writerows(cdrs)
-                else:
-                    dict_writer = csv.DictWriter(csv_fp, fieldnames=dataFields)
-                    dict_writer.writeheader()
-
-            if email:
-                # recipients required
-                cdr_info = db.query(dSIPCDRInfo).filter(dSIPCDRInfo.gwgroupid == gwgroupid).first()
-                if cdr_info is not None:
-                    # Setup the parameters to send the email
-                    data = {}
-                    data['html_body'] = "<html>CDR Report for {}</html>".format(gwgroupName)
-                    data['text_body'] = "CDR Report for {}".format(gwgroupName)
-                    data['subject'] = "CDR Report for {}".format(gwgroupName)
-                    data['attachments'] = []
-                    data['attachments'].append(csv_file)
-                    data['recipients'] = cdr_info.email.split(',')
-                    sendEmail(**data)
-                    # Remove CDR's from the payload thats being returned
-                    response_payload.pop('cdrs')
-                    response_payload['format'] = 'csv'
-                    response_payload['type'] = 'email'
-                    return jsonify(response_payload)
+                csv_fp.writelines(streamCDRS(db, query, query_params, type))
+
+            # recipients required
+            cdr_info = db.query(dSIPCDRInfo).filter(dSIPCDRInfo.gwgroupid == gwgroupid).first()
+            if cdr_info is not None:
+                # Setup the parameters to send the email
+                data = {}
+                data['html_body'] = "<html>CDR Report for {}</html>".format(gwgroupName)
+                data['text_body'] = "CDR Report for {}".format(gwgroupName)
+                data['subject'] = "CDR Report for {}".format(gwgroupName)
+                data['attachments'] = []
+                data['attachments'].append(csv_file)
+                data['recipients'] = cdr_info.email.split(',')
+                # the dispatcher removes the report once it is sent
+                sendEmail(**data, delete_attachments=True)
+                csv_file = ''
+                response_payload['status'] = "200"
+                response_payload['format'] = 'csv'
+                response_payload['type'] = 'email'
+                return jsonify(response_payload)
 
             return send_file(csv_file, as_attachment=True), StatusCodes.HTTP_OK
-        else:
-            return jsonify(response_payload), StatusCodes.HTTP_OK
+
+        if limit is not None:
+            # fetch one extra row to find out if there is another page
+            query_params['limit'] = limit + 1
+
+        rows = db.execute(text(query), query_params).all()
+
+        if limit is not None:
+            if len(rows) > limit:
+                rows = rows[:limit]
+                last = rows[-1]._mapping
+                response_payload['next'] = encodeCDRCursor(last['call_start_time'], last['source'], last['cdr_id'])
+            else:
+                response_payload['next'] = None
+        cdrs = [cdrRowToDict(row) for row in rows]
+
+        response_payload['status'] = "200"
+        response_payload['cdrs'] = cdrs
+        response_payload['recordCount'] = len(cdrs)
+
+        return jsonify(response_payload), StatusCodes.HTTP_OK
 
     except Exception as ex:
         db.rollback()
@@ -2571,10 +2949,20 @@ def getGatewayGroupCDRS(gwgroupid=None, type=None, email=None, filter=None, dtfi
 
     Getting the cdrs for a gatewaygroup
 
+    The csv and ndjson types are streamed to the client as the rows are read
+
+    Results can be paged through with the limit query arg,
+    the next page is requested by passing the returned "next" cursor in the after query arg
+
     """
     if (settings.DEBUG):
         debugEndpoint()
 
+    try:
+        limit, after = getCDRPageArgs()
+    except Exception as ex:
+        return showApiError(ex)
+
     if type is None:
         type = request.args.get('type', 'json')
     if email is None:
@@ -2586,7 +2974,8 @@ def getGatewayGroupCDRS(gwgroupid=None, type=None, email=None, filter=None, dtfi
     if nonCompletedCalls is None:
         nonCompletedCalls = bool(request.args.get('nonCompletedCalls', True))
 
-    return generateCDRS(gwgroupid, type, email, cdrfilter=filter, dtfilter=dtfilter, nonCompletedCalls=nonCompletedCalls)
+    return generateCDRS(gwgroupid, type, email, cdrfilter=filter, dtfilter=dtfilter, nonCompletedCalls=nonCompletedCalls,
+                        limit=limit, after=after)
 
 
 # TODO: standardize response payload (use createApiResponse())
@@ -2598,6 +2987,9 @@ def getGatewayCDRS(gwid=None):
 
     Getting the cdrs for a gateway thats part of a gateway group
 
+    Results can be paged through with the limit query arg,
+    the next page is requested by passing the returned "next" cursor in the after query arg
+
     """
     db = DummySession()
 
@@ -2610,13 +3002,30 @@ def getGatewayCDRS(gwid=None):
         if (settings.DEBUG):
             debugEndpoint()
 
-        query = text(
+        limit, after = getCDRPageArgs()
+        query_params = {'gwid': gwid}
+
+        query = (
             "SELECT cdr_id, gwid, call_start_time, calltype AS direction, dst_username AS number,src_ip, dst_domain, duration,sip_call_id "
             "FROM dr_gateways, cdrs "
-            "WHERE cdrs.src_ip=dr_gateways.address AND gwid=:gwid "
-            "ORDER BY call_start_time DESC"
+            "WHERE cdrs.src_ip=dr_gateways.address AND gwid=:gwid"
         )
-        cdrs = db.execute(query, gwid=gwid)
+        if after is not None:
+            query += " AND " + buildCDRKeysetFilter('call_start_time', 'cdr_id', CDR_SOURCE_CDRS, after)
+            query_params['after_time'], query_params['after_id'] = after[0], after[2]
+        query += " ORDER BY call_start_time DESC, cdr_id DESC"
+        if limit is not None:
+            # fetch one extra row to find out if there is another page
+            query += " LIMIT :limit"
+            query_params['limit'] = limit + 1
+
+        cdrs = db.execute(text(query), query_params).all()
+        if limit is not None:
+            if len(cdrs) > limit:
+                cdrs = cdrs[:limit]
+                response_payload['next'] = encodeCDRCursor(cdrs[-1][2], CDR_SOURCE_CDRS, cdrs[-1][0])
+            else:
+                response_payload['next'] = None
 
         rows = []
         for cdr in cdrs:
@@ -2633,9 +3042,9 @@ def getGatewayCDRS(gwid=None):
 
             rows.append(row)
 
-            response_payload['cdrs'] = rows
-            response_payload['recordCount'] = len(rows)
-            response_payload['status'] = "200"
+        response_payload['cdrs'] = rows
+        response_payload['recordCount'] = len(rows)
+        response_payload['status'] = "200"
 
         return jsonify(response_payload), StatusCodes.HTTP_OK
 
@@ -2647,6 +3056,51 @@ def getGatewayCDRS(gwid=None):
         db.close()
 
 
+@api.route("/api/v1/cdrs/summary", methods=['GET'])
+@api_security
+def getCDRSummaryReport():
+    """
+    Usage per endpoint group, read from the hourly / daily cdr rollups
+
+    Query args: period (hour|day, default day), start / end (ISO dates), gwgroupid, calltype,
+    group_by (src|dst, totals for the whole range per source / destination endpoint group)
+    """
+    db = DummySession()
+
+    try:
+        if settings.DEBUG:
+            debugEndpoint()
+
+        db = startSession()
+
+        try:
+            start = request.args.get('start', None)
+            start = datetime.fromisoformat(start) if start is not None else None
+            end = request.args.get('end', None)
+            end = datetime.fromisoformat(end) if end is not None else None
+        except ValueError:
+            raise http_exceptions.BadRequest('start and end must be ISO 8601 dates')
+
+        try:
+            summary = getCDRSummary(db, period=request.args.get('period', 'day'), start=start, end=end,
+                gwgroupid=request.args.get('gwgroupid', None), calltype=request.args.get('calltype', None),
+                group_by=request.args.get('group_by', None))
+        except ValueError as ex:
+            raise http_exceptions.BadRequest(str(ex))
+
+        return createApiResponse(
+            msg='CDR summary found',
+            data=summary,
+        )
+
+    except Exception as ex:
+        db.rollback()
+        db.flush()
+        return showApiError(ex)
+    finally:
+        db.close()
+
+
 @api.route("/api/v1/backupandrestore/backup", methods=['GET'])
 @api_security
 def createBackup():
@@ -2737,7 +3191,11 @@ def restoreBackup():
         with open(restore_path, 'rb') as fp:
             subprocess.Popen(restorecmd, stdin=fp, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).communicate()
 
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+        # the restore bypasses the ORM so the cached records are not invalidated automatically
+        invalidateGatewayCaches()
+        # the backup may be from a different schema
+        invalidateSchemaCache()
+        markKamailioReloadRequired()
         return createApiResponse(
             msg='The restore was successful',
             kamreload=True,
@@ -2780,23 +3238,10 @@ def getOptionMessageStatus(domain):
     """
 
     domain_active = False
-    cmdset = {"method": "dispatcher.list", "jsonrpc": "2.0", "id": 1}
-
-    r = requests.get('http://127.0.0.1:5060/api/kamailio', json=cmdset)
-    if r.status_code >= 400:
-        try:
-            msg = r.json()['error']['message']
-        except:
-            msg = r.reason
-        ex = http_exceptions.HTTPException(msg)
-        ex.code = r.status_code
-        raise ex
-    else:
-        response = r.json()
-        records = response['result']['RECORDS']
-
+    response = getKamRPCClient().call('dispatcher.list')
     if not response:
         return False
+    records = response['RECORDS']
 
     try:
         # Loop thru each record in the dispatcher list
@@ -2992,7 +3437,7 @@ def createCertificate():
                     key, cert = letsencrypt.generateCertificate(domain, email, default=replace_default_cert)
 
             except Exception as ex:
-                getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = False
+                clearKamailioReloadRequired()
                 raise http_exceptions.BadRequest(
                     "Issue with validating ownership of the domain.  Please add a DNS record for this domain and try again")
 
@@ -3020,7 +3465,7 @@ def createCertificate():
             if not kamtls.addCustomTLSConfig(domain, ip, port, server_name_mode):
                 raise Exception('Failed to add Certificate to Kamailio')
 
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+        markKamailioReloadRequired('tls')
         return createApiResponse(
             msg="Certificate creation succeeded",
             data=[{"id": certificate.id}],
@@ -3062,7 +3507,7 @@ def deleteCertificates(domain=None):
 
         db.commit()
 
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+        markKamailioReloadRequired('tls')
         return createApiResponse(
             msg='Certificate Deleted',
             kamreload=True,
@@ -3152,7 +3597,7 @@ def uploadCertificates(domain=None):
 
         db.commit()
 
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+        markKamailioReloadRequired('tls')
         return createApiResponse(
             msg="Certificate and Key were uploaded",
             data=[{"id": certificate.id}],
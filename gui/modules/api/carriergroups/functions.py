@@ -4,7 +4,7 @@ from werkzeug import exceptions as http_exceptions
 import settings
 from shared import debugException, debugEndpoint, stripDictVals, strFieldsToDict, dictToStrFields, showError
 from database import startSession, DummySession, Gateways, Address, UAC, GatewayGroups
-from util.ipc import STATE_SHMEM_NAME, getSharedMemoryDict
+from modules.api.kamailio.functions import markKamailioReloadRequired
 from util.networking import safeUriToHost, safeFormatSipUri, safeStripPort
 
 def addUpdateCarrierGroups(data=None):
@@ -110,7 +110,7 @@ def addUpdateCarrierGroups(data=None):
                 db.query(Address).filter(Address.tag.contains("name:{}-uac".format(name))).delete(synchronize_session=False)
 
         db.commit()
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+        markKamailioReloadRequired('drouting', 'gw2gwgroup', 'gwgroup2lb', 'permissions', 'uac')
         if data is None:
             return displayCarrierGroups()
         else:
@@ -249,7 +249,7 @@ def addUpdateCarriers(data=None):
             Gateway.description = dictToStrFields(gw_fields)
 
         db.commit()
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+        markKamailioReloadRequired('drouting', 'gw2gwgroup', 'permissions')
         if data is None:
             return displayCarriers(gwgroup=gwgroup, newgwid=newgwid)
 
@@ -0,0 +1,398 @@
+# make sure the generated source files are imported instead of the template ones
+import sys
+if sys.path[0] != '/etc/dsiprouter/gui':
+    sys.path.insert(0, '/etc/dsiprouter/gui')
+
+from sqlalchemy.sql import text
+from werkzeug import exceptions as http_exceptions
+from database import InboundMapping, GatewayGroups, getRulesGwgroupidSQL
+from util.conversions import escape_like
+import settings
+
+# number of rows validated, de-duplicated and inserted at a time
+INBOUND_IMPORT_CHUNK_SIZE = 5000
+# columns the inbound mapping view can be sorted on, the ruleid breaks the ties
+INBOUND_PAGE_SORT_COLUMNS = {
+    'ruleid': 'r.ruleid',
+    'prefix': 'r.prefix',
+    'gwgroupid': '{gwgroupid}',
+}
+
+
+def validateDID(did):
+    """
+    Check a DID only contains the characters allowed in a dr_rules prefix
+
+    :param did:     the DID to check
+    :type did:      str
+    :return:        error message or None if the DID is valid
+    :rtype:         str|None
+    """
+    if len(did) == 0:
+        return 'DID is required'
+    for c in did:
+        if c not in settings.DID_PREFIX_ALLOWED_CHARS:
+            return 'DID improperly formatted. Allowed characters: {}'.format(','.join(settings.DID_PREFIX_ALLOWED_CHARS))
+    return None
+
+
+def importInboundMappings(rows, db, override_gwgroupid=None, name=None, chunk_size=INBOUND_IMPORT_CHUNK_SIZE):
+    """
+    Bulk import inbound DID mappings
+
+    Rows are consumed lazily so the input can be streamed from a csv reader.
+    Each chunk is de-duplicated against dr_rules in a single query and written with
+    a multi-row insert. The whole import runs in the caller's transaction, the caller
+    is responsible for committing it, so a failed import never leaves a partial result.
+
+    Row format: did, endpoint group id (optional when overridden), name (optional)
+
+    :param rows:                    rows to import, lines starting with '#' are skipped
+    :type rows:                     collections.abc.Iterable[list]
+    :param db:                      session to import with
+    :type db:                       sqlalchemy.orm.Session
+    :param override_gwgroupid:      endpoint group to map all DIDs to, ignoring the row value
+    :type override_gwgroupid:       int|str|None
+    :param name:                    name to use for rows without a name
+    :type name:                     str|None
+    :param chunk_size:              number of rows processed per insert
+    :type chunk_size:               int
+    :return:                        the report, counts and the per-row status
+    :rtype:                         dict
+    """
+    report = {'accepted': 0, 'rejected': 0, 'rows': []}
+
+    # endpoint groups are checked in memory instead of once per row
+    gwgroupids = {str(gwgroupid) for gwgroupid, in db.query(GatewayGroups.id)}
+    if override_gwgroupid is not None and len(str(override_gwgroupid)) > 0:
+        override_gwgroupid = str(override_gwgroupid).lstrip('#')
+        if override_gwgroupid not in gwgroupids:
+            raise ValueError('endpoint group {} does not exist'.format(override_gwgroupid))
+    else:
+        override_gwgroupid = None
+    # DIDs already seen in this import
+    seen = set()
+
+    def reject(rownum, did, reason):
+        report['rejected'] += 1
+        report['rows'].append({'row': rownum, 'did': did, 'status': 'rejected', 'reason': reason})
+
+    def flush(chunk):
+        if len(chunk) == 0:
+            return
+        existing = {prefix for prefix, in db.query(InboundMapping.prefix).filter(
+            InboundMapping.groupid == settings.FLT_INBOUND).filter(
+            InboundMapping.prefix.in_([mapping['prefix'] for _, mapping in chunk]))}
+
+        inserts = []
+        for rownum, mapping in chunk:
+            if mapping['prefix'] in existing:
+                reject(rownum, mapping['prefix'], "Duplicate DID's are not allowed")
+                continue
+            inserts.append(mapping)
+            report['accepted'] += 1
+            report['rows'].append({'row': rownum, 'did': mapping['prefix'], 'status': 'accepted', 'reason': ''})
+
+        if len(inserts) > 0:
+            db.bulk_insert_mappings(InboundMapping, inserts)
+
+    chunk = []
+    for rownum, row in enumerate(rows, 1):
+        # skip blank lines and the header if present
+        if len(row) == 0 or len(row[0].strip()) == 0 or row[0].startswith('#'):
+            continue
+
+        did = row[0].strip()
+        error = validateDID(did)
+        if error is not None:
+            reject(rownum, did, error)
+            continue
+        if did in seen:
+            reject(rownum, did, 'DID is duplicated in the import')
+            continue
+
+        if override_gwgroupid is not None:
+            gwgroupid = override_gwgroupid
+        elif len(row) > 1:
+            gwgroupid = row[1].strip().lstrip('#')
+        else:
+            reject(rownum, did, 'Endpoint group is required')
+            continue
+        if gwgroupid not in gwgroupids:
+            reject(rownum, did, 'Endpoint group {} does not exist'.format(gwgroupid))
+            continue
+
+        if len(row) > 2 and len(row[2].strip()) > 0:
+            description = 'name:{}'.format(row[2].strip())
+        elif name is not None:
+            description = 'name:{}'.format(name)
+        else:
+            description = ''
+
+        seen.add(did)
+        chunk.append((rownum, {
+            'groupid': settings.FLT_INBOUND, 'prefix': did, 'gwlist': '#{}'.format(gwgroupid),
+            'description': description, 'timerec': '', 'routeid': ''
+        }))
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    flush(chunk)
+
+    report['rows'].sort(key=lambda r: r['row'])
+    return report
+
+
+def parseInboundMappingFields(data, index):
+    """
+    Validate an item of a batch request and convert it to dr_rules columns
+
+    :param data:    the item, with the did, servers and name fields
+    :type data:     dict
+    :param index:   position of the item in the batch, used in error messages
+    :type index:    int
+    :return:        the dr_rules columns to set
+    :rtype:         dict
+    :raises:        werkzeug.exceptions.BadRequest
+    """
+    fields = {}
+
+    if 'servers' in data:
+        if not isinstance(data['servers'], list) or len(data['servers']) < 1 or len(data['servers']) > 2:
+            raise http_exceptions.BadRequest('Item {}: Primary Server missing or More than 2 Servers Provided'.format(index))
+        fields['gwlist'] = ','.join(str(server) for server in data['servers'])
+    if 'did' in data:
+        error = validateDID(str(data['did']))
+        if error is not None:
+            raise http_exceptions.BadRequest('Item {}: {}'.format(index, error))
+        fields['prefix'] = str(data['did'])
+    if 'name' in data:
+        fields['description'] = 'name:{}'.format(data['name'])
+
+    return fields
+
+
+def checkBatchItems(items, valid_args):
+    """
+    Sanity check the items of a batch request
+
+    :param items:       the batch
+    :type items:        list
+    :param valid_args:  whitelist of the fields an item may contain
+    :type valid_args:   set
+    :return:            None
+    :rtype:             None
+    :raises:            werkzeug.exceptions.BadRequest
+    """
+    if len(items) == 0:
+        raise http_exceptions.BadRequest('Batch is empty')
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise http_exceptions.BadRequest('Item {}: must be an object'.format(i))
+        for arg in item:
+            if arg not in valid_args:
+                raise http_exceptions.BadRequest('Item {}: Request data argument not recognized'.format(i))
+
+
+def findDuplicateDIDs(dids, db, exclude_ruleids=()):
+    """
+    Find the DIDs that already have an inbound mapping, or are repeated in the list
+
+    :param dids:                DIDs to check
+    :type dids:                 list
+    :param db:                  session to query with
+    :type db:                   sqlalchemy.orm.Session
+    :param exclude_ruleids:     rules to ignore, the rules whose DID is being changed
+    :type exclude_ruleids:      list|tuple
+    :return:                    the duplicated DIDs
+    :rtype:                     set
+    """
+    seen = set()
+    duplicates = set()
+    for did in dids:
+        if did in seen:
+            duplicates.add(did)
+        seen.add(did)
+
+    query = db.query(InboundMapping.prefix).filter(InboundMapping.groupid == settings.FLT_INBOUND).filter(
+        InboundMapping.prefix.in_(list(seen)))
+    if len(exclude_ruleids) > 0:
+        query = query.filter(InboundMapping.ruleid.notin_(list(exclude_ruleids)))
+    duplicates.update(prefix for prefix, in query)
+
+    return duplicates
+
+
+def createInboundMappings(items, db):
+    """
+    Create a batch of inbound mappings
+
+    :param items:   the mappings, each with did and servers and optionally name
+    :type items:    list[dict]
+    :param db:      session to create the mappings with, the caller commits
+    :type db:       sqlalchemy.orm.Session
+    :return:        the created DIDs
+    :rtype:         list
+    :raises:        werkzeug.exceptions.BadRequest
+    """
+    checkBatchItems(items, {'did', 'servers', 'name'})
+
+    mappings = []
+    for i, item in enumerate(items):
+        if 'servers' not in item:
+            raise http_exceptions.BadRequest('Item {}: Servers to map DID to are required'.format(i))
+        if 'did' not in item:
+            raise http_exceptions.BadRequest('Item {}: DID is required'.format(i))
+        mapping = {'groupid': settings.FLT_INBOUND, 'description': '', 'timerec': '', 'routeid': ''}
+        mapping.update(parseInboundMappingFields(item, i))
+        mappings.append(mapping)
+
+    duplicates = findDuplicateDIDs([mapping['prefix'] for mapping in mappings], db)
+    if len(duplicates) > 0:
+        raise http_exceptions.BadRequest("Duplicate DID's are not allowed: {}".format(','.join(sorted(duplicates))))
+
+    db.bulk_insert_mappings(InboundMapping, mappings)
+    return [mapping['prefix'] for mapping in mappings]
+
+
+def updateInboundMappings(items, db):
+    """
+    Update a batch of inbound mappings
+
+    :param items:   the changes, each with the ruleid to update and any of did, servers and name
+    :type items:    list[dict]
+    :param db:      session to update the mappings with, the caller commits
+    :type db:       sqlalchemy.orm.Session
+    :return:        the updated rule ids
+    :rtype:         list
+    :raises:        werkzeug.exceptions.BadRequest|werkzeug.exceptions.NotFound
+    """
+    checkBatchItems(items, {'ruleid', 'did', 'servers', 'name'})
+
+    mappings = []
+    for i, item in enumerate(items):
+        try:
+            ruleid = int(item['ruleid'])
+        except (KeyError, ValueError, TypeError):
+            raise http_exceptions.BadRequest('Item {}: a valid ruleid is required'.format(i))
+        mapping = parseInboundMappingFields(item, i)
+        if len(mapping) == 0:
+            raise http_exceptions.BadRequest('Item {}: No data args supplied, {{did, servers, name}} is required'.format(i))
+        mapping['ruleid'] = ruleid
+        mappings.append(mapping)
+
+    ruleids = [mapping['ruleid'] for mapping in mappings]
+    found = {ruleid for ruleid, in db.query(InboundMapping.ruleid).filter(
+        InboundMapping.groupid == settings.FLT_INBOUND).filter(InboundMapping.ruleid.in_(ruleids))}
+    missing = set(ruleids) - found
+    if len(missing) > 0:
+        raise http_exceptions.NotFound('No Matching Rule Found: {}'.format(','.join(str(ruleid) for ruleid in sorted(missing))))
+
+    dids = [mapping['prefix'] for mapping in mappings if 'prefix' in mapping]
+    if len(dids) > 0:
+        # only the rules whose DID changes give up their current DID,
+        # the other rules of the batch keep theirs and are checked like any other rule
+        changing_ruleids = {mapping['ruleid'] for mapping in mappings if 'prefix' in mapping}
+        duplicates = findDuplicateDIDs(dids, db, exclude_ruleids=list(changing_ruleids))
+        if len(duplicates) > 0:
+            raise http_exceptions.BadRequest("Duplicate DID's are not allowed: {}".format(','.join(sorted(duplicates))))
+
+    db.bulk_update_mappings(InboundMapping, mappings)
+    return ruleids
+
+
+def deleteInboundMappings(items, db):
+    """
+    Delete a batch of inbound mappings
+
+    :param items:   the mappings to delete, each with either a ruleid or a did
+    :type items:    list[dict]
+    :param db:      session to delete the mappings with, the caller commits
+    :type db:       sqlalchemy.orm.Session
+    :return:        number of deleted mappings
+    :rtype:         int
+    :raises:        werkzeug.exceptions.BadRequest
+    """
+    checkBatchItems(items, {'ruleid', 'did'})
+
+    ruleids = []
+    dids = []
+    for i, item in enumerate(items):
+        if 'ruleid' in item:
+            try:
+                ruleids.append(int(item['ruleid']))
+            except (ValueError, TypeError):
+                raise http_exceptions.BadRequest('Item {}: Invalid ruleid'.format(i))
+        elif 'did' in item:
+            dids.append(str(item['did']))
+        else:
+            raise http_exceptions.BadRequest('Item {}: One of the following is required: {{ruleid, or did}}'.format(i))
+
+    return db.query(InboundMapping).filter(InboundMapping.groupid == settings.FLT_INBOUND).filter(
+        InboundMapping.ruleid.in_(ruleids) | InboundMapping.prefix.in_(dids)).delete(synchronize_session=False)
+
+
+def getInboundMappingsPage(db, limit, offset=0, sort='ruleid', order='asc', search=None, gwgroupid=None):
+    """
+    Get a page of the inbound mapping view
+
+    The rules are filtered, sorted and paged first, the forwarding settings are only
+    joined to the rules of the page.
+
+    :param db:          session to query in
+    :type db:           :class:`sqlalchemy.orm.Session`
+    :param limit:       max number of rows on the page
+    :type limit:        int
+    :param offset:      number of rows to skip
+    :type offset:       int
+    :param sort:        column to sort on, one of INBOUND_PAGE_SORT_COLUMNS
+    :type sort:         str
+    :param order:       asc or desc
+    :type order:        str
+    :param search:      only return the rules whose DID starts with this
+    :type search:       str|None
+    :param gwgroupid:   only return the rules of this endpoint group
+    :type gwgroupid:    int|str|None
+    :return:            number of matching rules and the rows of the page
+    :rtype:             tuple
+    :raises:            ValueError on an invalid sort column or order
+    """
+    if sort not in INBOUND_PAGE_SORT_COLUMNS:
+        raise ValueError('sort must be one of: {}'.format(', '.join(INBOUND_PAGE_SORT_COLUMNS)))
+    if order not in ('asc', 'desc'):
+        raise ValueError('order must be asc or desc')
+
+    where = 'r.groupid = :flt_inbound'
+    params = {'flt_inbound': settings.FLT_INBOUND, 'flt_outbound': settings.FLT_OUTBOUND}
+    if search:
+        where += ' AND r.prefix LIKE :search'
+        params['search'] = escape_like(search) + '%'
+    if gwgroupid is not None:
+        where += ' AND {gwgroupid} = :gwgroupid'
+        params['gwgroupid'] = int(str(gwgroupid).lstrip('#'))
+
+    gwgroupid_sql = getRulesGwgroupidSQL('r')
+    where = where.format(gwgroupid=gwgroupid_sql)
+    total = db.execute(text('SELECT COUNT(*) FROM dr_rules AS r WHERE ' + where), params).scalar()
+
+    params.update({'limit': limit, 'offset': offset})
+    rows = db.execute(text("""
+SELECT * FROM (
+    SELECT r.ruleid, r.groupid, r.prefix, r.gwlist, r.description AS rule_description, g.id AS gwgroupid, g.description AS gwgroup_description
+    FROM dr_rules AS r LEFT JOIN dr_gw_lists AS g ON g.id = {gwgroupid}
+    WHERE {where}
+    ORDER BY {sort_sql} {order}, r.ruleid {order}
+    LIMIT :limit OFFSET :offset
+) AS t1 LEFT JOIN (
+    SELECT hf.dr_ruleid AS hf_ruleid, hf.dr_groupid AS hf_groupid, hf.did AS hf_fwddid, g.id AS hf_gwgroupid FROM dsip_hardfwd AS hf LEFT JOIN dr_rules AS r ON hf.dr_groupid = r.groupid LEFT JOIN dr_gw_lists AS g ON g.id = {gwgroupid} WHERE hf.dr_groupid <> :flt_outbound
+    UNION ALL
+    SELECT hf.dr_ruleid AS hf_ruleid, hf.dr_groupid AS hf_groupid, hf.did AS hf_fwddid, NULL AS hf_gwgroupid FROM dsip_hardfwd AS hf LEFT JOIN dr_rules AS r ON hf.dr_ruleid = r.ruleid WHERE hf.dr_groupid = :flt_outbound
+) AS t2 ON t1.ruleid = t2.hf_ruleid LEFT JOIN (
+    SELECT ff.dr_ruleid AS ff_ruleid, ff.dr_groupid AS ff_groupid, ff.did AS ff_fwddid, g.id AS ff_gwgroupid FROM dsip_failfwd AS ff LEFT JOIN dr_rules AS r ON ff.dr_groupid = r.groupid LEFT JOIN dr_gw_lists AS g ON g.id = {gwgroupid} WHERE ff.dr_groupid <> :flt_outbound
+    UNION ALL
+    SELECT ff.dr_ruleid AS ff_ruleid, ff.dr_groupid AS ff_groupid, ff.did AS ff_fwddid, NULL AS ff_gwgroupid FROM dsip_failfwd AS ff LEFT JOIN dr_rules AS r ON ff.dr_ruleid = r.ruleid WHERE ff.dr_groupid = :flt_outbound
+) AS t3 ON t1.ruleid = t3.ff_ruleid
+ORDER BY t1.{sort} {order}, t1.ruleid {order}""".format(where=where, sort=sort, order=order, gwgroupid=gwgroupid_sql,
+                                                     sort_sql=INBOUND_PAGE_SORT_COLUMNS[sort].format(gwgroupid=gwgroupid_sql))), params).mappings().all()
+
+    return total, [dict(row) for row in rows]
@@ -1,112 +1,259 @@
-import requests
+import time
 from shared import IO
 import settings
 from util.security import AES_CTR
+from util.ipc import STATE_SHMEM_NAME, getSharedMemoryDict
 from werkzeug import exceptions as http_exceptions
+from modules.api.kamailio.rpc import getKamRPCClient, reportRPCResults
 import sys
 
 if sys.path[0] != '/etc/dsiprouter/gui':
     sys.path.insert(0, '/etc/dsiprouter/gui')
 
 
+# kamailio resources that can be reloaded individually and the rpc commands reloading them
+# the order here is the order a full reload is performed in
+KAM_RELOAD_COMMANDS = {
+    'tls': [('tls.reload', None)],
+    'permissions': [('permissions.addressReload', None)],
+    'drouting': [('drouting.reload', None)],
+    'domain': [('domain.reload', None)],
+    'dispatcher': [('dispatcher.reload', None)],
+    'maintmode': [('htable.reload', ["maintmode"])],
+    # the lcrindex htable is the prefix index of the tofromprefix rules, they are always reloaded together
+    'tofromprefix': [('htable.reload', ["tofromprefix"]), ('htable.reload', ["lcrindex"])],
+    'calllimit': [('htable.reload', ["calllimit"])],
+    'gw2gwgroup': [('htable.reload', ["gw2gwgroup"])],
+    'gwgroup2lb': [('htable.reload', ["gwgroup2lb"])],
+    'inbound_hardfwd': [('htable.reload', ["inbound_hardfwd"])],
+    'inbound_failfwd': [('htable.reload', ["inbound_failfwd"])],
+    'inbound_prefixmap': [('htable.reload', ["inbound_prefixmap"])],
+    #'enrichdnid_lnpmap': [('htable.reload', ["enrichdnid_lnpmap"])],
+    'dr_rules': [('htable.reload', ["dr_rules"])],
+    'uac': [('uac.reg_reload', None)],
+    # the runtime config values, generated from the settings at reload time
+    'cfg': [],
+}
+# pending reload marker for changes that were not tracked to specific resources
+KAM_RELOAD_ALL = 'all'
+
+
+def getKamailioCfgCommands():
+    """
+    Build the rpc commands that push the dSIPRouter settings into kamailio's runtime config
+
+    :return:    list of (method, params) tuples
+    :rtype:     list
+    """
+    # format some settings for kam config
+    dsip_api_url = settings.DSIP_API_PROTO + '://' + '127.0.0.1' + ':' + str(settings.DSIP_API_PORT)
+    if isinstance(settings.DSIP_API_TOKEN, bytes):
+        dsip_api_token = AES_CTR.decrypt(settings.DSIP_API_TOKEN)
+    else:
+        dsip_api_token = settings.DSIP_API_TOKEN
+
+    cfg_cmds = [
+        ('cfg.sets', ['teleblock', 'gw_enabled', str(settings.TELEBLOCK_GW_ENABLED)]),
+        ('cfg.sets', ['server', 'role', settings.ROLE]),
+        ('cfg.sets', ['server', 'api_server', dsip_api_url]),
+        ('cfg.sets', ['server', 'api_token', dsip_api_token])
+    ]
+
+    if settings.TELEBLOCK_GW_ENABLED:
+        cfg_cmds.append(
+            ('cfg.sets',
+             ['teleblock', 'gw_ip', str(settings.TELEBLOCK_GW_IP)]))
+        cfg_cmds.append(
+            ('cfg.sets',
+             ['teleblock', 'gw_port', str(settings.TELEBLOCK_GW_PORT)]))
+        cfg_cmds.append(
+            ('cfg.sets',
+             ['teleblock', 'media_ip', str(settings.TELEBLOCK_MEDIA_IP)]))
+        cfg_cmds.append(
+            ('cfg.seti',
+             ['teleblock', 'media_port', str(settings.TELEBLOCK_MEDIA_PORT)]))
+
+    # Settings for TransNexus
+    cfg_cmds.append(
+        ('cfg.sets',
+         ['transnexus', 'authservice_enabled', str(settings.TRANSNEXUS_AUTHSERVICE_ENABLED)]))
+    cfg_cmds.append(
+        ('cfg.sets',
+         ['transnexus', 'authservice_host', str(settings.TRANSNEXUS_AUTHSERVICE_HOST)]))
+    cfg_cmds.append(
+        ('cfg.sets',
+         ['transnexus', 'verifyservice_enabled', str(settings.TRANSNEXUS_VERIFYSERVICE_ENABLED)]))
+    cfg_cmds.append(
+        ('cfg.sets',
+         ['transnexus', 'verifyservice_host', str(settings.TRANSNEXUS_VERIFYSERVICE_HOST)]))
+
+    # Settings for STIR/SHAKEN
+    cfg_cmds.append(
+        ('cfg.sets',
+         ['stir_shaken', 'stir_shaken_enabled', str(settings.STIR_SHAKEN_ENABLED)]))
+    cfg_cmds.append(
+        ('cfg.sets',
+         ['stir_shaken', 'stir_shaken_prefix_a', str(settings.STIR_SHAKEN_PREFIX_A)]))
+    cfg_cmds.append(
+        ('cfg.sets',
+         ['stir_shaken', 'stir_shaken_prefix_b', str(settings.STIR_SHAKEN_PREFIX_B)]))
+    cfg_cmds.append(
+        ('cfg.sets',
+         ['stir_shaken', 'stir_shaken_prefix_c', str(settings.STIR_SHAKEN_PREFIX_C)]))
+    cfg_cmds.append(
+        ('cfg.sets',
+         ['stir_shaken', 'stir_shaken_prefix_invalid', str(settings.STIR_SHAKEN_PREFIX_INVALID)]))
+    cfg_cmds.append(
+        ('cfg.sets',
+         ['stir_shaken', 'stir_shaken_block_invalid', str(settings.STIR_SHAKEN_BLOCK_INVALID)]))
+    cfg_cmds.append(
+        ('cfg.sets',
+         ['stir_shaken', 'stir_shaken_key_path', str(settings.STIR_SHAKEN_KEY_PATH)]))
+    cfg_cmds.append(
+        ('cfg.sets',
+         ['stir_shaken', 'stir_shaken_cert_url', str(settings.STIR_SHAKEN_CERT_URL)]))
+
+    return cfg_cmds
+
+
+def markKamailioReloadRequired(*resources):
+    """
+    Record the kamailio resources a change touched so the next reload only reloads those
+
+    :param resources:   names of the resources from KAM_RELOAD_COMMANDS, none means a full reload is required
+    :type resources:    str
+    :return:            None
+    :rtype:             None
+    :raises:            ValueError
+    """
+    for resource in resources:
+        if resource not in KAM_RELOAD_COMMANDS:
+            raise ValueError('unknown kamailio reload resource: {}'.format(resource))
+
+    state = getSharedMemoryDict(STATE_SHMEM_NAME)
+    with state.lock:
+        pending = set(state.get('kam_reload_pending', []))
+        if len(resources) == 0:
+            pending.add(KAM_RELOAD_ALL)
+        else:
+            pending.update(resources)
+        state['kam_reload_pending'] = sorted(pending)
+        state['kam_reload_required'] = True
+
+
+def getPendingKamailioReloads():
+    """
+    Get the kamailio resources waiting to be reloaded
+
+    :return:    names of the pending resources, KAM_RELOAD_ALL if a full reload is required
+    :rtype:     list
+    """
+    state = getSharedMemoryDict(STATE_SHMEM_NAME)
+    pending = list(state.get('kam_reload_pending', []))
+    # changes recorded before the pending set existed are not tracked
+    if len(pending) == 0 and state['kam_reload_required']:
+        return [KAM_RELOAD_ALL]
+    return pending
+
+
+def clearKamailioReloadRequired():
+    """
+    Mark all pending kamailio changes as reloaded
+
+    :return:    the resources that were pending
+    :rtype:     list
+    """
+    state = getSharedMemoryDict(STATE_SHMEM_NAME)
+    with state.lock:
+        pending = getPendingKamailioReloads()
+        state['kam_reload_pending'] = []
+        state['kam_reload_required'] = False
+    return pending
+
+
+def pushHtableUpdates(updates):
+    """
+    Apply row level changes to kamailio htables in place instead of reloading them
+
+    If any of the changes can not be applied the htables they belong to are marked for a reload,
+    so the change is never lost, only delayed until the next reload.
+
+    :param updates:     list of (htable, key, value) tuples, a value of None deletes the key
+    :type updates:      list
+    :return:            whether all the changes were applied
+    :rtype:             bool
+    """
+    if len(updates) == 0:
+        return True
+
+    cmds = []
+    for htable, key, value in updates:
+        if value is None:
+            cmds.append(('htable.delete', [htable, key]))
+        elif isinstance(value, int):
+            cmds.append(('htable.seti', [htable, key, value]))
+        else:
+            cmds.append(('htable.sets', [htable, key, value]))
+
+    try:
+        failed = {res.params[0] for res in reportRPCResults(getKamRPCClient().batch(cmds))}
+    except Exception as ex:
+        IO.logerr('could not push htable updates to kamailio: {}'.format(str(ex)))
+        failed = {htable for htable, _, _ in updates}
+
+    # only the htables a change could not be applied to need a reload
+    if len(failed) > 0:
+        markKamailioReloadRequired(*sorted(failed))
+        return False
+    return True
+
+
+def getReloadCommands(resources=None):
+    """
+    Build the rpc commands needed to reload some kamailio resources
+
+    :param resources:   names of the resources to reload, None or KAM_RELOAD_ALL reloads everything
+    :type resources:    list|None
+    :return:            list of (method, params) tuples
+    :rtype:             list
+    """
+    if resources is None or KAM_RELOAD_ALL in resources:
+        resources = KAM_RELOAD_COMMANDS.keys()
+    else:
+        resources = [resource for resource in KAM_RELOAD_COMMANDS if resource in resources]
+
+    reload_cmds = []
+    for resource in resources:
+        if resource == 'cfg':
+            reload_cmds.extend(getKamailioCfgCommands())
+        else:
+            reload_cmds.extend(KAM_RELOAD_COMMANDS[resource])
+    return reload_cmds
+
+
 # TODO: parse enabled features from kamailio config and only reload enabled ones
 #       we would want to separate the feature definitions into a separate file to do this
-def reloadKamailio():
+def reloadKamailio(resources=None):
+    """
+    Reload kamailio's in-memory data and runtime config
+
+    :param resources:   names of the resources to reload, None reloads everything
+    :type resources:    list|None
+    :return:            None
+    :rtype:             None
+    :raises:            werkzeug.exceptions.HTTPException
+    """
     try:
-        # format some settings for kam config
-        dsip_api_url = settings.DSIP_API_PROTO + '://' + '127.0.0.1' + ':' + str(settings.DSIP_API_PORT)
-        if isinstance(settings.DSIP_API_TOKEN, bytes):
-            dsip_api_token = AES_CTR.decrypt(settings.DSIP_API_TOKEN)
-        else:
-            dsip_api_token = settings.DSIP_API_TOKEN
-
-        reload_cmds = [
-            {'method': 'tls.reload', 'jsonrpc': '2.0', 'id': 1},
-            {"method": "permissions.addressReload", "jsonrpc": "2.0", "id": 1},
-            {'method': 'drouting.reload', 'jsonrpc': '2.0', 'id': 1},
-            {'method': 'domain.reload', 'jsonrpc': '2.0', 'id': 1},
-            {'method': 'dispatcher.reload', 'jsonrpc': '2.0', 'id': 1},
-            {'method': 'htable.reload', 'jsonrpc': '2.0', 'id': 1, 'params': ["maintmode"]},
-            {'method': 'htable.reload', 'jsonrpc': '2.0', 'id': 1, 'params': ["tofromprefix"]},
-            {'method': 'htable.reload', 'jsonrpc': '2.0', 'id': 1, 'params': ["calllimit"]},
-            {'method': 'htable.reload', 'jsonrpc': '2.0', 'id': 1, 'params': ["gw2gwgroup"]},
-            {'method': 'htable.reload', 'jsonrpc': '2.0', 'id': 1, 'params': ["gwgroup2lb"]},
-            {'method': 'htable.reload', 'jsonrpc': '2.0', 'id': 1, 'params': ["inbound_hardfwd"]},
-            {'method': 'htable.reload', 'jsonrpc': '2.0', 'id': 1, 'params': ["inbound_failfwd"]},
-            {'method': 'htable.reload', 'jsonrpc': '2.0', 'id': 1, 'params': ["inbound_prefixmap"]},
-            #{'method': 'htable.reload', 'jsonrpc': '2.0', 'id': 1, 'params': ["enrichdnid_lnpmap"]},
-            {'method': 'htable.reload', 'jsonrpc': '2.0', 'id': 1, 'params': ["dr_rules"]},
-            {'method': 'uac.reg_reload', 'jsonrpc': '2.0', 'id': 1},
-            {'method': 'cfg.sets', 'jsonrpc': '2.0', 'id': 1, 'params': ['teleblock', 'gw_enabled', str(settings.TELEBLOCK_GW_ENABLED)]},
-            {'method': 'cfg.sets', 'jsonrpc': '2.0', 'id': 1, 'params': ['server', 'role', settings.ROLE]},
-            {'method': 'cfg.sets', 'jsonrpc': '2.0', 'id': 1, 'params': ['server', 'api_server', dsip_api_url]},
-            {'method': 'cfg.sets', 'jsonrpc': '2.0', 'id': 1, 'params': ['server', 'api_token', dsip_api_token]}
-        ]
-
-        if settings.TELEBLOCK_GW_ENABLED:
-            reload_cmds.append(
-                {'method': 'cfg.sets', 'jsonrpc': '2.0', 'id': 1,
-                 'params': ['teleblock', 'gw_ip', str(settings.TELEBLOCK_GW_IP)]})
-            reload_cmds.append(
-                {'method': 'cfg.sets', 'jsonrpc': '2.0', 'id': 1,
-                 'params': ['teleblock', 'gw_port', str(settings.TELEBLOCK_GW_PORT)]})
-            reload_cmds.append(
-                {'method': 'cfg.sets', 'jsonrpc': '2.0', 'id': 1,
-                 'params': ['teleblock', 'media_ip', str(settings.TELEBLOCK_MEDIA_IP)]})
-            reload_cmds.append(
-                {'method': 'cfg.seti', 'jsonrpc': '2.0', 'id': 1,
-                 'params': ['teleblock', 'media_port', str(settings.TELEBLOCK_MEDIA_PORT)]})
-
-        # Settings for TransNexus
-        reload_cmds.append(
-            {'method': 'cfg.sets', 'jsonrpc': '2.0', 'id': 1,
-             'params': ['transnexus', 'authservice_enabled', str(settings.TRANSNEXUS_AUTHSERVICE_ENABLED)]})
-        reload_cmds.append(
-            {'method': 'cfg.sets', 'jsonrpc': '2.0', 'id': 1,
-             'params': ['transnexus', 'authservice_host', str(settings.TRANSNEXUS_AUTHSERVICE_HOST)]})
-        reload_cmds.append(
-            {'method': 'cfg.sets', 'jsonrpc': '2.0', 'id': 1,
-             'params': ['transnexus', 'verifyservice_enabled', str(settings.TRANSNEXUS_VERIFYSERVICE_ENABLED)]})
-        reload_cmds.append(
-            {'method': 'cfg.sets', 'jsonrpc': '2.0', 'id': 1,
-             'params': ['transnexus', 'verifyservice_host', str(settings.TRANSNEXUS_VERIFYSERVICE_HOST)]})
-
-        # Settings for STIR/SHAKEN
-        reload_cmds.append(
-            {'method': 'cfg.sets', 'jsonrpc': '2.0', 'id': 1,
-             'params': ['stir_shaken', 'stir_shaken_enabled', str(settings.STIR_SHAKEN_ENABLED)]})
-        reload_cmds.append(
-            {'method': 'cfg.sets', 'jsonrpc': '2.0', 'id': 1,
-             'params': ['stir_shaken', 'stir_shaken_prefix_a', str(settings.STIR_SHAKEN_PREFIX_A)]})
-        reload_cmds.append(
-            {'method': 'cfg.sets', 'jsonrpc': '2.0', 'id': 1,
-             'params': ['stir_shaken', 'stir_shaken_prefix_b', str(settings.STIR_SHAKEN_PREFIX_B)]})
-        reload_cmds.append(
-            {'method': 'cfg.sets', 'jsonrpc': '2.0', 'id': 1,
-             'params': ['stir_shaken', 'stir_shaken_prefix_c', str(settings.STIR_SHAKEN_PREFIX_C)]})
-        reload_cmds.append(
-            {'method': 'cfg.sets', 'jsonrpc': '2.0', 'id': 1,
-             'params': ['stir_shaken', 'stir_shaken_prefix_invalid', str(settings.STIR_SHAKEN_PREFIX_INVALID)]})
-        reload_cmds.append(
-            {'method': 'cfg.sets', 'jsonrpc': '2.0', 'id': 1,
-             'params': ['stir_shaken', 'stir_shaken_block_invalid', str(settings.STIR_SHAKEN_BLOCK_INVALID)]})
-        reload_cmds.append(
-            {'method': 'cfg.sets', 'jsonrpc': '2.0', 'id': 1,
-             'params': ['stir_shaken', 'stir_shaken_key_path', str(settings.STIR_SHAKEN_KEY_PATH)]})
-        reload_cmds.append(
-            {'method': 'cfg.sets', 'jsonrpc': '2.0', 'id': 1,
-             'params': ['stir_shaken', 'stir_shaken_cert_url', str(settings.STIR_SHAKEN_CERT_URL)]})
-
-        for cmdset in reload_cmds:
-            r = requests.get('http://127.0.0.1:5060/api/kamailio', json=cmdset)
-            if r.status_code >= 400:
-                try:
-                    msg = r.json()['error']['message']
-                except:
-                    msg = r.reason
-                ex = http_exceptions.HTTPException(msg)
-                ex.code = r.status_code
-                raise ex
+        reload_cmds = getReloadCommands(resources)
+
+        start = time.perf_counter()
+        results = getKamRPCClient().batch(reload_cmds)
+        failures = reportRPCResults(results)
+        IO.logdbg('kamailio reload of {} commands took {:.3f}s'.format(len(results), time.perf_counter() - start))
+        if len(failures) > 0:
+            ex = http_exceptions.HTTPException('; '.join('{} failed: {}'.format(res.method, res.error) for res in failures))
+            ex.code = 500
+            raise ex
 
         IO.printinfo("[---- Reloaded Kamailio with dSIPRouter Settings ----]")
     except Exception as ex:
@@ -0,0 +1,244 @@
+# make sure the generated source files are imported instead of the template ones
+import sys
+if sys.path[0] != '/etc/dsiprouter/gui':
+    sys.path.insert(0, '/etc/dsiprouter/gui')
+
+import os, json, select, threading, time, uuid
+import requests
+from werkzeug import exceptions as http_exceptions
+from shared import IO
+
+# the jsonrpcs endpoint exposed by the xhttp module in kamailio.cfg
+KAM_RPC_URL = 'http://127.0.0.1:5060/api/kamailio'
+# seconds to wait for kamailio to answer a request
+KAM_RPC_TIMEOUT = 10
+# the jsonrpcs FIFO transport configured in kamailio.cfg, the dsiprouter user is in the kamailio group
+KAM_RPC_FIFO = '/var/run/kamailio/kamailio_rpc.fifo'
+# directory kamailio writes the FIFO replies to, the fifo_reply_dir of jsonrpcs
+KAM_RPC_FIFO_REPLY_DIR = '/tmp'
+
+
+class KamRPCResult():
+    """
+    Outcome of a single Kamailio RPC command
+    """
+
+    def __init__(self, method, params=None, result=None, error=None, latency=0.0):
+        """
+        :param method:      rpc method that was called
+        :type method:       str
+        :param params:      params the method was called with
+        :type params:       list|None
+        :param result:      result returned by kamailio
+        :type result:       object
+        :param error:       error message if the command failed
+        :type error:        str|None
+        :param latency:     round trip time of the command in seconds
+        :type latency:      float
+        """
+        self.method = method
+        self.params = params
+        self.result = result
+        self.error = error
+        self.latency = latency
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return '<KamRPCResult method={} params={} ok={} latency={:.3f}s>'.format(
+            self.method, self.params, self.ok, self.latency)
+
+
+class KamailioRPC():
+    """
+    Client for Kamailio's jsonrpcs interface
+
+    Single commands are sent over HTTP, reusing a single keep-alive session.
+    jsonrpcs does not run JSON-RPC batch arrays, so multiple commands are pipelined over its
+    FIFO transport instead: every command is written to the FIFO without waiting for a reply,
+    then the replies are read back from a reply FIFO, so a reload costs one exchange instead
+    of a round trip per command. When the FIFO can not be used the commands are sent over HTTP
+    one after the other.
+    """
+
+    def __init__(self, url=KAM_RPC_URL, timeout=KAM_RPC_TIMEOUT, fifo=KAM_RPC_FIFO, fifo_reply_dir=KAM_RPC_FIFO_REPLY_DIR):
+        self.url = url
+        self.timeout = timeout
+        self.fifo = fifo
+        self.fifo_reply_dir = fifo_reply_dir
+        self.session = requests.Session()
+        # requests sessions are not safe to share between threads
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def buildCommand(method, params=None, id=1):
+        cmd = {'method': method, 'jsonrpc': '2.0', 'id': id}
+        if params is not None:
+            cmd['params'] = params
+        return cmd
+
+    @staticmethod
+    def _parseResponse(method, params, response, latency):
+        if 'error' in response:
+            return KamRPCResult(method, params, error=response['error'].get('message', str(response['error'])), latency=latency)
+        return KamRPCResult(method, params, result=response.get('result', None), latency=latency)
+
+    def _post(self, payload):
+        with self._lock:
+            start = time.perf_counter()
+            r = self.session.post(self.url, json=payload, timeout=self.timeout)
+            latency = time.perf_counter() - start
+        return r, latency
+
+    def _send(self, method, params=None):
+        r, latency = self._post(KamailioRPC.buildCommand(method, params))
+        try:
+            response = r.json()
+        except ValueError:
+            return KamRPCResult(method, params, error=r.reason, latency=latency)
+        if r.status_code >= 400 and 'error' not in response:
+            return KamRPCResult(method, params, error=r.reason, latency=latency)
+        return KamailioRPC._parseResponse(method, params, response, latency)
+
+    def _readReplies(self, fd, count, deadline):
+        # the replies are JSON documents written one after the other, pretty printed over several lines
+        decoder = json.JSONDecoder()
+        buffer = ''
+        replies = {}
+        while len(replies) < count:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 or len(select.select([fd], [], [], remaining)[0]) == 0:
+                break
+            buffer += os.read(fd, 65536).decode('utf-8')
+            while True:
+                buffer = buffer.lstrip()
+                try:
+                    reply, end = decoder.raw_decode(buffer)
+                except ValueError:
+                    break
+                replies[reply.get('id', None)] = reply
+                buffer = buffer[end:]
+        return replies
+
+    def _sendFifo(self, commands):
+        reply_name = 'dsiprouter_rpc_{}_{}'.format(os.getpid(), uuid.uuid4().hex)
+        reply_fifo = os.path.join(self.fifo_reply_dir, reply_name)
+
+        with self._lock:
+            os.mkfifo(reply_fifo)
+            try:
+                # kamailio runs as its own user and opens the reply FIFO to write to it
+                os.chmod(reply_fifo, 0o622)
+                # opened read/write so the FIFO never reads EOF between two replies
+                reply_fd = os.open(reply_fifo, os.O_RDWR | os.O_NONBLOCK)
+                try:
+                    # fails right away if kamailio is not reading the FIFO
+                    fifo_fd = os.open(self.fifo, os.O_WRONLY | os.O_NONBLOCK)
+                    try:
+                        os.set_blocking(fifo_fd, True)
+                        start = time.perf_counter()
+                        # one write per command, writes below PIPE_BUF are not interleaved with other writers
+                        for i, (method, params) in enumerate(commands, 1):
+                            cmd = KamailioRPC.buildCommand(method, params, id=i)
+                            cmd['reply_name'] = reply_name
+                            os.write(fifo_fd, (json.dumps(cmd) + '\n').encode('utf-8'))
+                    finally:
+                        os.close(fifo_fd)
+                    replies = self._readReplies(reply_fd, len(commands), start + self.timeout)
+                    latency = time.perf_counter() - start
+                finally:
+                    os.close(reply_fd)
+            finally:
+                os.remove(reply_fifo)
+
+        # the individual latencies are not known when pipelining, each command reports the whole exchange
+        results = []
+        for i, (method, params) in enumerate(commands, 1):
+            if i in replies:
+                results.append(KamailioRPC._parseResponse(method, params, replies[i], latency))
+            else:
+                results.append(KamRPCResult(method, params, error='no reply from kamailio', latency=latency))
+        return results
+
+    def call(self, method, *params):
+        """
+        Run a single rpc command
+
+        :param method:  rpc method to run
+        :type method:   str
+        :param params:  params for the method
+        :type params:   str|int
+        :return:        the result of the command
+        :rtype:         object
+        :raises:        werkzeug.exceptions.HTTPException
+        """
+        res = self._send(method, list(params) if len(params) > 0 else None)
+        if not res.ok:
+            ex = http_exceptions.HTTPException('{} failed: {}'.format(method, res.error))
+            ex.code = 500
+            raise ex
+        return res.result
+
+    def batch(self, commands):
+        """
+        Run multiple rpc commands, pipelined over the jsonrpcs FIFO
+
+        :param commands:    list of (method, params) tuples, params may be None
+        :type commands:     list
+        :return:            the outcome of each command in the same order
+        :rtype:             list[KamRPCResult]
+        """
+        if len(commands) == 0:
+            return []
+
+        try:
+            return self._sendFifo(commands)
+        except OSError as ex:
+            IO.logdbg('kamailio jsonrpcs FIFO {} is not usable, sending rpc commands over http: {}'.format(self.fifo, str(ex)))
+
+        return [self._send(method, params) for method, params in commands]
+
+    def close(self):
+        self.session.close()
+
+
+# shared by every caller in this process so the keep-alive connection is reused
+_kam_rpc_client = None
+_kam_rpc_client_lock = threading.Lock()
+
+
+def getKamRPCClient():
+    """
+    Get the process-wide Kamailio RPC client
+
+    :return:    the rpc client
+    :rtype:     KamailioRPC
+    """
+    global _kam_rpc_client
+
+    if _kam_rpc_client is None:
+        with _kam_rpc_client_lock:
+            if _kam_rpc_client is None:
+                _kam_rpc_client = KamailioRPC()
+    return _kam_rpc_client
+
+
+def reportRPCResults(results):
+    """
+    Log the latency and outcome of rpc commands
+
+    :param results:     outcome of the commands
+    :type results:      list[KamRPCResult]
+    :return:            the failed commands
+    :rtype:             list[KamRPCResult]
+    """
+    failures = []
+    for res in results:
+        if res.ok:
+            IO.logdbg('kamailio rpc {} {} completed in {:.3f}s'.format(res.method, res.params or '', res.latency))
+        else:
+            IO.logerr('kamailio rpc {} {} failed in {:.3f}s: {}'.format(res.method, res.params or '', res.latency, res.error))
+            failures.append(res)
+    return failures
@@ -1,8 +1,15 @@
 # FusionPBX Plugin for the Media Server api
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
 import json
 import uuid
+import threading
+
+# max number of connections kept open to the database of each PBX
+POOL_MAX_CONNECTIONS = 5
+# seconds a request waits for a free connection when all of them are in use
+POOL_WAIT_TIMEOUT = 10
 
 
 # Defining a dialplan object, which allows you to define how the
@@ -33,12 +40,13 @@ class cos():
 
     domain_uuid=""
     db = ""
-    dialplan_list = []
+    dialplan_list = None
     domain = None
 
     def __init__(self, domain,data=None):
         if domain.db:
             self.db = domain.db
+        self.dialplan_list = []
         self.domain_uuid = domain.domain_id
         self.domain = domain
 
@@ -136,6 +144,74 @@ class cos():
             return True
 
 
+class connectionPool():
+    """
+    Pool of connections to the database of a PBX
+
+    Blocks for up to POOL_WAIT_TIMEOUT seconds when all the connections are in use,
+    instead of failing right away like psycopg2's pools do.
+    """
+
+    def __init__(self, **params):
+        self.params = params
+        self.pool = psycopg2.pool.ThreadedConnectionPool(0, POOL_MAX_CONNECTIONS, **params)
+        self.slots = threading.BoundedSemaphore(POOL_MAX_CONNECTIONS)
+
+    def getconn(self):
+        if not self.slots.acquire(timeout=POOL_WAIT_TIMEOUT):
+            raise Exception("No free connection to FusionPBX: {} database".format(self.params['host']))
+        try:
+            db = self.pool.getconn()
+            # the connection was closed while it was idle in the pool
+            if db.closed:
+                self.pool.putconn(db, close=True)
+                db = self.pool.getconn()
+            return db
+        except Exception:
+            self.slots.release()
+            raise
+
+    def putconn(self, db):
+        try:
+            broken = db.closed != 0
+            if not broken:
+                try:
+                    # discard anything left uncommitted by the request
+                    db.rollback()
+                except psycopg2.Error:
+                    broken = True
+            self.pool.putconn(db, close=broken)
+        finally:
+            self.slots.release()
+
+    def closeall(self):
+        self.pool.closeall()
+
+
+# connection pools by PBX, shared by all the requests of the process
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def getPool(hostname, port, username, password, dbname):
+    """
+    Get the connection pool of a PBX, the pool is replaced when its credentials changed
+
+    :return:    the pool
+    :rtype:     :class:`connectionPool`
+    """
+    key = (hostname, str(port), dbname)
+    with _pools_lock:
+        pool = _pools.get(key, None)
+        if pool is None or pool.params['user'] != username or pool.params['password'] != password:
+            if pool is not None:
+                pool.closeall()
+            pool = connectionPool(host=hostname, port=port, user=username, password=password, dbname=dbname)
+            _pools[key] = pool
+            print("Connection pool to FusionPBX: {} database was created".format(hostname))
+        return pool
+
+
 class mediaserver():
 
     hostname=''
@@ -144,7 +220,8 @@ class mediaserver():
     username=''
     password=''
     dbname="fusionpbx"
-    db=''
+    db=None
+    pool=None
 
 
     def __init__(self, config):
@@ -154,23 +231,28 @@ class mediaserver():
         self.username = config.username
         self.password = config.password
         self.dbname = config.dbname
+        self.pool = getPool(self.hostname, self.port, self.username, self.password, self.dbname)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.closeConnection()
 
     def testConnection(self):
         print("testConnection")
         pass
 
     def getConnection(self):
-        try:
-            db = psycopg2.connect(host=self.hostname,port=self.port,user=self.username,password=self.password,dbname=self.dbname)
-            if db is not None:
-                print("Connection to FusionPBX: {} database was successful".format(self.hostname))
-                return db
-
-        except Exception as ex:
-            raise
+        # one pooled connection is shared by the domains / extensions of this mediaserver until it is closed
+        if self.db is None:
+            self.db = self.pool.getconn()
+        return self.db
 
     def closeConnection(self):
-        db.close()
+        if self.db is not None:
+            self.pool.putconn(self.db)
+            self.db = None
 
 class domain():
     domain_id=""
@@ -189,11 +271,12 @@ class domains():
 
     mediaserver=''
     db=''
-    domain_list = []
+    domain_list = None
 
     def __init__(self, mediaserver):
         self.mediaserver = mediaserver
         self.db = self.mediaserver.getConnection()
+        self.domain_list = []
 
     def create(self,data):
         #Todo: Check if the domain exists before creating it
@@ -330,11 +413,12 @@ class extensions():
     domain_name=''
     domain_uuid=''
     db=''
-    extension_list = []
+    extension_list = None
 
     def __init__(self, mediaserver, domain ,extension=None):
         self.mediaserver = mediaserver
         self.db = self.mediaserver.getConnection()
+        self.extension_list = []
         self.domain = domain
         self.domain_uuid = self.domain['domain_id']
         self.domain_name = self.domain['name']
@@ -1,7 +1,8 @@
-import importlib.util, os
+import importlib.util, os, threading
 from flask import Blueprint, render_template, abort, jsonify
 from util.security import api_security
-from database import startSession, DummySession, dSIPMultiDomainMapping
+from database import dSIPMultiDomainMapping
+from database.cache import domainmapping_cache
 from shared import debugEndpoint,StatusCodes, getRequestData
 from modules.api.api_functions import showApiError
 from werkzeug import exceptions as http_exceptions
@@ -13,6 +14,38 @@ import settings
 #       marked for implementation in v0.74
 
 
+# loaded plugin modules by plugin type, a plugin is only imported once per process
+_plugins = {}
+_plugins_lock = threading.Lock()
+
+
+def loadPlugin(plugin_type):
+    """
+    Get a mediaserver plugin, importing it on first use
+
+    :param plugin_type:     the plugin, one of the FLAGS.*_PLUGIN values
+    :type plugin_type:      str
+    :return:                the plugin module
+    :rtype:                 module
+    """
+    plugin = _plugins.get(plugin_type, None)
+    if plugin is not None:
+        return plugin
+
+    with _plugins_lock:
+        if plugin_type not in _plugins:
+            # Returns the Base directory of this file
+            base_dir = os.path.dirname(__file__)
+
+            # Use the Base Dir to specify the location of the plugin required for this domain
+            spec = importlib.util.spec_from_file_location("plugin.{}".format(plugin_type), "{}/plugin/{}/interface.py".format(base_dir,plugin_type))
+            plugin = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(plugin)
+            _plugins[plugin_type] = plugin
+            print("***Plugin {} was loaded***".format(plugin_type))
+        return _plugins[plugin_type]
+
+
 class config():
 
     hostname=''
@@ -29,51 +62,29 @@ class config():
 
     def __init__(self,config_id):
 
-        db = DummySession()
-
-        db = startSession()
-        try:
-            print("The config_id is {}".format(config_id))
-            domainMapping = db.query(dSIPMultiDomainMapping).filter(dSIPMultiDomainMapping.pbx_id == config_id).first()
-            if domainMapping is None:
-                raise Exception("Configuration doesn't exist")
-            else:
-                print("***In domain mapping***")
-                self.hostname=domainMapping.db_host
-                #self.port=domainMapping.port if "port" in domainMapping else "5432"
-                self.port="5432"
-                self.username=domainMapping.db_username
-                self.password=domainMapping.db_password
-                self.dbname="fusionpbx"
-
-                #response_payload['msg'] = 'Domain Configuration Exists'
-
-                if domainMapping.type == int(dSIPMultiDomainMapping.FLAGS.TYPE_FUSIONPBX.value):
-                    self.plugin_type = FLAGS.FUSIONPBX_PLUGIN
-                elif domainMapping.type == dSIPMultiDomainMapping.FLAGS.TYPE_FUSIONPBX_CLUSTER.value:
-                    self.plugin_type = FLAGS.FUSIONPBX_PLUGIN
-                elif domainMapping.type == dSIPMultiDomainMapping.FLAGS.TYPE_FREEPBX.value:
-                    self.plugin_type = FLAGS.FREEPBX_PLUGIN;
-                    raise Exception("FreePBX Plugin is not supported yet")
-                else:
-                    raise Exception("PBX plugin for config #{} can not be found".format(config_id))
-
-                # Import plugin
-
-                # Returns the Base directory of this file
-                base_dir = os.path.dirname(__file__)
-
-                # Use the Base Dir to specify the location of the plugin required for this domain
-                spec = importlib.util.spec_from_file_location("plugin.{}".format(self.plugin_type), "{}/plugin/{}/interface.py".format(base_dir,self.plugin_type))
-                self.plugin = importlib.util.module_from_spec(spec)
-                if spec.loader.exec_module(self.plugin):
-                    print("***Plugin was loaded***")
-                return
-
-        except Exception as ex:
-            raise ex
-        finally:
-            db.close()
+        # the mappings are cached for a short time, so provisioning requests do not query them each time
+        domainMapping = domainmapping_cache.get(config_id)
+        if domainMapping is None:
+            raise Exception("Configuration doesn't exist")
+
+        self.hostname=domainMapping['db_host']
+        #self.port=domainMapping.port if "port" in domainMapping else "5432"
+        self.port="5432"
+        self.username=domainMapping['db_username']
+        self.password=domainMapping['db_password']
+        self.dbname="fusionpbx"
+
+        if domainMapping['type'] == int(dSIPMultiDomainMapping.FLAGS.TYPE_FUSIONPBX.value):
+            self.plugin_type = FLAGS.FUSIONPBX_PLUGIN
+        elif domainMapping['type'] == dSIPMultiDomainMapping.FLAGS.TYPE_FUSIONPBX_CLUSTER.value:
+            self.plugin_type = FLAGS.FUSIONPBX_PLUGIN
+        elif domainMapping['type'] == dSIPMultiDomainMapping.FLAGS.TYPE_FREEPBX.value:
+            self.plugin_type = FLAGS.FREEPBX_PLUGIN;
+            raise Exception("FreePBX Plugin is not supported yet")
+        else:
+            raise Exception("PBX plugin for config #{} can not be found".format(config_id))
+
+        self.plugin = loadPlugin(self.plugin_type)
 
 
     def getPlugin(self):
@@ -147,8 +158,8 @@ def getDomains(config_id=None,domain_id=None):
             plugin = config_info.getPlugin()
             # Create instance of Media Server Class
             if plugin:
-                mediaserver = plugin.mediaserver(config_info)
-                if mediaserver:
+                # the pooled connection is returned when the request is done with it
+                with plugin.mediaserver(config_info) as mediaserver:
                     domains = plugin.domains(mediaserver)
                     # Use plugin to get list of domains by calling plugin.<pbxtype>.getDomain()
                     domain_list = domains.read(domain_id)
@@ -208,8 +219,8 @@ def postDomains():
             plugin = config_info.getPlugin()
             # Create instance of Media Server Class
             if plugin:
-                mediaserver = plugin.mediaserver(config_info)
-                if mediaserver:
+                # the pooled connection is returned when the request is done with it
+                with plugin.mediaserver(config_info) as mediaserver:
                     domains = plugin.domains(mediaserver)
                     domain = domains.create(data)
                     #Generate Close of Service
@@ -269,8 +280,8 @@ def putDomains():
             plugin = config_info.getPlugin()
             # Create instance of Media Server Class
             if plugin:
-                mediaserver = plugin.mediaserver(config_info)
-                if mediaserver:
+                # the pooled connection is returned when the request is done with it
+                with plugin.mediaserver(config_info) as mediaserver:
                     domains = plugin.domains(mediaserver)
                     domain_id = domains.update(data)
                     response_payload['msg'] = "Success"
@@ -323,8 +334,8 @@ def deleteDomains():
             plugin = config_info.getPlugin()
             # Create instance of Media Server Class
             if plugin:
-                mediaserver = plugin.mediaserver(config_info)
-                if mediaserver:
+                # the pooled connection is returned when the request is done with it
+                with plugin.mediaserver(config_info) as mediaserver:
                     domains = plugin.domains(mediaserver)
                     # Delete the domain
                     if domains.delete(domain_id):
@@ -385,8 +396,8 @@ def postExtensions():
             plugin = config_info.getPlugin()
             # Create instance of Media Server Class
             if plugin:
-                mediaserver = plugin.mediaserver(config_info)
-                if mediaserver:
+                # the pooled connection is returned when the request is done with it
+                with plugin.mediaserver(config_info) as mediaserver:
                     domains = plugin.domains(mediaserver)
                     domain = domains.read(domain_id)
                     print(domain_id)
@@ -460,8 +471,8 @@ def putExtensions():
             plugin = config_info.getPlugin()
             # Create instance of Media Server Class
             if plugin:
-                mediaserver = plugin.mediaserver(config_info)
-                if mediaserver:
+                # the pooled connection is returned when the request is done with it
+                with plugin.mediaserver(config_info) as mediaserver:
                     domains = plugin.domains(mediaserver)
                     domain = domains.read(domain_id)
                     print(domain_id)
@@ -528,8 +539,8 @@ def getExtensions(config_id=None,domain_id=None,extension_id=None):
             plugin = config_info.getPlugin()
             # Create instance of Media Server Class
             if plugin:
-                mediaserver = plugin.mediaserver(config_info)
-                if mediaserver:
+                # the pooled connection is returned when the request is done with it
+                with plugin.mediaserver(config_info) as mediaserver:
                     domains = plugin.domains(mediaserver)
                     domain = domains.read(domain_id)
                     extensions = plugin.extensions(mediaserver,domain[0])
@@ -588,8 +599,8 @@ def deleteExtensions():
             plugin = config_info.getPlugin()
             # Create instance of Media Server Class
             if plugin:
-                mediaserver = plugin.mediaserver(config_info)
-                if mediaserver:
+                # the pooled connection is returned when the request is done with it
+                with plugin.mediaserver(config_info) as mediaserver:
                     domains = plugin.domains(mediaserver)
                     domain = domains.read(domain_id)
                     if domain:
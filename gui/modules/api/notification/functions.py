@@ -0,0 +1,155 @@
+# make sure the generated source files are imported instead of the template ones
+import sys
+if sys.path[0] != '/etc/dsiprouter/gui':
+    sys.path.insert(0, '/etc/dsiprouter/gui')
+
+import os, time, threading
+from datetime import datetime
+from shared import IO, debugException
+from database import dSIPNotification
+from database.cache import gwgroup_cache, gateway_cache, notification_cache
+from util.notifications import sendEmail
+import settings
+
+# html body of the alert emails by notification type
+ALERT_HTML_TEMPLATES = {
+    dSIPNotification.FLAGS.TYPE_OVERLIMIT.value: 'Call Limit Exceeded in Endpoint Group [{}] on Endpoint [{}]',
+    dSIPNotification.FLAGS.TYPE_GWFAILURE.value: 'Failure Detected in Endpoint Group [{}] on Endpoint [{}]',
+}
+
+
+class AlertAggregator():
+    """
+    Collapses repeated endpoint group alerts into one email per window
+
+    Alerts are keyed on (gwgroupid, gwid, type). The first alert of a key is sent right away
+    and opens a window, the repeats received during the window are only counted and a single
+    digest is sent when it ends. Recording an alert only touches memory, the emails are built
+    and queued by a background thread, which is started on first use in the process that records.
+    """
+
+    def __init__(self, window=None):
+        """
+        :param window:  seconds repeats are collected for, defaults to settings.NOTIFICATION_DIGEST_WINDOW
+        :type window:   int|float|None
+        """
+        self.window = window
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+        self._alerts = {}
+        self._counters = {'received': 0, 'sent': 0, 'digests': 0, 'collapsed': 0, 'dropped': 0}
+
+    def _start(self):
+        # threads do not survive a fork, so (re)start it in the current process
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._alerts = {}
+        threading.Thread(target=self._work, name='alert-aggregator', daemon=True).start()
+
+    def record(self, gwgroupid, gwid, type, data):
+        """
+        Record an alert
+
+        :param gwgroupid:   endpoint group the alert is for
+        :type gwgroupid:    int
+        :param gwid:        endpoint the alert is for
+        :type gwid:         int|None
+        :param type:        dSIPNotification.FLAGS.TYPE_* value
+        :type type:         int
+        :param data:        the email fields, text_body and optionally subject and data
+        :type data:         dict
+        :return:            whether the alert was queued to be sent, False when it was collapsed into a digest
+        :rtype:             bool
+        """
+        key = (gwgroupid, gwid, type)
+        now = time.time()
+        window = self.window if self.window is not None else settings.NOTIFICATION_DIGEST_WINDOW
+
+        with self._lock:
+            self._start()
+            self._counters['received'] += 1
+
+            alert = self._alerts.get(key, None)
+            if alert is not None:
+                alert['repeats'] += 1
+                alert['last'] = now
+                self._counters['collapsed'] += 1
+                return False
+
+            self._alerts[key] = {'data': data, 'ends': now + window, 'first': now, 'last': now, 'repeats': 0, 'sent': False}
+        self._wakeup.set()
+        return True
+
+    def _work(self):
+        while True:
+            self._wakeup.wait(timeout=1)
+            self._wakeup.clear()
+
+            now = time.time()
+            due = []
+            with self._lock:
+                for key, alert in list(self._alerts.items()):
+                    if not alert['sent']:
+                        alert['sent'] = True
+                        due.append((key, alert['data'], None))
+                    if alert['ends'] <= now:
+                        del self._alerts[key]
+                        if alert['repeats'] > 0:
+                            due.append((key, alert['data'], alert))
+
+            for key, data, digest in due:
+                try:
+                    self._send(key, data, digest)
+                except Exception as ex:
+                    IO.logerr('could not send the notification for endpoint group {}: {}'.format(key[0], str(ex)))
+                    debugException(ex)
+
+    def _send(self, key, data, digest=None):
+        gwgroupid, gwid, type = key
+
+        notification = notification_cache.get((gwgroupid, type))
+        if notification is None:
+            return
+
+        gw_name = gateway_cache.getName(gwid) if gwid is not None else ''
+        gwgroup_name = gwgroup_cache.getName(gwgroupid)
+
+        email = dict(data)
+        if type in ALERT_HTML_TEMPLATES:
+            email['html_body'] = (
+                '<html><head><style>.error{{border: 1px solid; margin: 10px 0px; padding: 15px 10px 15px 50px; background-color: #FF5555;}}</style></head>'
+                '<body><div class="error"><strong>{}</strong></div></body>').format(
+                ALERT_HTML_TEMPLATES[type].format(gwgroup_name, gw_name))
+        if digest is not None:
+            email['text_body'] = '{}\r\n\nRepeated {} more time(s) between {} and {}\n'.format(
+                email['text_body'], digest['repeats'], datetime.fromtimestamp(digest['first']).strftime('%Y-%m-%d %H:%M:%S'),
+                datetime.fromtimestamp(digest['last']).strftime('%Y-%m-%d %H:%M:%S'))
+
+        # TODO: we only support email at this time, add support for slack
+        queued = True
+        if notification['method'] == dSIPNotification.FLAGS.METHOD_EMAIL.value:
+            email['recipients'] = [notification['value']]
+            queued = sendEmail(**email)
+        elif notification['method'] == dSIPNotification.FLAGS.METHOD_SLACK.value:
+            pass
+
+        with self._lock:
+            if not queued:
+                self._counters['dropped'] += 1
+            else:
+                self._counters['sent' if digest is None else 'digests'] += 1
+
+    def getMetrics(self):
+        """
+        :return:    number of open windows and the alert counters
+        :rtype:     dict
+        """
+        with self._lock:
+            metrics = dict(self._counters)
+            metrics['windows'] = len(self._alerts)
+        return metrics
+
+
+alert_aggregator = AlertAggregator()
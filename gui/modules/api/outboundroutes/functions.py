@@ -0,0 +1,384 @@
+# make sure the generated source files are imported instead of the template ones
+import sys
+if sys.path[0] != '/etc/dsiprouter/gui':
+    sys.path.insert(0, '/etc/dsiprouter/gui')
+
+from sqlalchemy.sql import text
+from shared import IO
+from database import OutboundRoutes, GatewayGroups, dSIPLCR, getRulesGwgroupidSQL
+from database.lcr import updateLCRIndex
+from modules.api.kamailio.functions import reloadKamailio, markKamailioReloadRequired
+from util.conversions import estimate_prefix_count, iter_prefixes, escape_like
+import settings
+
+# number of prefixes de-duplicated and inserted at a time
+OUTBOUND_WRITE_CHUNK_SIZE = 5000
+# number of rows of an import validated and upserted at a time
+OUTBOUND_IMPORT_CHUNK_SIZE = 5000
+# max number of prefixes a pattern in an import row may expand to
+OUTBOUND_IMPORT_MAX_EXPANSION = 1000
+# kamailio resources holding the outbound routes
+OUTBOUND_RELOAD_RESOURCES = ('drouting', 'dr_rules', 'tofromprefix')
+# columns the outbound routes view can be sorted on, the ruleid breaks the ties
+OUTBOUND_PAGE_SORT_COLUMNS = {
+    'ruleid': 'r.ruleid',
+    'prefix': 'r.prefix',
+    'priority': 'r.priority',
+    'routeid': 'r.routeid',
+    'gwgroupid': '{gwgroupid}',
+}
+
+
+def writeOutboundRoutes(prefixes, db, gwlist, groupid=None, name=None, priority=0, timerec='', routeid='',
+                        chunk_size=OUTBOUND_WRITE_CHUNK_SIZE):
+    """
+    Bulk write outbound routes for a list of literal prefixes
+
+    The prefixes are consumed lazily, so they can come straight from :func:`util.conversions.iter_prefixes`.
+    Each chunk is de-duplicated against the routes of the group in a single query and written
+    with a multi-row insert. The write runs in the caller's transaction, the caller commits it
+    and marks drouting / dr_rules for reload.
+
+    :param prefixes:    the literal prefixes to route
+    :type prefixes:     collections.abc.Iterable[str]
+    :param db:          session to write with
+    :type db:           sqlalchemy.orm.Session
+    :param gwlist:      the dr_rules gwlist, ex: #9 for a carrier group
+    :type gwlist:       str
+    :param groupid:     the dr_rules group, defaults to settings.FLT_OUTBOUND
+    :type groupid:      int|None
+    :param name:        name of the routes
+    :type name:         str|None
+    :param priority:    priority of the routes
+    :type priority:     int
+    :param timerec:     time recurrence of the routes
+    :type timerec:      str
+    :param routeid:     route to run when the routes match
+    :type routeid:      str
+    :param chunk_size:  number of prefixes processed per insert
+    :type chunk_size:   int
+    :return:            number of routes inserted and skipped because they already existed
+    :rtype:             dict
+    """
+    if groupid is None:
+        groupid = settings.FLT_OUTBOUND
+    description = 'name:{}'.format(name) if name is not None else ''
+    stats = {'inserted': 0, 'skipped': 0}
+
+    def flush(chunk):
+        if len(chunk) == 0:
+            return
+        # the earlier chunks are already inserted, so the query also skips the repeats across chunks
+        existing = {prefix for prefix, in db.query(OutboundRoutes.prefix).filter(
+            OutboundRoutes.groupid == groupid).filter(OutboundRoutes.prefix.in_(chunk))}
+        inserts = [{
+            'groupid': groupid, 'prefix': prefix, 'timerec': timerec, 'priority': priority,
+            'routeid': routeid, 'gwlist': gwlist, 'description': description
+        } for prefix in dict.fromkeys(chunk) if prefix not in existing]
+        if len(inserts) > 0:
+            db.bulk_insert_mappings(OutboundRoutes, inserts)
+        stats['inserted'] += len(inserts)
+        stats['skipped'] += len(chunk) - len(inserts)
+
+    chunk = []
+    for prefix in prefixes:
+        chunk.append(prefix)
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    flush(chunk)
+
+    return stats
+
+
+def parseOutboundRouteRow(row, override_gwgroupid, name):
+    """
+    Validate an import row and convert it to the route fields
+
+    Row format: prefix, carrier group id (optional when overridden), from prefix (optional),
+    cost (optional), priority (optional), name (optional). The prefix may be a pattern,
+    see :func:`util.conversions.iter_prefixes`.
+
+    :return:    (error, route), the error is None when the row is valid
+    :rtype:     tuple
+    """
+    prefix = row[0].strip()
+    fields = [field.strip() for field in row[1:]] + [''] * (6 - len(row))
+    gwgroupid = override_gwgroupid if override_gwgroupid is not None else fields[0].lstrip('#')
+    from_prefix = fields[1] if len(fields[1]) > 0 else None
+
+    if len(gwgroupid) == 0:
+        return 'Carrier group is required', None
+    if from_prefix is not None:
+        for c in from_prefix:
+            if c not in settings.DID_PREFIX_ALLOWED_CHARS:
+                return 'From prefix improperly formatted. Allowed characters: {}'.format(
+                    ','.join(settings.DID_PREFIX_ALLOWED_CHARS)), None
+    try:
+        cost = float(fields[2]) if len(fields[2]) > 0 else 0.0
+        if cost < 0 or cost >= 10:
+            raise ValueError()
+    except ValueError:
+        return 'Cost must be a number between 0 and 9.99', None
+    try:
+        priority = int(fields[3]) if len(fields[3]) > 0 else 0
+    except ValueError:
+        return 'Priority must be an integer', None
+
+    if len(fields[4]) > 0:
+        description = 'name:{}'.format(fields[4])
+    elif name is not None:
+        description = 'name:{}'.format(name)
+    else:
+        description = ''
+
+    if all(c in settings.DID_PREFIX_ALLOWED_CHARS for c in prefix):
+        prefixes = [prefix]
+    else:
+        try:
+            if estimate_prefix_count([prefix]) > OUTBOUND_IMPORT_MAX_EXPANSION:
+                return 'Prefix pattern expands to more than {} prefixes'.format(OUTBOUND_IMPORT_MAX_EXPANSION), None
+            prefixes = list(iter_prefixes([prefix]))
+        except ValueError as ex:
+            return str(ex), None
+        for expanded in prefixes:
+            for c in expanded:
+                if c not in settings.DID_PREFIX_ALLOWED_CHARS:
+                    return 'Prefix improperly formatted. Allowed characters: {}'.format(
+                        ','.join(settings.DID_PREFIX_ALLOWED_CHARS)), None
+
+    return None, {
+        'prefixes': prefixes, 'gwgroupid': gwgroupid, 'from_prefix': from_prefix, 'cost': cost,
+        'priority': priority, 'description': description
+    }
+
+
+def importOutboundRoutes(rows, db, override_gwgroupid=None, name=None, chunk_size=OUTBOUND_IMPORT_CHUNK_SIZE):
+    """
+    Bulk import outbound routes from a carrier rate deck
+
+    Rows are consumed lazily so the input can be streamed from a csv reader, see
+    :func:`parseOutboundRouteRow` for the row format. Routes with a from prefix are LCR routes,
+    they get a dsip_lcr entry and a dr_rules group of their own like the routes created in the GUI.
+    An existing route (same prefix and carrier group, or same LCR pattern) is updated, the other
+    routes are inserted. Each chunk is matched against the existing routes with one query per table
+    and written with multi-row statements. The whole import runs in the caller's transaction,
+    the caller commits it and reloads kamailio, see :func:`reloadOutboundRoutes`.
+
+    :param rows:                    rows to import, lines starting with '#' are skipped
+    :type rows:                     collections.abc.Iterable[list]
+    :param db:                      session to import with
+    :type db:                       sqlalchemy.orm.Session
+    :param override_gwgroupid:      carrier group to route all the prefixes to, ignoring the row value
+    :type override_gwgroupid:       int|str|None
+    :param name:                    name to use for rows without a name
+    :type name:                     str|None
+    :param chunk_size:              number of rows processed at a time
+    :type chunk_size:               int
+    :return:                        the report, the counts and the rejected rows
+    :rtype:                         dict
+    :raises:                        ValueError
+    """
+    report = {'inserted': 0, 'updated': 0, 'rejected': 0, 'rejects': []}
+
+    # carrier groups are checked in memory instead of once per row
+    gwgroupids = {str(gwgroupid) for gwgroupid, in db.query(GatewayGroups.id)}
+    if override_gwgroupid is not None and len(str(override_gwgroupid)) > 0:
+        override_gwgroupid = str(override_gwgroupid).lstrip('#')
+        if override_gwgroupid not in gwgroupids:
+            raise ValueError('carrier group {} does not exist'.format(override_gwgroupid))
+    else:
+        override_gwgroupid = None
+
+    # LCR routes are numbered from the last LCR group in use, as in the GUI
+    last_lcr_groupid = db.execute(
+        text('SELECT MAX(CAST(dr_groupid AS UNSIGNED)) FROM dsip_lcr '
+             'WHERE CAST(dr_groupid AS UNSIGNED) >= :min AND CAST(dr_groupid AS UNSIGNED) < :max'),
+        {'min': settings.FLT_LCR_MIN, 'max': settings.FLT_FWD_MIN}
+    ).scalar()
+    next_lcr_groupid = [int(last_lcr_groupid) + 1 if last_lcr_groupid is not None else settings.FLT_LCR_MIN]
+    # routes already seen in this import
+    seen = set()
+
+    def reject(rownum, prefix, reason):
+        report['rejected'] += 1
+        report['rejects'].append({'row': rownum, 'prefix': prefix, 'reason': reason})
+
+    def flush(chunk):
+        if len(chunk) == 0:
+            return
+        routes = [route for route in chunk if route['from_prefix'] is None]
+        lcr_routes = [route for route in chunk if route['from_prefix'] is not None]
+
+        rule_inserts, rule_updates = [], []
+
+        if len(routes) > 0:
+            existing = {(prefix, gwlist): ruleid for ruleid, prefix, gwlist in db.query(
+                OutboundRoutes.ruleid, OutboundRoutes.prefix, OutboundRoutes.gwlist).filter(
+                OutboundRoutes.groupid == settings.FLT_OUTBOUND).filter(
+                OutboundRoutes.prefix.in_({route['prefix'] for route in routes}))}
+            for route in routes:
+                gwlist = '#{}'.format(route['gwgroupid'])
+                ruleid = existing.get((route['prefix'], gwlist), None)
+                if ruleid is not None:
+                    rule_updates.append({'ruleid': ruleid, 'priority': route['priority'], 'description': route['description']})
+                else:
+                    rule_inserts.append({
+                        'groupid': settings.FLT_OUTBOUND, 'prefix': route['prefix'], 'timerec': '',
+                        'priority': route['priority'], 'routeid': '', 'gwlist': gwlist, 'description': route['description']
+                    })
+
+        if len(lcr_routes) > 0:
+            existing = {pattern: dr_groupid for pattern, dr_groupid in db.query(dSIPLCR.pattern, dSIPLCR.dr_groupid).filter(
+                dSIPLCR.pattern.in_({route['pattern'] for route in lcr_routes}))}
+            existing_rules = {}
+            if len(existing) > 0:
+                existing_rules = {str(groupid): ruleid for ruleid, groupid in db.query(OutboundRoutes.ruleid, OutboundRoutes.groupid).filter(
+                    OutboundRoutes.groupid.in_(set(existing.values())))}
+
+            lcr_inserts, lcr_updates = [], []
+            for route in lcr_routes:
+                gwlist = '#{}'.format(route['gwgroupid'])
+                groupid = existing.get(route['pattern'], None)
+                if groupid is not None:
+                    lcr_updates.append({'pattern': route['pattern'], 'cost': route['cost']})
+                    ruleid = existing_rules.get(str(groupid), None)
+                    if ruleid is not None:
+                        rule_updates.append({'ruleid': ruleid, 'gwlist': gwlist, 'priority': route['priority'],
+                                             'description': route['description']})
+                        continue
+                else:
+                    if next_lcr_groupid[0] >= settings.FLT_FWD_MIN:
+                        raise ValueError('no LCR groups left, the LCR groups end at {}'.format(settings.FLT_FWD_MIN))
+                    groupid = next_lcr_groupid[0]
+                    next_lcr_groupid[0] += 1
+                    lcr_inserts.append({'pattern': route['pattern'], 'from_prefix': route['from_prefix'],
+                                        'dr_groupid': str(groupid), 'cost': route['cost']})
+                rule_inserts.append({
+                    'groupid': groupid, 'prefix': route['prefix'], 'timerec': '', 'priority': route['priority'],
+                    'routeid': '', 'gwlist': gwlist, 'description': route['description']
+                })
+
+            if len(lcr_inserts) > 0:
+                db.bulk_insert_mappings(dSIPLCR, lcr_inserts)
+            if len(lcr_updates) > 0:
+                db.bulk_update_mappings(dSIPLCR, lcr_updates)
+
+        if len(rule_inserts) > 0:
+            db.bulk_insert_mappings(OutboundRoutes, rule_inserts)
+        if len(rule_updates) > 0:
+            db.bulk_update_mappings(OutboundRoutes, rule_updates)
+        report['inserted'] += len(rule_inserts)
+        report['updated'] += len(rule_updates)
+
+    chunk = []
+    for rownum, row in enumerate(rows, 1):
+        # skip blank lines and the header if present
+        if len(row) == 0 or len(row[0].strip()) == 0 or row[0].startswith('#'):
+            continue
+
+        error, fields = parseOutboundRouteRow(row, override_gwgroupid, name)
+        if error is None and fields['gwgroupid'] not in gwgroupids:
+            error = 'Carrier group {} does not exist'.format(fields['gwgroupid'])
+        if error is not None:
+            reject(rownum, row[0].strip(), error)
+            continue
+
+        for prefix in fields['prefixes']:
+            route = dict(fields, prefix=prefix)
+            del route['prefixes']
+            if route['from_prefix'] is not None:
+                route['pattern'] = route['from_prefix'] + '-' + prefix
+                key = route['pattern']
+            else:
+                key = (prefix, route['gwgroupid'])
+            if key in seen:
+                reject(rownum, prefix, 'Route is duplicated in the import')
+                continue
+            seen.add(key)
+            chunk.append(route)
+
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    flush(chunk)
+
+    if report['inserted'] + report['updated'] > 0:
+        updateLCRIndex(db)
+    return report
+
+
+def reloadOutboundRoutes():
+    """
+    Reload the outbound routes in kamailio, in a single batch of rpc commands
+
+    When the reload fails the routes are marked for reload, so the next reload from the GUI picks them up.
+
+    :return:    whether kamailio was reloaded
+    :rtype:     bool
+    """
+    try:
+        reloadKamailio(list(OUTBOUND_RELOAD_RESOURCES))
+        return True
+    except Exception as ex:
+        IO.logwarn('could not reload the outbound routes: {}'.format(str(ex)))
+        markKamailioReloadRequired(*OUTBOUND_RELOAD_RESOURCES)
+        return False
+
+
+def getOutboundRoutesPage(db, limit, offset=0, sort='ruleid', order='asc', search=None, gwgroupid=None):
+    """
+    Get a page of the outbound routes view
+
+    The filters only use dr_rules columns, the prefix search is a prefix match so both
+    the count and the page can be resolved from the (groupid, prefix) and gwgroupid indexes.
+
+    :param db:          session to query in
+    :type db:           :class:`sqlalchemy.orm.Session`
+    :param limit:       max number of rows on the page
+    :type limit:        int
+    :param offset:      number of rows to skip
+    :type offset:       int
+    :param sort:        column to sort on, one of OUTBOUND_PAGE_SORT_COLUMNS
+    :type sort:         str
+    :param order:       asc or desc
+    :type order:        str
+    :param search:      only return the routes whose prefix starts with this
+    :type search:       str|None
+    :param gwgroupid:   only return the routes of this carrier group
+    :type gwgroupid:    int|str|None
+    :return:            number of matching routes and the rows of the page
+    :rtype:             tuple
+    :raises:            ValueError on an invalid sort column or order
+    """
+    if sort not in OUTBOUND_PAGE_SORT_COLUMNS:
+        raise ValueError('sort must be one of: {}'.format(', '.join(OUTBOUND_PAGE_SORT_COLUMNS)))
+    if order not in ('asc', 'desc'):
+        raise ValueError('order must be asc or desc')
+
+    where = '((r.groupid = :flt_outbound) OR (r.groupid >= :flt_lcr_min AND r.groupid < :flt_fwd_min))'
+    params = {'flt_outbound': settings.FLT_OUTBOUND, 'flt_lcr_min': settings.FLT_LCR_MIN, 'flt_fwd_min': settings.FLT_FWD_MIN}
+    if search:
+        where += ' AND r.prefix LIKE :search'
+        params['search'] = escape_like(search) + '%'
+    if gwgroupid is not None:
+        where += ' AND {gwgroupid} = :gwgroupid'
+        params['gwgroupid'] = int(str(gwgroupid).lstrip('#'))
+
+    gwgroupid_sql = getRulesGwgroupidSQL('r')
+    where = where.format(gwgroupid=gwgroupid_sql)
+    total = db.execute(text('SELECT COUNT(*) FROM dr_rules AS r WHERE ' + where), params).scalar()
+
+    params.update({'limit': limit, 'offset': offset})
+    rows = db.execute(text("""
+SELECT l.from_prefix, l.cost, l.dr_groupid, r.ruleid, r.prefix, r.routeid, {gwgroupid} AS gwgroupid, r.timerec, r.priority,
+    r.description, g.description AS gwgroup_description, g.gwlist
+FROM dr_rules AS r
+    LEFT JOIN dsip_lcr AS l ON l.dr_groupid = r.groupid
+    LEFT JOIN dr_gw_lists AS g ON g.id = {gwgroupid}
+WHERE {where}
+ORDER BY {sort} {order}, r.ruleid {order}
+LIMIT :limit OFFSET :offset""".format(where=where, sort=OUTBOUND_PAGE_SORT_COLUMNS[sort].format(gwgroupid=gwgroupid_sql),
+                                        order=order, gwgroupid=gwgroupid_sql)), params).mappings().all()
+
+    return total, [dict(row) for row in rows]
@@ -42,7 +42,11 @@ CREATE TABLE `acc` (
   `src_gwgroupid` varchar(10)      NOT NULL DEFAULT '',
   `dst_gwgroupid` varchar(10)      NOT NULL DEFAULT '',
   PRIMARY KEY (`id`),
-  KEY `acc_callid` (`callid`)
+  KEY `acc_callid` (`callid`),
+  KEY `acc_method_cdr_id` (`method`, `cdr_id`, `id`),
+  KEY `acc_time` (`time`),
+  KEY `acc_src_gwgroupid_time` (`src_gwgroupid`, `time`),
+  KEY `acc_dst_gwgroupid_time` (`dst_gwgroupid`, `time`)
   );
 /*!40101 SET character_set_client = @saved_cs_client */;
 
@@ -73,7 +77,51 @@ CREATE TABLE `cdrs` (
   `fraud`           bool             NOT NULL DEFAULT '0',
   `src_gwgroupid`   varchar(10)      NOT NULL DEFAULT '',
   `dst_gwgroupid`   varchar(10)      NOT NULL DEFAULT '',
-  PRIMARY KEY (`cdr_id`)
+  PRIMARY KEY (`cdr_id`),
+  KEY `cdrs_sip_call_id` (`sip_call_id`),
+  KEY `cdrs_rated` (`rated`, `cdr_id`),
+  KEY `cdrs_src_gwgroupid_start` (`src_gwgroupid`, `call_start_time`),
+  KEY `cdrs_dst_gwgroupid_start` (`dst_gwgroupid`, `call_start_time`),
+  KEY `cdrs_src_ip_start` (`src_ip`, `call_start_time`)
+  );
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `cdr_rollups`
+-- hourly and daily usage per endpoint group, maintained by: dsiprouter_cron.py cdr rollup
+--
+
+DROP TABLE IF EXISTS `cdr_rollups`;
+/*!40101 SET @saved_cs_client = @@character_set_client */;
+/*!40101 SET character_set_client = utf8 */;
+CREATE TABLE `cdr_rollups` (
+  `period`          enum('hour','day')  NOT NULL,
+  `period_start`    datetime            NOT NULL,
+  `src_gwgroupid`   varchar(10)         NOT NULL DEFAULT '',
+  `dst_gwgroupid`   varchar(10)         NOT NULL DEFAULT '',
+  `calltype`        varchar(20)         NOT NULL DEFAULT '',
+  `calls`           int(10) UNSIGNED    NOT NULL DEFAULT '0',
+  `failed_calls`    int(10) UNSIGNED    NOT NULL DEFAULT '0',
+  `total_duration`  bigint(20) UNSIGNED NOT NULL DEFAULT '0',
+  PRIMARY KEY (`period`, `period_start`, `src_gwgroupid`, `dst_gwgroupid`, `calltype`),
+  KEY `cdr_rollups_src_gwgroupid` (`period`, `src_gwgroupid`, `period_start`),
+  KEY `cdr_rollups_dst_gwgroupid` (`period`, `dst_gwgroupid`, `period_start`)
+  );
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `cdr_rollup_marks`
+-- the last cdrs.cdr_id / acc.id included in cdr_rollups
+--
+
+DROP TABLE IF EXISTS `cdr_rollup_marks`;
+/*!40101 SET @saved_cs_client = @@character_set_client */;
+/*!40101 SET character_set_client = utf8 */;
+CREATE TABLE `cdr_rollup_marks` (
+  `source`          varchar(16)         NOT NULL,
+  `last_id`         bigint(20) UNSIGNED NOT NULL DEFAULT '0',
+  `updated`         datetime            NOT NULL DEFAULT NOW(),
+  PRIMARY KEY (`source`)
   );
 /*!40101 SET character_set_client = @saved_cs_client */;
 
@@ -0,0 +1,20 @@
+--
+-- Brings the acc / cdrs tables of an existing install up to cdrs.sql
+-- safe to re-run, it is applied by the v0.74 upgrade migration
+--
+
+-- cdr consolidation (modules.cdr.functions.consolidateCDRS)
+ALTER TABLE IF EXISTS `acc`
+  ADD KEY IF NOT EXISTS `acc_method_cdr_id` (`method`, `cdr_id`, `id`),
+  ADD KEY IF NOT EXISTS `acc_time` (`time`);
+ALTER TABLE IF EXISTS `cdrs`
+  ADD KEY IF NOT EXISTS `cdrs_sip_call_id` (`sip_call_id`);
+
+-- cdr report pagination (modules.cdr.functions.buildCDRQuery)
+ALTER TABLE IF EXISTS `acc`
+  ADD KEY IF NOT EXISTS `acc_src_gwgroupid_time` (`src_gwgroupid`, `time`),
+  ADD KEY IF NOT EXISTS `acc_dst_gwgroupid_time` (`dst_gwgroupid`, `time`);
+ALTER TABLE IF EXISTS `cdrs`
+  ADD KEY IF NOT EXISTS `cdrs_src_gwgroupid_start` (`src_gwgroupid`, `call_start_time`),
+  ADD KEY IF NOT EXISTS `cdrs_dst_gwgroupid_start` (`dst_gwgroupid`, `call_start_time`),
+  ADD KEY IF NOT EXISTS `cdrs_src_ip_start` (`src_ip`, `call_start_time`);
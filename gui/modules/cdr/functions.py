@@ -0,0 +1,653 @@
+# make sure the generated source files are imported instead of the template ones
+import sys
+if sys.path[0] != '/etc/dsiprouter/gui':
+    sys.path.insert(0, '/etc/dsiprouter/gui')
+
+import io, csv, json, time, math
+from bisect import bisect_right
+from collections import defaultdict
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam
+from sqlalchemy.sql import text
+from shared import IO
+from database import getDBEngine
+from database.cache import gwgroup_cache
+
+# field names of the rows returned by the cdr report queries
+CDR_REPORT_FIELDS = ['cdr_id', 'call_start_time', 'call_duration', 'call_direction', 'src_gwgroupid',
+                     'src_gwgroupname', 'dst_gwgroupid', 'dst_gwgroupname', 'src_username',
+                     'dst_username', 'src_address', 'dst_address', 'call_id']
+# discriminator of the table a cdr report row comes from, the keyset is (time, source, id)
+# as the ids of the cdrs and acc tables are unrelated and can collide
+CDR_SOURCE_CDRS = 0
+CDR_SOURCE_ACC = 1
+# number of rows fetched from the server-side cursor per round trip when exporting cdrs
+CDR_EXPORT_CHUNK_SIZE = 1000
+# number of acc INVITE rows paired per transaction
+CDR_CONSOLIDATE_BATCH_SIZE = 5000
+# seconds an INVITE without a BYE is retried for, older unmatched INVITEs are failed / abandoned calls
+# the window starts before the newest cdr, so a backlog left by an outage is still consolidated
+CDR_CONSOLIDATE_WINDOW = 24 * 60 * 60
+# named lock preventing overlapping consolidation runs
+CDR_CONSOLIDATE_LOCK = 'dsiprouter_cdr_consolidate'
+# number of unrated cdrs rated per transaction
+CDR_RATING_CHUNK_SIZE = 10000
+# rate group used when none is given, same as the one kamailio_rating() was called with
+CDR_RATING_DEFAULT_GROUP = 'default'
+# number of source rows aggregated into the rollups per transaction
+CDR_ROLLUP_BATCH_SIZE = 50000
+# seconds acc rows are left to settle, kamailio workers can commit them out of id order
+CDR_ROLLUP_SETTLE_TIME = 60
+# rollup periods and the expression truncating a datetime column to the start of the period
+CDR_ROLLUP_PERIODS = {
+    'hour': 'DATE_ADD(DATE({col}), INTERVAL HOUR({col}) HOUR)',
+    'day': 'DATE({col})',
+}
+# named lock preventing overlapping rollup runs
+CDR_ROLLUP_LOCK = 'dsiprouter_cdr_rollup'
+
+
+def consolidateCDRS(conn=None, batch_size=CDR_CONSOLIDATE_BATCH_SIZE, window=CDR_CONSOLIDATE_WINDOW):
+    """
+    Pair the INVITE and BYE records in acc and create the matching cdrs
+
+    Set based replacement for the kamailio_cdrs() procedure. The unmatched INVITEs inside
+    the window are walked by id in batches, each batch is paired with its BYEs in a single
+    join, inserted into cdrs with one INSERT ... SELECT and marked in acc with one UPDATE.
+
+    The window ends at now, or at the start of the newest cdr when it is older, so the INVITEs
+    of an outage longer than the window are not skipped. When there is no cdr yet, such as on
+    the first run after kamailio_cdrs() was used, every unmatched INVITE is scanned.
+
+    :param conn:        connection to run on, defaults to a new connection to the kamailio DB
+    :type conn:         :class:`sqlalchemy.engine.Connection`|None
+    :param batch_size:  number of INVITEs processed per transaction
+    :type batch_size:   int
+    :param window:      seconds an INVITE is retried for until a BYE is found, counted back from the newest cdr
+    :type window:       int
+    :return:            stats of the run, the invites scanned, cdrs created and elapsed seconds
+    :rtype:             dict
+    """
+    stats = {'invites': 0, 'cdrs': 0, 'batches': 0, 'elapsed': 0.0}
+    start = time.perf_counter()
+
+    with (getDBEngine().connect() if conn is None else nullcontext(conn)) as conn:
+        if conn.execute(text('SELECT GET_LOCK(:name, 0)'), {'name': CDR_CONSOLIDATE_LOCK}).scalar() != 1:
+            IO.logwarn('cdr consolidation already running, skipping this run')
+            return stats
+        conn.commit()
+
+        try:
+            # low watermark, the first acc record inside the window
+            newest_cdr_start = conn.execute(text('SELECT call_start_time FROM cdrs ORDER BY cdr_id DESC LIMIT 1')).scalar()
+            if newest_cdr_start is None:
+                after = 0
+            else:
+                window_start = min(datetime.now(), newest_cdr_start) - timedelta(seconds=window)
+                after = conn.execute(
+                    text('SELECT MIN(id) - 1 FROM acc WHERE time >= :window_start'),
+                    {'window_start': window_start}
+                ).scalar()
+                if after is None:
+                    return stats
+
+            while True:
+                upto, invites = conn.execute(
+                    text("""SELECT MAX(id), COUNT(*) FROM (
+                        SELECT id FROM acc
+                        WHERE method = 'INVITE' AND cdr_id = 0 AND id > :after
+                        ORDER BY id LIMIT :limit) t"""),
+                    {'after': after, 'limit': batch_size}
+                ).one()
+                if invites == 0:
+                    break
+
+                params = {'after': after, 'upto': upto}
+                last_cdr_id = conn.execute(text('SELECT COALESCE(MAX(cdr_id), 0) FROM cdrs')).scalar()
+                # the first BYE of the dialog in either direction ends the call,
+                # re-INVITEs of a dialog in the same batch only create one cdr
+                created = conn.execute(
+                    text("""INSERT INTO cdrs (src_username, src_domain, dst_username, dst_domain, call_start_time,
+                            duration, sip_call_id, sip_from_tag, sip_to_tag, src_ip, created, calltype,
+                            src_gwgroupid, dst_gwgroupid)
+                        SELECT i.src_user, i.src_domain, i.dst_user, i.dst_domain, i.time,
+                            UNIX_TIMESTAMP(p.bye_time) - UNIX_TIMESTAMP(i.time), i.callid, i.from_tag, i.to_tag,
+                            i.src_ip, NOW(), i.calltype, i.src_gwgroupid, i.dst_gwgroupid
+                        FROM (
+                            SELECT inv.id, MIN(bye.time) AS bye_time
+                            FROM acc inv
+                            JOIN acc bye ON bye.callid = inv.callid AND bye.method = 'BYE' AND (
+                                (bye.from_tag = inv.from_tag AND bye.to_tag = inv.to_tag) OR
+                                (bye.from_tag = inv.to_tag AND bye.to_tag = inv.from_tag))
+                            WHERE inv.method = 'INVITE' AND inv.cdr_id = 0 AND inv.id > :after AND inv.id <= :upto
+                            GROUP BY inv.id
+                        ) p
+                        JOIN acc i ON i.id = p.id
+                        WHERE NOT EXISTS (
+                            SELECT 1 FROM acc dup
+                            WHERE dup.callid = i.callid AND dup.method = 'INVITE' AND dup.cdr_id = 0
+                                AND dup.from_tag = i.from_tag AND dup.to_tag = i.to_tag
+                                AND dup.id > :after AND dup.id < i.id)
+                        ORDER BY i.id"""),
+                    params
+                ).rowcount
+
+                if created > 0:
+                    conn.execute(
+                        text("""UPDATE acc a
+                            JOIN cdrs c ON c.sip_call_id = a.callid AND c.sip_from_tag = a.from_tag AND c.sip_to_tag = a.to_tag
+                            SET a.cdr_id = c.cdr_id
+                            WHERE c.cdr_id > :last_cdr_id AND a.cdr_id = 0"""),
+                        {'last_cdr_id': last_cdr_id}
+                    )
+                conn.commit()
+
+                stats['invites'] += invites
+                stats['cdrs'] += created
+                stats['batches'] += 1
+                after = upto
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.execute(text('SELECT RELEASE_LOCK(:name)'), {'name': CDR_CONSOLIDATE_LOCK})
+            conn.commit()
+
+    stats['elapsed'] = time.perf_counter() - start
+    IO.logdbg('cdr consolidation scanned {} invites and created {} cdrs in {:.3f}s'.format(
+        stats['invites'], stats['cdrs'], stats['elapsed']))
+    return stats
+
+
+class RateDeck():
+    """
+    Longest prefix match over the rates of a billing_rates rate group
+
+    The prefixes are kept sorted with a pointer from each prefix to the longest other prefix
+    it starts with. The best candidate for a number is found with a binary search, then the
+    parent pointers are followed until a prefix of the number is reached.
+    """
+
+    def __init__(self, rates):
+        """
+        :param rates:   the rates as (prefix, rate_unit, time_unit) tuples
+        :type rates:    collections.abc.Iterable[tuple]
+        """
+        deck = {}
+        for prefix, rate_unit, time_unit in rates:
+            deck[str(prefix)] = (int(rate_unit), int(time_unit))
+
+        self.prefixes = sorted(deck)
+        self.rates = [deck[prefix] for prefix in self.prefixes]
+        self.parents = []
+        stack = []
+        for i, prefix in enumerate(self.prefixes):
+            while len(stack) > 0 and not prefix.startswith(self.prefixes[stack[-1]]):
+                stack.pop()
+            self.parents.append(stack[-1] if len(stack) > 0 else -1)
+            stack.append(i)
+
+    def __len__(self):
+        return len(self.prefixes)
+
+    def lookup(self, number):
+        """
+        Find the rate of the longest prefix matching a number
+
+        :param number:  the dialed number
+        :type number:   str
+        :return:        (rate_unit, time_unit) or None if no prefix matches
+        :rtype:         tuple|None
+        """
+        i = bisect_right(self.prefixes, number) - 1
+        while i >= 0:
+            if number.startswith(self.prefixes[i]):
+                return self.rates[i]
+            i = self.parents[i]
+        return None
+
+    def cost(self, number, duration):
+        """
+        Compute the cost of a call, rate_unit for every started time_unit of the call
+
+        :param number:      the dialed number
+        :type number:       str
+        :param duration:    call duration in seconds
+        :type duration:     int
+        :return:            the cost or None if no prefix matches
+        :rtype:             int|None
+        """
+        rate = self.lookup(number)
+        if rate is None:
+            return None
+        rate_unit, time_unit = rate
+        # a rate without a time unit is charged per second
+        return rate_unit * math.ceil(duration / max(time_unit, 1))
+
+
+def loadRateDeck(conn, rate_group):
+    """
+    Load the rates of a rate group into memory
+
+    :param conn:        connection to load the rates with
+    :type conn:         :class:`sqlalchemy.engine.Connection`
+    :param rate_group:  the rate group
+    :type rate_group:   str
+    :return:            the rate deck
+    :rtype:             RateDeck
+    """
+    return RateDeck(conn.execute(
+        text('SELECT prefix, rate_unit, time_unit FROM billing_rates WHERE rate_group = :rate_group'),
+        {'rate_group': rate_group}
+    ))
+
+
+def rateCDRS(rate_group=CDR_RATING_DEFAULT_GROUP, conn=None, chunk_size=CDR_RATING_CHUNK_SIZE):
+    """
+    Rate the unrated cdrs against a rate group
+
+    Replacement for the kamailio_rating() procedure. The rate deck is loaded once, the unrated
+    cdrs are read in chunks by cdr_id and the costs written back with one UPDATE per distinct
+    cost in the chunk. cdrs without a matching rate are left unrated, like the procedure did.
+
+    :param rate_group:  the rate group to rate with
+    :type rate_group:   str
+    :param conn:        connection to run on, defaults to a new connection to the kamailio DB
+    :type conn:         :class:`sqlalchemy.engine.Connection`|None
+    :param chunk_size:  number of cdrs rated per transaction
+    :type chunk_size:   int
+    :return:            stats of the run, the cdrs scanned and rated, elapsed seconds and cdrs per second
+    :rtype:             dict
+    """
+    stats = {'rates': 0, 'cdrs': 0, 'rated': 0, 'unmatched': 0, 'elapsed': 0.0, 'cdrs_per_second': 0.0}
+    start = time.perf_counter()
+
+    update_query = text('UPDATE cdrs SET rated = 1, cost = :cost WHERE cdr_id IN :cdr_ids').bindparams(
+        bindparam('cdr_ids', expanding=True))
+
+    with (getDBEngine().connect() if conn is None else nullcontext(conn)) as conn:
+        deck = loadRateDeck(conn, rate_group)
+        stats['rates'] = len(deck)
+        if len(deck) == 0:
+            IO.logwarn('rate group {} has no rates, no cdrs rated'.format(rate_group))
+            return stats
+
+        after = 0
+        while True:
+            rows = conn.execute(
+                text('SELECT cdr_id, dst_username, duration FROM cdrs WHERE rated = 0 AND cdr_id > :after ORDER BY cdr_id LIMIT :limit'),
+                {'after': after, 'limit': chunk_size}
+            ).all()
+            if len(rows) == 0:
+                break
+
+            costs = defaultdict(list)
+            for cdr_id, dst_username, duration in rows:
+                cost = deck.cost(dst_username, duration)
+                if cost is None:
+                    stats['unmatched'] += 1
+                else:
+                    costs[cost].append(cdr_id)
+
+            for cost, cdr_ids in costs.items():
+                conn.execute(update_query, {'cost': cost, 'cdr_ids': cdr_ids})
+            conn.commit()
+
+            stats['cdrs'] += len(rows)
+            stats['rated'] += sum(len(cdr_ids) for cdr_ids in costs.values())
+            after = rows[-1][0]
+
+    stats['elapsed'] = time.perf_counter() - start
+    if stats['elapsed'] > 0:
+        stats['cdrs_per_second'] = stats['cdrs'] / stats['elapsed']
+    IO.loginfo('cdr rating with rate group {} ({} rates) rated {} of {} cdrs in {:.3f}s ({:.0f} cdrs/s)'.format(
+        rate_group, stats['rates'], stats['rated'], stats['cdrs'], stats['elapsed'], stats['cdrs_per_second']))
+    return stats
+
+
+# the rows aggregated into cdr_rollups, answered calls come from cdrs and failed calls from acc
+CDR_ROLLUP_SOURCES = {
+    'cdrs': {
+        'id': 'cdr_id',
+        'time': 'call_start_time',
+        'where': '1',
+        'calls': 'COUNT(*)',
+        'failed_calls': '0',
+        'total_duration': 'SUM(duration)',
+    },
+    'acc': {
+        'id': 'id',
+        'time': 'time',
+        'where': "method = 'INVITE' AND LEFT(sip_code, 1) <> '2'",
+        'calls': '0',
+        'failed_calls': 'COUNT(*)',
+        'total_duration': '0',
+    },
+}
+
+
+def rollupSource(conn, source, batch_size):
+    """
+    Aggregate the new rows of a source table into cdr_rollups
+
+    :param conn:        connection to run on
+    :type conn:         :class:`sqlalchemy.engine.Connection`
+    :param source:      name of the source table, a key of CDR_ROLLUP_SOURCES
+    :type source:       str
+    :param batch_size:  number of source rows aggregated per transaction
+    :type batch_size:   int
+    :return:            the mark before and after the run, the ids in between were aggregated
+    :rtype:             tuple
+    """
+    src = CDR_ROLLUP_SOURCES[source]
+
+    if source == 'acc':
+        upto = conn.execute(
+            text('SELECT MAX(id) FROM acc WHERE time <= NOW() - INTERVAL :settle SECOND'),
+            {'settle': CDR_ROLLUP_SETTLE_TIME}
+        ).scalar()
+    else:
+        upto = conn.execute(text('SELECT MAX(cdr_id) FROM cdrs')).scalar()
+
+    conn.execute(text('INSERT IGNORE INTO cdr_rollup_marks (source, last_id) VALUES (:source, 0)'), {'source': source})
+    last_id = conn.execute(
+        text('SELECT last_id FROM cdr_rollup_marks WHERE source = :source'), {'source': source}).scalar()
+    conn.commit()
+
+    start_id = last_id
+    while upto is not None and last_id < upto:
+        params = {'last_id': last_id, 'batch_upto': min(last_id + batch_size, upto)}
+        for period, truncate in CDR_ROLLUP_PERIODS.items():
+            conn.execute(
+                text("""INSERT INTO cdr_rollups (period, period_start, src_gwgroupid, dst_gwgroupid, calltype,
+                        calls, failed_calls, total_duration)
+                    SELECT '{period}', {period_start} AS period_start, src_gwgroupid, dst_gwgroupid,
+                        COALESCE(calltype, '') AS rollup_calltype, {calls}, {failed_calls}, {total_duration}
+                    FROM {source}
+                    WHERE {id} > :last_id AND {id} <= :batch_upto AND {where}
+                    GROUP BY period_start, src_gwgroupid, dst_gwgroupid, rollup_calltype
+                    ON DUPLICATE KEY UPDATE calls = calls + VALUES(calls), failed_calls = failed_calls + VALUES(failed_calls),
+                        total_duration = total_duration + VALUES(total_duration)""".format(
+                    period=period, period_start=truncate.format(col=src['time']), source=source, **src)),
+                params
+            )
+        # moving the mark in the same transaction keeps the rollups exact if the run is interrupted
+        conn.execute(
+            text('UPDATE cdr_rollup_marks SET last_id = :batch_upto, updated = NOW() WHERE source = :source'),
+            {'batch_upto': params['batch_upto'], 'source': source}
+        )
+        conn.commit()
+        last_id = params['batch_upto']
+
+    return start_id, last_id
+
+
+def rollupCDRS(conn=None, batch_size=CDR_ROLLUP_BATCH_SIZE):
+    """
+    Bring the cdr_rollups table up to date with cdrs and acc
+
+    Each source is aggregated from its high-water mark in cdr_rollup_marks, so a run only
+    reads the rows added since the previous run.
+
+    The run reads with READ COMMITTED instead of the engine's READ UNCOMMITTED, otherwise the rows
+    of a consolidation batch that is rolled back could be aggregated and the mark moved past them.
+    The cdrs are only inserted by :func:`consolidateCDRS`, whose batches are serialized by its lock,
+    so they commit in cdr_id order and need no settle time unlike the acc rows.
+
+    :param conn:        connection to run on, defaults to a new connection to the kamailio DB
+    :type conn:         :class:`sqlalchemy.engine.Connection`|None
+    :param batch_size:  number of source rows aggregated per transaction
+    :type batch_size:   int
+    :return:            the marks before and after the run per source and elapsed seconds
+    :rtype:             dict
+    """
+    stats = {'elapsed': 0.0}
+    start = time.perf_counter()
+
+    with (getDBEngine().connect() if conn is None else nullcontext(conn)) as conn:
+        conn.execution_options(isolation_level='READ COMMITTED')
+        if conn.execute(text('SELECT GET_LOCK(:name, 0)'), {'name': CDR_ROLLUP_LOCK}).scalar() != 1:
+            IO.logwarn('cdr rollup already running, skipping this run')
+            return stats
+        conn.commit()
+
+        try:
+            for source in CDR_ROLLUP_SOURCES:
+                stats[source] = rollupSource(conn, source, batch_size)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.execute(text('SELECT RELEASE_LOCK(:name)'), {'name': CDR_ROLLUP_LOCK})
+            conn.commit()
+
+    stats['elapsed'] = time.perf_counter() - start
+    IO.logdbg('cdr rollup moved the marks {} in {:.3f}s'.format(
+        ', '.join('{} {}->{}'.format(source, *stats[source]) for source in CDR_ROLLUP_SOURCES), stats['elapsed']))
+    return stats
+
+
+def getCDRSummary(db, period='day', start=None, end=None, gwgroupid=None, calltype=None, group_by=None):
+    """
+    Read the usage per endpoint group from the rollups
+
+    :param db:          session to query with
+    :type db:           sqlalchemy.orm.Session
+    :param period:      granularity of the rows, hour or day
+    :type period:       str
+    :param start:       include periods starting at or after this time
+    :type start:        datetime|None
+    :param end:         include periods starting before this time
+    :type end:          datetime|None
+    :param gwgroupid:   only include calls from or to this endpoint group
+    :type gwgroupid:    int|str|None
+    :param calltype:    only include calls of this type
+    :type calltype:     str|None
+    :param group_by:    None for a row per period, src or dst for totals per source / destination endpoint group
+    :type group_by:     str|None
+    :return:            the usage rows
+    :rtype:             list[dict]
+    """
+    if period not in CDR_ROLLUP_PERIODS:
+        raise ValueError('period must be one of: {}'.format(', '.join(CDR_ROLLUP_PERIODS)))
+
+    where = ['period = :period']
+    params = {'period': period}
+    if start is not None:
+        where.append('period_start >= :start')
+        params['start'] = start
+    if end is not None:
+        where.append('period_start < :end')
+        params['end'] = end
+    if gwgroupid is not None:
+        where.append('(src_gwgroupid = :gwgroupid OR dst_gwgroupid = :gwgroupid)')
+        params['gwgroupid'] = str(gwgroupid)
+    if calltype is not None:
+        where.append('calltype = :calltype')
+        params['calltype'] = calltype
+
+    if group_by is None:
+        columns = ['period_start', 'src_gwgroupid', 'dst_gwgroupid', 'calltype']
+    elif group_by in ('src', 'dst'):
+        columns = ['{}_gwgroupid'.format(group_by)]
+    else:
+        raise ValueError('group_by must be one of: src, dst')
+
+    rows = db.execute(
+        text("""SELECT {columns}, SUM(calls) AS calls, SUM(failed_calls) AS failed_calls, SUM(total_duration) AS total_duration
+            FROM cdr_rollups WHERE {where}
+            GROUP BY {columns} ORDER BY {columns}""".format(columns=', '.join(columns), where=' AND '.join(where))),
+        params
+    )
+
+    summary = []
+    for row in rows:
+        data = dict(row._mapping)
+        calls, failed_calls, total_duration = int(data['calls']), int(data['failed_calls']), int(data['total_duration'])
+        data.update({
+            'calls': calls,
+            'failed_calls': failed_calls,
+            'total_duration': total_duration,
+            'average_duration': round(total_duration / calls, 2) if calls > 0 else 0,
+            'asr': round(calls / (calls + failed_calls) * 100, 2) if calls + failed_calls > 0 else 0,
+        })
+        if 'period_start' in data:
+            data['period_start'] = str(data['period_start'])
+        summary.append(data)
+    return summary
+
+
+def buildCDRKeysetFilter(time_col, id_col, source, after):
+    """
+    Build the condition selecting the rows of a table that come after a cursor
+
+    The rows are ordered by (time, source, id) descending, the source of a table is
+    constant so the condition only compares the time and id columns and stays indexable.
+
+    Bind parameters: after_time, after_id
+
+    :param time_col:    the time column of the table
+    :type time_col:     str
+    :param id_col:      the id column of the table
+    :type id_col:       str
+    :param source:      the source of the table, one of the CDR_SOURCE_* constants
+    :type source:       int
+    :param after:       cursor (start time, source, id) to start after
+    :type after:        tuple
+    :return:            the condition
+    :rtype:             str
+    """
+    after_source = after[1]
+    if source < after_source:
+        return "{time_col} <= :after_time".format(time_col=time_col)
+    if source > after_source:
+        return "{time_col} < :after_time".format(time_col=time_col)
+    return "{time_col} <= :after_time AND ({time_col} < :after_time OR {id_col} < :after_id)".format(
+        time_col=time_col, id_col=id_col
+    )
+
+
+def buildCDRQuery(cdrfilter='', nonCompletedCalls=True, after=None, limit=None):
+    """
+    Build the cdr report query for a gwgroup
+
+    The source and destination gwgroup are matched in separate branches of a UNION,
+    so each branch can be resolved from the (src|dst)_gwgroupid/time indexes.
+    When paginating, the branches are bounded by the keyset (time, source, id) and the limit,
+    therefore the cost of a page depends on the page size rather than the table size.
+
+    Bind parameters: gwgroupid, dtfilter and when paginating after_time, after_id, limit
+
+    :param cdrfilter:           comma separated, validated, cdr id's to include
+    :type cdrfilter:            str
+    :param nonCompletedCalls:   whether to include the acc records
+    :type nonCompletedCalls:    bool
+    :param after:               cursor (start time, source, id) to start after
+    :type after:                tuple|None
+    :param limit:               max number of rows to return
+    :type limit:                int|None
+    :return:                    the query
+    :rtype:                     str
+    """
+    cdr_cols = ("cdr_id, call_start_time, duration AS call_duration, calltype AS call_direction, src_gwgroupid, dst_gwgroupid, "
+                "src_username, dst_username, src_ip AS src_address, dst_domain AS dst_address, sip_call_id AS call_id")
+    acc_cols = ("id AS cdr_id, time AS call_start_time, 0 AS call_duration, calltype AS call_direction, src_gwgroupid, dst_gwgroupid, "
+                "src_user AS src_username, dst_user AS dst_username, src_ip AS src_address, dst_domain AS dst_address, callid AS call_id")
+
+    def branch(cols, table, source, gwgroup_col, time_col, id_col, extra_filter=''):
+        query = "SELECT {source} AS source, {cols} FROM {table} WHERE {gwgroup_col} = :gwgroupid AND {time_col} >= :dtfilter{extra_filter}".format(
+            source=source, cols=cols, table=table, gwgroup_col=gwgroup_col, time_col=time_col, extra_filter=extra_filter
+        )
+        if after is not None:
+            query += " AND " + buildCDRKeysetFilter(time_col, id_col, source, after)
+        if limit is not None:
+            query += " ORDER BY {time_col} DESC, {id_col} DESC LIMIT :limit".format(time_col=time_col, id_col=id_col)
+        return "(" + query + ")"
+
+    cdr_filter = " AND cdr_id IN ({})".format(cdrfilter) if len(cdrfilter) > 0 else ''
+    branches = [
+        branch(cdr_cols, 'cdrs', CDR_SOURCE_CDRS, 'src_gwgroupid', 'call_start_time', 'cdr_id', cdr_filter),
+        branch(cdr_cols, 'cdrs', CDR_SOURCE_CDRS, 'dst_gwgroupid', 'call_start_time', 'cdr_id', cdr_filter),
+    ]
+    if nonCompletedCalls:
+        branches.extend([
+            branch(acc_cols, 'acc', CDR_SOURCE_ACC, 'src_gwgroupid', 'time', 'id'),
+            branch(acc_cols, 'acc', CDR_SOURCE_ACC, 'dst_gwgroupid', 'time', 'id'),
+        ])
+
+    query = (
+        """SELECT t1.source, t1.cdr_id, t1.call_start_time, t1.call_duration, t1.call_direction,
+                  t1.src_gwgroupid, t1.dst_gwgroupid,
+                  t1.src_username, t1.dst_username, t1.src_address, t1.dst_address, t1.call_id
+        FROM ({branches}) t1
+        ORDER BY t1.call_start_time DESC, t1.source DESC, t1.cdr_id DESC"""
+    ).format(branches=" UNION ".join(branches))
+    if limit is not None:
+        query += " LIMIT :limit"
+
+    return query
+
+
+def cdrRowToDict(row):
+    """
+    Convert a row returned by the cdr report queries to a dict
+
+    :param row:     row from the cdr report query
+    :type row:      sqlalchemy.engine.Row
+    :return:        the cdr fields
+    :rtype:         dict
+    """
+    data = row._mapping
+    # the endpoint group names come from the cache instead of parsing dr_gw_lists in the query
+    names = {
+        'src_gwgroupname': gwgroup_cache.getName(data['src_gwgroupid'], None),
+        'dst_gwgroupname': gwgroup_cache.getName(data['dst_gwgroupid'], None),
+    }
+    data = {field: names[field] if field in names else data[field] for field in CDR_REPORT_FIELDS}
+    data['cdr_id'] = int(data['cdr_id'])
+    data['call_duration'] = str(data['call_duration'])
+    return data
+
+
+def streamCDRS(db, query, params, format='csv', chunk_size=CDR_EXPORT_CHUNK_SIZE):
+    """
+    Stream the results of a cdr report query in chunks
+
+    The query is executed with a server-side cursor, therefore at most
+    chunk_size rows are held in memory at any time regardless of the report size.
+
+    :param db:          session to execute the query with
+    :type db:           sqlalchemy.orm.scoping.scoped_session
+    :param query:       the cdr report query
+    :type query:        str
+    :param params:      bind parameters for the query
+    :type params:       dict
+    :param format:      output format (csv|ndjson)
+    :type format:       str
+    :param chunk_size:  number of rows fetched and rendered per chunk
+    :type chunk_size:   int
+    :return:            chunks of the formatted report
+    :rtype:             collections.abc.Generator[str]
+    """
+    stmt = text(query).execution_options(stream_results=True, yield_per=chunk_size)
+    rows = db.execute(stmt, params)
+
+    buffer = io.StringIO()
+    if format == 'csv':
+        writer = csv.DictWriter(buffer, fieldnames=CDR_REPORT_FIELDS)
+        writer.writeheader()
+        write_row = writer.writerow
+    else:
+        write_row = lambda data: buffer.write(json.dumps(data, default=str) + '\n')
+
+    for partition in rows.partitions(chunk_size):
+        for row in partition:
+            write_row(cdrRowToDict(row))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+
+    # make sure the header is sent even when there are no results
+    if buffer.tell() > 0:
+        yield buffer.getvalue()
@@ -35,10 +35,20 @@ function installSQL {
 
 function install {
     installSQL
+    cronAppend "*/5 * * * * ${PYTHON_CMD} ${DSIP_PROJECT_DIR}/gui/dsiprouter_cron.py cdr consolidate"
+    # the per gwgroup report entries are replaced by the sendreports entry
+    cronRemove 'dsiprouter_cron.py cdr sendreport'
+    cronAppend "* * * * * ${PYTHON_CMD} ${DSIP_PROJECT_DIR}/gui/dsiprouter_cron.py cdr sendreports"
+    cronAppend "*/5 * * * * ${PYTHON_CMD} ${DSIP_PROJECT_DIR}/gui/dsiprouter_cron.py cdr rollup"
+    cronAppend "30 2 * * * ${PYTHON_CMD} ${DSIP_PROJECT_DIR}/gui/dsiprouter_cron.py cdr lifecycle"
     printdbg "CDR module installed"
 }
 
 function uninstall {
+    cronRemove 'dsiprouter_cron.py cdr consolidate'
+    cronRemove 'dsiprouter_cron.py cdr sendreports'
+    cronRemove 'dsiprouter_cron.py cdr rollup'
+    cronRemove 'dsiprouter_cron.py cdr lifecycle'
     printdbg "CDR module uninstalled"
 }
 
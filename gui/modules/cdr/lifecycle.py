@@ -0,0 +1,263 @@
+# make sure the generated source files are imported instead of the template ones
+import sys
+if sys.path[0] != '/etc/dsiprouter/gui':
+    sys.path.insert(0, '/etc/dsiprouter/gui')
+
+import os, gzip, json, time
+from contextlib import nullcontext
+from datetime import date
+from sqlalchemy.sql import text
+from shared import IO
+from database import getDBEngine
+import settings
+
+# parquet archives are written when pyarrow is installed, gzip'd ndjson otherwise
+try:
+    import pyarrow
+    import pyarrow.parquet
+    HAS_PARQUET = True
+except ImportError:
+    HAS_PARQUET = False
+
+# partitioned tables, their id column and the datetime column they are partitioned on
+CDR_LIFECYCLE_TABLES = {
+    'cdrs': ('cdr_id', 'call_start_time'),
+    'acc': ('id', 'time'),
+}
+# number of future monthly partitions kept ahead of the current month
+CDR_PARTITIONS_AHEAD = 2
+# catch-all partition for rows past the last monthly partition
+CDR_PARTITION_MAX = 'pmax'
+# rows written to an archive at a time
+CDR_ARCHIVE_CHUNK_SIZE = 10000
+# named lock preventing overlapping lifecycle runs
+CDR_LIFECYCLE_LOCK = 'dsiprouter_cdr_lifecycle'
+
+
+def addMonths(month, count):
+    """
+    :param month:   first day of a month
+    :type month:    datetime.date
+    :param count:   number of months to add, may be negative
+    :type count:    int
+    :return:        first day of the resulting month
+    :rtype:         datetime.date
+    """
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partitionName(month):
+    return 'p{:04d}{:02d}'.format(month.year, month.month)
+
+
+def partitionDefinition(month):
+    # the partition holds the rows before the start of the next month
+    return "PARTITION {} VALUES LESS THAN (TO_DAYS('{}'))".format(partitionName(month), addMonths(month, 1).isoformat())
+
+
+def getPartitions(conn, table):
+    """
+    Get the monthly partitions of a table
+
+    :param conn:    connection to query with
+    :type conn:     :class:`sqlalchemy.engine.Connection`
+    :param table:   name of the table
+    :type table:    str
+    :return:        the months the partitions hold, ordered, empty if the table is not partitioned
+    :rtype:         list[datetime.date]
+    """
+    names = conn.execute(
+        text("""SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL
+            ORDER BY PARTITION_ORDINAL_POSITION"""),
+        {'table': table}
+    ).scalars().all()
+    return [date(int(name[1:5]), int(name[5:7]), 1) for name in names if name != CDR_PARTITION_MAX]
+
+
+def partitionTable(conn, table, through):
+    """
+    Convert a table to monthly RANGE partitions
+
+    The id column alone can not be the primary key of a partitioned table, so the primary key
+    becomes (id, datetime column). The table is rebuilt, which takes a while on a large table
+    but only happens on the first run.
+
+    :param conn:        connection to run on
+    :type conn:         :class:`sqlalchemy.engine.Connection`
+    :param table:       name of the table
+    :type table:        str
+    :param through:     the last month to create a partition for
+    :type through:      datetime.date
+    :return:            None
+    :rtype:             None
+    """
+    id_col, time_col = CDR_LIFECYCLE_TABLES[table]
+
+    oldest = conn.execute(text('SELECT MIN({}) FROM {}'.format(time_col, table))).scalar()
+    month = date(oldest.year, oldest.month, 1) if oldest is not None else date.today().replace(day=1)
+    month = min(month, through)
+
+    partitions = []
+    while month <= through:
+        partitions.append(partitionDefinition(month))
+        month = addMonths(month, 1)
+    partitions.append('PARTITION {} VALUES LESS THAN MAXVALUE'.format(CDR_PARTITION_MAX))
+
+    IO.loginfo('partitioning table {} by month, this rebuilds the table'.format(table))
+    conn.execute(text('ALTER TABLE {table} DROP PRIMARY KEY, ADD PRIMARY KEY ({id_col}, {time_col}) '
+                      'PARTITION BY RANGE (TO_DAYS({time_col})) ({partitions})'.format(
+        table=table, id_col=id_col, time_col=time_col, partitions=', '.join(partitions))))
+
+
+def addPartitions(conn, table, through):
+    """
+    Split the monthly partitions up to a month out of the catch-all partition
+
+    :param conn:        connection to run on
+    :type conn:         :class:`sqlalchemy.engine.Connection`
+    :param table:       name of the table
+    :type table:        str
+    :param through:     the last month to create a partition for
+    :type through:      datetime.date
+    :return:            the months added
+    :rtype:             list[datetime.date]
+    """
+    months = getPartitions(conn, table)
+    month = addMonths(months[-1], 1) if len(months) > 0 else date.today().replace(day=1)
+
+    added = []
+    while month <= through:
+        added.append(month)
+        month = addMonths(month, 1)
+    if len(added) > 0:
+        # pmax is empty unless rows were written past the last partition, so this is cheap
+        conn.execute(text('ALTER TABLE {} REORGANIZE PARTITION {} INTO ({}, PARTITION {} VALUES LESS THAN MAXVALUE)'.format(
+            table, CDR_PARTITION_MAX, ', '.join(partitionDefinition(month) for month in added), CDR_PARTITION_MAX)))
+    return added
+
+
+def archivePartition(conn, table, month, folder=None):
+    """
+    Export the rows of a monthly partition to a compressed archive
+
+    Parquet is used when pyarrow is available, gzip'd NDJSON otherwise. The rows are streamed
+    from a server-side cursor and the archive only appears under its final name when complete.
+
+    :param conn:        connection to run on
+    :type conn:         :class:`sqlalchemy.engine.Connection`
+    :param table:       name of the table
+    :type table:        str
+    :param month:       the month held by the partition
+    :type month:        datetime.date
+    :param folder:      directory to write the archive to, defaults to settings.CDR_ARCHIVE_FOLDER
+    :type folder:       str|None
+    :return:            path of the archive and the number of rows in it
+    :rtype:             (str, int)
+    """
+    if folder is None:
+        folder = settings.CDR_ARCHIVE_FOLDER
+    os.makedirs(folder, exist_ok=True)
+
+    archive_path = os.path.join(folder, '{}-{}.{}'.format(
+        table, partitionName(month)[1:], 'parquet' if HAS_PARQUET else 'ndjson.gz'))
+    tmp_path = archive_path + '.tmp'
+
+    result = conn.execute(
+        text('SELECT * FROM {} PARTITION ({})'.format(table, partitionName(month))),
+        execution_options={'stream_results': True, 'yield_per': CDR_ARCHIVE_CHUNK_SIZE}
+    )
+
+    count = 0
+    try:
+        if HAS_PARQUET:
+            writer = None
+            try:
+                for rows in result.mappings().partitions():
+                    batch = [dict(row) for row in rows]
+                    if writer is None:
+                        batch_table = pyarrow.Table.from_pylist(batch)
+                        writer = pyarrow.parquet.ParquetWriter(tmp_path, batch_table.schema, compression='zstd')
+                    else:
+                        batch_table = pyarrow.Table.from_pylist(batch, schema=writer.schema)
+                    writer.write_table(batch_table)
+                    count += len(batch)
+            finally:
+                if writer is not None:
+                    writer.close()
+            # an empty partition still gets an archive so it is not exported again
+            if writer is None:
+                open(tmp_path, 'wb').close()
+        else:
+            with gzip.open(tmp_path, 'wt', encoding='utf-8') as fp:
+                for rows in result.mappings().partitions():
+                    fp.writelines(json.dumps(dict(row), default=str) + '\n' for row in rows)
+                    count += len(rows)
+        os.replace(tmp_path, archive_path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    return archive_path, count
+
+
+def manageCDRLifecycle(retention_months=None, conn=None):
+    """
+    Partition cdrs / acc by month, archive the months past the retention and drop them
+
+    Dropping a partition is a metadata change, so expired months are removed without
+    a long running DELETE. A month is only dropped after its archive was written.
+
+    :param retention_months:    months kept in the database, defaults to settings.CDR_RETENTION_MONTHS,
+                                0 disables the lifecycle management
+    :type retention_months:     int|None
+    :param conn:                connection to run on, defaults to a new connection to the kamailio DB
+    :type conn:                 :class:`sqlalchemy.engine.Connection`|None
+    :return:                    the partitions added, archived and dropped per table
+    :rtype:                     dict
+    """
+    if retention_months is None:
+        retention_months = settings.CDR_RETENTION_MONTHS
+    stats = {}
+    if retention_months <= 0:
+        return stats
+
+    this_month = date.today().replace(day=1)
+    through = addMonths(this_month, CDR_PARTITIONS_AHEAD)
+    # the oldest month that is kept
+    keep_from = addMonths(this_month, -(retention_months - 1))
+
+    with (getDBEngine().connect() if conn is None else nullcontext(conn)) as conn:
+        if conn.execute(text('SELECT GET_LOCK(:name, 0)'), {'name': CDR_LIFECYCLE_LOCK}).scalar() != 1:
+            IO.logwarn('cdr lifecycle already running, skipping this run')
+            return stats
+        conn.commit()
+
+        try:
+            for table in CDR_LIFECYCLE_TABLES:
+                table_stats = stats[table] = {'added': [], 'archived': [], 'dropped': []}
+
+                if len(getPartitions(conn, table)) == 0:
+                    partitionTable(conn, table, through)
+                table_stats['added'] = [partitionName(month) for month in addPartitions(conn, table, through)]
+
+                for month in getPartitions(conn, table):
+                    if month >= keep_from:
+                        break
+                    start = time.perf_counter()
+                    archive_path, count = archivePartition(conn, table, month)
+                    conn.execute(text('ALTER TABLE {} DROP PARTITION {}'.format(table, partitionName(month))))
+                    table_stats['archived'].append(archive_path)
+                    table_stats['dropped'].append(partitionName(month))
+                    IO.loginfo('archived {} rows of {} partition {} to {} and dropped it in {:.3f}s'.format(
+                        count, table, partitionName(month), archive_path, time.perf_counter() - start))
+                conn.commit()
+        finally:
+            conn.execute(text('SELECT RELEASE_LOCK(:name)'), {'name': CDR_LIFECYCLE_LOCK})
+            conn.commit()
+
+    return stats
@@ -0,0 +1,275 @@
+# make sure the generated source files are imported instead of the template ones
+import sys
+if sys.path[0] != '/etc/dsiprouter/gui':
+    sys.path.insert(0, '/etc/dsiprouter/gui')
+
+import os, gzip, json, time, shutil, smtplib, tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import text
+from werkzeug.utils import secure_filename
+from shared import IO
+from database import getDBEngine, dSIPCDRInfo
+from database.cache import gwgroup_cache
+from modules.cdr.functions import buildCDRQuery, streamCDRS
+from util.cron import cronIntervalMatches, cronNextTime
+from util.notifications import iterEmailMessage, sendStreamedEmail, connectSMTP
+import settings
+
+# number of reports generated concurrently, each worker holds one DB connection
+CDR_REPORT_WORKERS = 4
+# attempts made to send a report before it is dropped from the retry backlog
+CDR_REPORT_MAX_ATTEMPTS = 5
+# seconds before the first retry of a failed report, doubled on every further attempt
+CDR_REPORT_RETRY_DELAY = 300
+# failed reports waiting to be retried, survives between the cron runs
+CDR_REPORT_BACKLOG_FILE = '/var/lib/dsiprouter/cdr_report_backlog.json'
+# named lock preventing overlapping report runs
+CDR_REPORT_LOCK = 'dsiprouter_cdr_reports'
+
+
+def loadReportBacklog():
+    """
+    :return:    the failed reports by gwgroupid, with their attempts, next_attempt and error
+    :rtype:     dict
+    """
+    try:
+        with open(CDR_REPORT_BACKLOG_FILE, 'r') as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        return {}
+    except Exception as ex:
+        IO.logwarn('could not read cdr report backlog {}: {}'.format(CDR_REPORT_BACKLOG_FILE, str(ex)))
+        return {}
+
+
+def saveReportBacklog(backlog):
+    """
+    :param backlog:     the failed reports by gwgroupid
+    :type backlog:      dict
+    :return:            None
+    :rtype:             None
+    """
+    tmp_file = '{}.{}'.format(CDR_REPORT_BACKLOG_FILE, os.getpid())
+    try:
+        with open(os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as fp:
+            json.dump(backlog, fp)
+        os.replace(tmp_file, CDR_REPORT_BACKLOG_FILE)
+    except Exception as ex:
+        IO.logerr('could not write cdr report backlog {}: {}'.format(CDR_REPORT_BACKLOG_FILE, str(ex)))
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+
+
+def getDueReports(db, now, backlog, gwgroupids=None):
+    """
+    Get the reports whose send interval came due since they were last sent or whose retry is due
+
+    A report is due once the first time its interval matches after last_sent has passed, so the
+    runs that were skipped, late or found another run holding the lock are caught up on the next one.
+
+    :param db:          session to query with
+    :type db:           :class:`sqlalchemy.orm.Session`
+    :param now:         the current minute
+    :type now:          datetime
+    :param backlog:     the failed reports by gwgroupid
+    :type backlog:      dict
+    :param gwgroupids:  only these reports, sent regardless of their interval
+    :type gwgroupids:   list|None
+    :return:            the reports, as dicts of the dsip_cdrinfo columns
+    :rtype:             list[dict]
+    """
+    query = db.query(dSIPCDRInfo)
+    if gwgroupids is not None:
+        query = query.filter(dSIPCDRInfo.gwgroupid.in_([int(gwgroupid) for gwgroupid in gwgroupids]))
+
+    reports = []
+    for cdr_info in query.all():
+        retry = backlog.get(str(cdr_info.gwgroupid), None)
+        # a failed report keeps its last_sent time, it is only due again once its retry is
+        if retry is not None:
+            due = retry['next_attempt'] <= time.time()
+        elif cdr_info.last_sent is None:
+            due = cronIntervalMatches(cdr_info.send_interval, now)
+        else:
+            next_send = cronNextTime(cdr_info.send_interval, cdr_info.last_sent)
+            due = next_send is not None and next_send <= now
+        if gwgroupids is not None or due:
+            reports.append({
+                'gwgroupid': cdr_info.gwgroupid,
+                'email': cdr_info.email,
+                'send_interval': cdr_info.send_interval,
+                'last_sent': cdr_info.last_sent,
+            })
+    return reports
+
+
+def generateCDRReport(report, now, folder):
+    """
+    Stream the cdrs of a gwgroup since its last report to a gzip'd csv
+
+    Runs in a worker thread, so it uses a session of its own.
+
+    :param report:      the report, as returned by :func:`getDueReports`
+    :type report:       dict
+    :param now:         the time the report is generated for
+    :type now:          datetime
+    :param folder:      directory to write the attachment to
+    :type folder:       str
+    :return:            the report with the attachment path, its size and the generation time added
+    :rtype:             dict
+    """
+    start = time.perf_counter()
+
+    gwgroup = gwgroup_cache.get(report['gwgroupid'])
+    if gwgroup is None:
+        raise Exception("Endpoint group {} doesn't exist".format(report['gwgroupid']))
+    report['name'] = gwgroup['fields'].get('name', '')
+
+    filename = secure_filename('{}_{}.csv.gz'.format(report['name'], now.strftime('%Y%m%d-%H%M%S')))
+    attachment = os.path.join(folder, filename)
+    params = {
+        'gwgroupid': str(report['gwgroupid']),
+        'dtfilter': report['last_sent'] if report['last_sent'] is not None else datetime.min,
+    }
+
+    with Session(bind=getDBEngine()) as db:
+        with gzip.open(attachment, 'wt', encoding='utf-8', newline='') as fp:
+            fp.writelines(streamCDRS(db, buildCDRQuery(), params, 'csv'))
+
+    report['attachment'] = attachment
+    report['bytes'] = os.path.getsize(attachment)
+    report['generate_time'] = time.perf_counter() - start
+    return report
+
+
+def deliverCDRReport(server, report):
+    """
+    Email a generated report over an open SMTP connection
+
+    :param server:      the connection, as returned by :func:`util.notifications.connectSMTP`
+    :type server:       smtplib.SMTP
+    :param report:      the report, as returned by :func:`generateCDRReport`
+    :type report:       dict
+    :return:            None
+    :rtype:             None
+    """
+    recipients = report['email'].split(',')
+    chunks = iterEmailMessage(
+        recipients,
+        "CDR Report for {}".format(report['name']),
+        html_body="<html>CDR Report for {}</html>".format(report['name']),
+        subject="CDR Report for {}".format(report['name']),
+        attachments=[report['attachment']]
+    )
+    sendStreamedEmail(server, settings.MAIL_DEFAULT_SENDER, recipients, chunks)
+
+
+def sendCDRReports(gwgroupids=None, now=None, workers=CDR_REPORT_WORKERS):
+    """
+    Generate and email all the due cdr reports
+
+    Replaces the crontab entry per gwgroup, the reports are generated concurrently by a bounded
+    pool of workers and sent over a single SMTP connection as they complete. A failed report
+    keeps its last_sent time and is retried with an exponential backoff on the following runs,
+    after too many attempts it is retried on its next interval instead.
+
+    :param gwgroupids:  only send the reports of these gwgroups, regardless of their interval
+    :type gwgroupids:   list|None
+    :param now:         the time to check the intervals at, defaults to the current minute
+    :type now:          datetime|None
+    :param workers:     max number of reports generated concurrently
+    :type workers:      int
+    :return:            number of reports due, sent and failed, with the timing of each report
+    :rtype:             dict
+    """
+    if now is None:
+        now = datetime.now().replace(second=0, microsecond=0)
+    stats = {'due': 0, 'sent': 0, 'failed': 0, 'reports': []}
+
+    with getDBEngine().connect() as conn:
+        if conn.execute(text('SELECT GET_LOCK(:name, 0)'), {'name': CDR_REPORT_LOCK}).scalar() != 1:
+            IO.logwarn('cdr reports already being sent, skipping this run')
+            return stats
+        conn.commit()
+
+        backlog = loadReportBacklog()
+        folder = tempfile.mkdtemp(prefix='dsip_cdr_reports_')
+        server = None
+        try:
+            with Session(bind=getDBEngine()) as db:
+                reports = getDueReports(db, now, backlog, gwgroupids)
+            stats['due'] = len(reports)
+            if len(reports) == 0:
+                return stats
+
+            with ThreadPoolExecutor(max_workers=min(workers, len(reports))) as executor:
+                futures = {executor.submit(generateCDRReport, report, now, folder): report for report in reports}
+
+                for future in as_completed(futures):
+                    report = futures[future]
+                    key = str(report['gwgroupid'])
+                    try:
+                        future.result()
+
+                        start = time.perf_counter()
+                        try:
+                            if server is None:
+                                server = connectSMTP()
+                            deliverCDRReport(server, report)
+                        except smtplib.SMTPServerDisconnected:
+                            # the server dropped the idle connection, reconnect once
+                            server = connectSMTP()
+                            deliverCDRReport(server, report)
+                        report['send_time'] = time.perf_counter() - start
+
+                        conn.execute(text('UPDATE dsip_cdrinfo SET last_sent = :now WHERE gwgroupid = :gwgroupid'),
+                                     {'now': now, 'gwgroupid': report['gwgroupid']})
+                        conn.commit()
+                        backlog.pop(key, None)
+
+                        stats['sent'] += 1
+                        stats['reports'].append({field: report[field] for field in ('gwgroupid', 'bytes', 'generate_time', 'send_time')})
+                        IO.loginfo('sent cdr report for gwgroup {} ({} bytes) generated in {:.3f}s, sent in {:.3f}s'.format(
+                            key, report['bytes'], report['generate_time'], report['send_time']))
+                    except Exception as ex:
+                        stats['failed'] += 1
+                        attempts = backlog.get(key, {}).get('attempts', 0) + 1
+                        if attempts >= CDR_REPORT_MAX_ATTEMPTS:
+                            # the report is still due from its last_sent time, hold it off until its next interval
+                            next_send = cronNextTime(report['send_interval'], now)
+                            backlog[key] = {
+                                'attempts': 0,
+                                'next_attempt': next_send.timestamp() if next_send is not None else float('inf'),
+                                'error': str(ex),
+                            }
+                            IO.logerr('cdr report for gwgroup {} failed {} times, giving up until its next interval: {}'.format(
+                                key, attempts, str(ex)))
+                        else:
+                            backlog[key] = {
+                                'attempts': attempts,
+                                'next_attempt': time.time() + CDR_REPORT_RETRY_DELAY * 2 ** (attempts - 1),
+                                'error': str(ex),
+                            }
+                            IO.logwarn('cdr report for gwgroup {} failed, retrying later: {}'.format(key, str(ex)))
+                        if isinstance(ex, smtplib.SMTPException) and server is not None:
+                            server.close()
+                            server = None
+                    finally:
+                        if 'attachment' in report:
+                            os.remove(report['attachment'])
+        finally:
+            if server is not None:
+                try:
+                    server.quit()
+                except smtplib.SMTPException:
+                    pass
+            shutil.rmtree(folder, ignore_errors=True)
+            saveReportBacklog(backlog)
+            conn.execute(text('SELECT RELEASE_LOCK(:name)'), {'name': CDR_REPORT_LOCK})
+            conn.commit()
+
+    return stats
@@ -41,6 +41,22 @@ CREATE TABLE `dsip_multidomain_mapping` (
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
+--
+-- Table structure for table `dsip_multidomain_sync`
+-- the domain set of each PBX as of its last sync, used to sync only the domains that changed
+--
+
+DROP TABLE IF EXISTS `dsip_multidomain_sync`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8 */;
+CREATE TABLE `dsip_multidomain_sync` (
+  `pbx_id` int(10) NOT NULL,
+  `domain` varchar(64) NOT NULL,
+  `updated` datetime DEFAULT NULL,
+  PRIMARY KEY (`pbx_id`,`domain`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
 --
 -- Table structure for table `dsip_domain_mapping`
 --
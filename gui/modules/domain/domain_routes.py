@@ -13,6 +13,7 @@ from database import startSession, DummySession, Domain, DomainAttrs, Dispatcher
 from modules.api.api_routes import addEndpointGroups
 from shared import debugException, debugEndpoint, showError, strFieldsToDict, stripDictVals
 from util.ipc import STATE_SHMEM_NAME, getSharedMemoryDict
+from modules.api.kamailio.functions import markKamailioReloadRequired
 import settings
 
 domains = Blueprint('domains', __name__)
@@ -325,7 +326,7 @@ def addUpdateDomain():
             addDomain(domainlist.split(",")[0].strip(), authtype, pbxs, notes, db)
 
         db.commit()
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+        markKamailioReloadRequired('domain', 'dispatcher')
         return displayDomains()
 
     except sql_exceptions.SQLAlchemyError as ex:
@@ -377,7 +378,7 @@ def deleteDomain():
         domainEntry.delete(synchronize_session=False)
 
         db.commit()
-        getSharedMemoryDict(STATE_SHMEM_NAME)['kam_reload_required'] = True
+        markKamailioReloadRequired('domain', 'dispatcher')
         return displayDomains()
 
     except sql_exceptions.SQLAlchemyError as ex:
@@ -1,213 +1,224 @@
-import os, psycopg2, hashlib, MySQLdb, subprocess, docker,shutil
-from database import dSIPMultiDomainMapping
-from util.security import AES_CTR
+import os, time, hashlib, psycopg2, subprocess, shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from sqlalchemy import bindparam
+from sqlalchemy.sql import text
+from database import getDBEngine
 from util.networking import safeUriToHost, hostToIP
 
-# TODO: error handling here is pretty bad, we need to establish connection from main func and pass conn/cursors to sub funcs
-#       I implemented an exmaple in sync_needed() of proper connection / cursor handling, we need to move that to the entry func
-#       i.e. run_sync() should utilize the proper handling of the connections/cursors and pass them to sub functions
+# number of FusionPBX sources synced concurrently, each uses a connection from the kamailio DB pool
+FUSIONPBX_SYNC_WORKERS = 8
+# rows written / deleted per statement
+FUSIONPBX_SYNC_BATCH_SIZE = 500
+# named lock preventing overlapping sync runs
+FUSIONPBX_SYNC_LOCK = 'dsiprouter_fusionpbx_sync'
+
+# the domain set of each PBX as of its last sync, created here as well for installs that predate the table
+SYNC_TRACKING_TABLE_SQL = """CREATE TABLE IF NOT EXISTS dsip_multidomain_sync (
+  pbx_id int(10) NOT NULL,
+  domain varchar(64) NOT NULL,
+  updated datetime DEFAULT NULL,
+  PRIMARY KEY (pbx_id, domain)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8"""
+
+# values of dsip_multidomain_mapping.syncstatus
+SYNC_STATUS_CHANGED = 1
+SYNC_STATUS_UNCHANGED = 2
+SYNC_STATUS_NO_DOMAINS = 3
+SYNC_STATUS_ERROR = 4
+
 
 # Obtain a set of FusionPBX systems that contains domains that Kamailio will route traffic to.
-def get_sources(db):
-    # Dictionary object to hold the set of source FusionPBX systems
+def get_sources(conn):
+    # Dictionary object to hold the set of source FusionPBX systems, keyed by the PBX host
     sources = {}
 
-    # Kamailio Database Parameters
-    kam_hostname = db['hostname']
-    kam_username = db['username']
-    kam_password = db['password']
-    kam_database = db['database']
-
-    try:
-        db = MySQLdb.connect(host=kam_hostname, user=kam_username, passwd=kam_password, db=kam_database)
-        c = db.cursor()
-        c.execute(
-            """select pbx_id,address as pbx_host,db_host,db_username,db_password,domain_list,domain_list_hash,attr_list,dsip_multidomain_mapping.type from dsip_multidomain_mapping join dr_gw_lists on dsip_multidomain_mapping.pbx_id=dr_gw_lists.id join dr_gateways on dr_gateways.gwid = dr_gw_lists.gwlist where enabled=1""")
-        results = c.fetchall()
-        db.close()
-        for row in results:
-            # Store the PBX_ID as the key and the entire row as the value
-            sources[row[1]] = row
-    except Exception as e:
-        print(str(e))
+    rows = conn.execute(text(
+        """select pbx_id,address as pbx_host,db_host,db_username,db_password,domain_list,domain_list_hash,attr_list,dsip_multidomain_mapping.type from dsip_multidomain_mapping join dr_gw_lists on dsip_multidomain_mapping.pbx_id=dr_gw_lists.id join dr_gateways on dr_gateways.gwid = dr_gw_lists.gwlist where enabled=1"""))
+    for row in rows.mappings():
+        sources[row['pbx_host']] = dict(row)
 
     return sources
 
 
-# Will remove all of the fusionpbx domain data so that it can be rebuilt
-def drop_fusionpbx_domains(source, dest):
-    # PBX Domain Mapping Parameters
-    pbx_domain_list = source[5]
-    pbx_attr_list = source[6]
+# Whether the v_domains table of a FusionPBX system has the insert_date / update_date columns (FusionPBX 4.5+)
+def has_domain_timestamps(fpbx_curs):
+    fpbx_curs.execute("""select count(*) from information_schema.columns where table_name='v_domains' and column_name in ('insert_date','update_date')""")
+    return fpbx_curs.fetchone()[0] == 2
 
-    # Kamailio Database Parameters
-    kam_hostname = dest['hostname']
-    kam_username = dest['username']
-    kam_password = dest['password']
-    kam_database = dest['database']
 
-    pbx_domain_list = list(map(int, filter(None, pbx_domain_list.split(","))))
-    pbx_attr_list = list(map(int, filter(None, pbx_attr_list.split(","))))
+# Get the enabled domains of a FusionPBX system, with the time they were last modified if known
+def get_fusionpbx_domains(fpbx_curs, fpbx_ip, timestamps):
+    fpbx_curs.execute(
+        """select domain_name,{} from v_domains where domain_enabled='true' and domain_name <> %s""".format(
+            'coalesce(update_date,insert_date)' if timestamps else 'null'),
+        [fpbx_ip])
+    return dict(fpbx_curs.fetchall())
 
-    kam_conn = None
-    kam_curs = None
 
-    try:
-        kam_conn = MySQLdb.connect(host=kam_hostname, user=kam_username, passwd=kam_password, db=kam_database)
-        kam_curs = kam_conn.cursor()
+# Get the domains of a FusionPBX system modified at or after a point in time, with whether they are enabled
+def get_fusionpbx_domain_changes(fpbx_curs, fpbx_ip, since):
+    fpbx_curs.execute(
+        """select domain_name,domain_enabled='true',coalesce(update_date,insert_date) from v_domains where coalesce(update_date,insert_date) >= %s and domain_name <> %s""",
+        [since, fpbx_ip])
+    return fpbx_curs.fetchall()
 
-        if len(pbx_domain_list) > 0:
-            kam_curs.execute("""DELETE FROM domain WHERE id IN({})""".format(pbx_domain_list))
 
-        if len(pbx_attr_list) > 0:
-            kam_curs.execute("""DELETE FROM domain_attrs WHERE id IN({})""".format(pbx_attr_list))
+# Count the enabled domains of a FusionPBX system, deleted domains do not show up as changes so the count is compared
+def count_fusionpbx_domains(fpbx_curs, fpbx_ip):
+    fpbx_curs.execute("""select count(*) from v_domains where domain_enabled='true' and domain_name <> %s""", [fpbx_ip])
+    return fpbx_curs.fetchone()[0]
 
-        kam_conn.commit()
-    except Exception as ex:
-        error = str(ex)
-        try:
-            kam_conn.rollback()
-            kam_curs.execute("update dsip_multidomain_mapping set syncstatus=4, lastsync=NOW(),syncerror='{}'".format(error))
-            kam_conn.commit()
-        except:
-            pass
-        raise ex
-    finally:
-        if kam_curs is not None:
-            kam_curs.close()
-        if kam_conn is not None:
-            kam_conn.close()
-
-def sync_db(source, dest):
-    # FusionPBX Database Parameters
-    pbx_id = source[0]
-    pbx_host = source[1]
-    if ':' in source[2]:
-        fpbx_hostname = source[2].split(':')[0]
-        fpbx_port = source[2].split(':')[1]
+
+# Get the domains previously synced from a PBX, they are tagged with a created_by attribute
+def get_synced_domains(conn, pbx_id):
+    return set(conn.execute(
+        text("""select did from domain_attrs where name='created_by' and value=:pbx_id"""),
+        {'pbx_id': str(pbx_id)}
+    ).scalars())
+
+
+# Get the domain set stored by the last sync of a PBX, with the time each domain was last modified on the PBX
+def get_tracked_domains(conn, pbx_id):
+    return dict(conn.execute(
+        text("""select domain,updated from dsip_multidomain_sync where pbx_id=:pbx_id"""),
+        {'pbx_id': pbx_id}
+    ).all())
+
+
+# Get the enabled domains of a FusionPBX system, incrementally if possible
+# returns the domains with the time they were last modified and whether all the domains were fetched
+def fetch_domains(source, tracked):
+    if ':' in source['db_host']:
+        fpbx_hostname, fpbx_port = source['db_host'].split(':', 1)
     else:
-        fpbx_hostname = source[2]
+        fpbx_hostname = source['db_host']
         fpbx_port = 5432
-    fpbx_username = source[3]
-    fpbx_password = source[4]
-    pbx_domain_list = source[5]
-    pbx_attr_list = source[6]
-    pbx_type = source[8]
-    fpbx_database = 'fusionpbx'
-
-    # Kamailio Database Parameters
-    kam_hostname = dest['hostname']
-    kam_username = dest['username']
-    kam_password = dest['password']
-    kam_database = dest['database']
-
-    domain_id_list = []
-    attr_id_list = []
-
-    fpbx_conn = None
-    fpbx_curs = None
-    kam_conn = None
-    kam_curs = None
+    fpbx_ip = hostToIP(fpbx_hostname)
 
+    fpbx_conn = psycopg2.connect(dbname='fusionpbx', user=source['db_username'], host=fpbx_hostname, port=fpbx_port,
+                                 password=source['db_password'])
     try:
-        # Get a connection to Kamailio Server DB
-        kam_conn = MySQLdb.connect(host=kam_hostname, user=kam_username, passwd=kam_password, db=kam_database)
-        kam_curs = kam_conn.cursor()
-        # Delete existing domain for the pbx
-        pbx_domain_list_str = ''.join(str(e) for e in pbx_domain_list)
-        if len(pbx_domain_list_str) > 0:
-            query = "delete from domain where id in ({})".format(pbx_domain_list_str)
-            kam_curs.execute(query)
-            pbx_domain_list = ''
-
-        # Trying connecting to PostgresSQL database using a Trust releationship first
-        fpbx_conn = psycopg2.connect(dbname=fpbx_database, user=fpbx_username, host=fpbx_hostname, port=fpbx_port, password=fpbx_password)
-        if fpbx_conn is not None:
-            print("Connection to FusionPBX:{} database was successful".format(fpbx_hostname))
-        fpbx_curs = fpbx_conn.cursor()
-        fpbx_curs.execute("""select domain_name from v_domains where domain_enabled='true' and domain_name <> %s""",[hostToIP(fpbx_hostname)])
-        rows = fpbx_curs.fetchall()
-        if rows is not None:
-            counter = 0
-            domain_name_str = ""
-
-            for row in rows:
-                kam_curs.execute("""insert ignore into domain (id,domain,did,last_modified) values (null,%s,%s,NOW())""",
-                          (row[0], row[0]))
-
-                if kam_curs.rowcount > 0:
-                    kam_curs.execute(
-                        """SELECT AUTO_INCREMENT FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN('domain') ORDER BY FIND_IN_SET(TABLE_NAME, 'domain')""")
-                    rows_left = kam_curs.fetchall()
-                    domain_id_list.append(str(rows_left[0][0] - 1))
-                # Delete all domain_attrs for the domain first
-                kam_curs.execute("""delete from domain_attrs where did=%s""", [row[0]])
-                kam_curs.execute(
-                    """insert ignore into domain_attrs (id,did,name,type,value,last_modified) values (null,%s,'pbx_ip',2,%s,NOW())""",
-                    (row[0], pbx_host))
-                kam_curs.execute(
-                    """insert ignore into domain_attrs (id,did,name,type,value,last_modified) values (null,%s,'pbx_type',2,%s,NOW())""",
-
-                    (row[0], pbx_type))
-                kam_curs.execute(
-                    """insert ignore into domain_attrs (id,did,name,type,value,last_modified) values (null,%s,'created_by',2,%s,NOW())""",
-                    (row[0], pbx_id))
-                kam_curs.execute(
-                    """insert ignore into domain_attrs (id,did,name,type,value,last_modified) values (null,%s,'dispatcher_set_id',2,%s,NOW())""",
-                    (row[0], pbx_id))
-                kam_curs.execute(
-                    """insert ignore into domain_attrs (id,did,name,type,value,last_modified) values (null,%s,'dispatcher_reg_alg',2,%s,NOW())""",
-                    (row[0], 4))
-                kam_curs.execute(
-
-                    """insert ignore into domain_attrs (id,did,name,type,value,last_modified) values (null,%s,'domain_auth',2,%s,NOW())""",
-                    (row[0], 'passthru'))
-                kam_curs.execute(
-                    """insert ignore into domain_attrs (id,did,name,type,value,last_modified) values (null,%s,'pbx_list',2,%s,NOW())""",
-                    (row[0], pbx_id))
-                kam_curs.execute(
-                    """insert ignore into domain_attrs (id,did,name,type,value,last_modified) values (null,%s,'description',2,%s,NOW())""",
-                    (row[0], 'notes:'))
-                counter = counter + 1
-                domain_name_str += row[0]
-
-            # Convert to a string seperated by commas
-            domain_id_list = ','.join(domain_id_list)
-
-            if not pbx_domain_list:  # if empty string then this is the first set of domains
-                pbx_domain_list = domain_id_list
-            else:  # adding to an existing list of domains
-                pbx_domain_list = pbx_domain_list + "," + domain_id_list
-
-            print("[sync_db] String of domains: {}".format(domain_name_str))
-
-            # Create Hash of the string
-            domain_name_str_hash = hashlib.md5(domain_name_str.encode('utf-8')).hexdigest()
-            print("[sync_db] Hashed String of domains: {}".format(domain_name_str_hash))
-
-            kam_curs.execute(
-                """update dsip_multidomain_mapping set domain_list=%s, domain_list_hash=%s,syncstatus=1, lastsync=NOW(),syncerror='' where pbx_id=%s""",
-                (pbx_domain_list, domain_name_str_hash, pbx_id))
-            kam_conn.commit()
-
-    except Exception as ex:
-        error = str(ex)
-        try:
-            kam_conn.rollback()
-            kam_curs.execute("update dsip_multidomain_mapping set syncstatus=4, lastsync=NOW(),syncerror='{}'".format(error))
-            kam_conn.commit()
-        except:
-            pass
-        raise ex
+        with fpbx_conn.cursor() as fpbx_curs:
+            timestamps = has_domain_timestamps(fpbx_curs)
+            since = max((updated for updated in tracked.values() if updated is not None), default=None)
+
+            # only the domains modified since the last sync are fetched
+            if timestamps and since is not None:
+                domains = dict(tracked)
+                changes = {}
+                for domain, enabled, updated in get_fusionpbx_domain_changes(fpbx_curs, fpbx_ip, since):
+                    if enabled:
+                        domains[domain] = changes[domain] = updated
+                    else:
+                        domains.pop(domain, None)
+                if len(domains) == count_fusionpbx_domains(fpbx_curs, fpbx_ip):
+                    return domains, changes, False
+
+            domains = get_fusionpbx_domains(fpbx_curs, fpbx_ip, timestamps)
+            return domains, domains, True
     finally:
-        if fpbx_conn is not None:
-            fpbx_conn.close()
-        if fpbx_curs is not None:
-            fpbx_curs.close()
-        if kam_curs is not None:
-            kam_curs.close()
-        if kam_conn is not None:
-            kam_conn.close()
+        fpbx_conn.close()
+
+
+# The attributes every domain synced from a PBX gets
+def get_domain_attrs(source):
+    return [
+        ('pbx_ip', source['pbx_host']),
+        ('pbx_type', source['type']),
+        ('created_by', source['pbx_id']),
+        ('dispatcher_set_id', source['pbx_id']),
+        ('dispatcher_reg_alg', 4),
+        ('domain_auth', 'passthru'),
+        ('pbx_list', source['pbx_id']),
+        ('description', 'notes:'),
+    ]
+
+
+# Insert rows with multi-row statements, insert_sql must contain a {values} placeholder
+# row_sql formats the placeholders of a row, such as '({},NOW())'
+def insert_rows(conn, insert_sql, rows, row_sql='({})'):
+    for i in range(0, len(rows), FUSIONPBX_SYNC_BATCH_SIZE):
+        params = {}
+        values = []
+        for j, row in enumerate(rows[i:i + FUSIONPBX_SYNC_BATCH_SIZE]):
+            placeholders = []
+            for k, value in enumerate(row):
+                params['v{}_{}'.format(j, k)] = value
+                placeholders.append(':v{}_{}'.format(j, k))
+            values.append(row_sql.format(','.join(placeholders)))
+        conn.execute(text(insert_sql.format(values=','.join(values))), params)
+
+
+# Delete the rows of a table whose column value is in values, where adds conditions with their params
+def delete_rows(conn, table, values, column='did', where='', params=None):
+    stmt = text("""delete from {} where {} in :values{}""".format(table, column, where)).bindparams(
+        bindparam('values', expanding=True))
+    for i in range(0, len(values), FUSIONPBX_SYNC_BATCH_SIZE):
+        conn.execute(stmt, dict(params or {}, values=values[i:i + FUSIONPBX_SYNC_BATCH_SIZE]))
+
+
+# Sync the domains of a single PBX into kamailio, only the domains that were added / removed are written
+def sync_source(source):
+    pbx_id = source['pbx_id']
+    stats = {'pbx_id': pbx_id, 'added': 0, 'removed': 0, 'full': True, 'elapsed': 0.0}
+    start = time.perf_counter()
+
+    with getDBEngine().connect() as conn:
+        try:
+            tracked = get_tracked_domains(conn, pbx_id)
+            domains, changes, full = fetch_domains(source, tracked)
+
+            # the first sync compares against the domains created before the domains were tracked
+            synced = set(tracked.keys()) if len(tracked) > 0 else get_synced_domains(conn, pbx_id)
+            added = sorted(set(domains.keys()) - synced)
+            removed = sorted(synced - set(domains.keys()))
+
+            if len(removed) > 0:
+                delete_rows(conn, 'domain', removed)
+                delete_rows(conn, 'domain_attrs', removed)
+                delete_rows(conn, 'dsip_multidomain_sync', removed, 'domain', ' and pbx_id=:pbx_id', {'pbx_id': pbx_id})
+
+            if len(added) > 0:
+                # the domain may have leftover attributes from another source
+                delete_rows(conn, 'domain_attrs', added)
+                insert_rows(conn, """insert ignore into domain (domain,did,last_modified) values {values}""",
+                            [(domain, domain) for domain in added], '({},NOW())')
+                attrs = get_domain_attrs(source)
+                insert_rows(conn, """insert ignore into domain_attrs (did,name,type,value,last_modified) values {values}""",
+                            [(domain, name, 2, value) for domain in added for name, value in attrs], '({},NOW())')
+
+            # remember the domain set and when each domain was modified, for the next incremental sync
+            if len(changes) > 0:
+                insert_rows(conn, """insert into dsip_multidomain_sync (pbx_id,domain,updated) values {values} on duplicate key update updated=values(updated)""",
+                            [(pbx_id, domain, updated) for domain, updated in changes.items()])
+
+            if len(domains) == 0:
+                syncstatus = SYNC_STATUS_NO_DOMAINS
+            elif len(added) > 0 or len(removed) > 0:
+                syncstatus = SYNC_STATUS_CHANGED
+            else:
+                syncstatus = SYNC_STATUS_UNCHANGED
+
+            domain_list_hash = hashlib.md5(','.join(sorted(domains.keys())).encode('utf-8')).hexdigest()
+            conn.execute(
+                text("""update dsip_multidomain_mapping set domain_list_hash=:hash,syncstatus=:syncstatus,lastsync=NOW(),syncerror='' where pbx_id=:pbx_id"""),
+                {'hash': domain_list_hash, 'syncstatus': syncstatus, 'pbx_id': pbx_id}
+            )
+            conn.commit()
+        except Exception as ex:
+            conn.rollback()
+            conn.execute(
+                text("""update dsip_multidomain_mapping set syncstatus=:syncstatus,lastsync=NOW(),syncerror=:error where pbx_id=:pbx_id"""),
+                {'syncstatus': SYNC_STATUS_ERROR, 'error': str(ex)[:200], 'pbx_id': pbx_id}
+            )
+            conn.commit()
+            raise
+
+    stats['added'] = len(added)
+    stats['removed'] = len(removed)
+    stats['full'] = full
+    stats['elapsed'] = time.perf_counter() - start
+    return stats
 
 
 def reloadkam(kamcmd_path):
@@ -272,7 +283,6 @@ def update_nginx(sources):
         os.system('systemctl reload nginx')
     
     except Exception as e:
-        os.remove("./.sync-lock")
         print(e)
 
 #    Depricating the use of docker containers - logic will be removed during the next release
@@ -320,146 +330,54 @@ def update_nginx(sources):
 #        print(str(e))
 
 
-def sync_needed(source, dest):
-    # FusionPBX Database Parameters
-    pbx_id = source[0]
-
-    pbx_host = source[1]
-    if ':' in source[2]:
-        fpbx_hostname = source[2].split(':')[0]
-        fpbx_port = source[2].split(':')[1]
-    else:
-        fpbx_hostname = source[2]
-        fpbx_port = 5432
-    fpbx_username = source[3]
-    fpbx_password = source[4]
-    pbx_domain_list = source[5]
-    pbx_domain_list_hash = source[6]
-    pbx_attr_list = source[7]
-    pbx_type = source[8]
-    fpbx_database = 'fusionpbx'
-
-    # Kamailio Database Parameters
-    kam_hostname = dest['hostname']
-    kam_username = dest['username']
-    kam_password = dest['password']
-    kam_database = dest['database']
-
-    domain_id_list = []
-    attr_id_list = []
-
-    need_sync = True
-
-    fpbx_conn = None
-    fpbx_curs = None
-    kam_conn = None
-    kam_curs = None
-
-    # Trying connecting to the databases
-    try:
-        # Get a connection to Kamailio Server DB
-        kam_conn = MySQLdb.connect(host=kam_hostname, user=kam_username, passwd=kam_password, db=kam_database)
-        kam_curs = kam_conn.cursor()
-        if kam_curs is not None:
-            print("[sync_needed] Connection to Kamailio DB: {} database was successful".format(kam_hostname))
-
-        # Get a connection to the FusionPBX Server
-        fpbx_conn = psycopg2.connect(dbname=fpbx_database, user=fpbx_username, host=fpbx_hostname, port=fpbx_port, password=fpbx_password)
-        if fpbx_conn is not None:
-            print("[sync_needed] Connection to FusionPBX DB: {} database was successful".format(fpbx_hostname))
-        fpbx_curs = fpbx_conn.cursor()
-        fpbx_curs.execute("""select domain_name from v_domains where domain_enabled='true' and domain_name <> %s""",[hostToIP(fpbx_hostname)])
-        rows = fpbx_curs.fetchall()
-        if rows is not None:
-            domain_name_str = ""
-
-            # Build a string that contains all of the domains
-            for row in rows:
-                domain_name_str += row[0]
-
-            print("[sync_needed] String of domains: {}".format(domain_name_str))
-
-            # Create Hash of the string
-            domain_name_str_hash = hashlib.md5(domain_name_str.encode('utf-8')).hexdigest()
-            print("[sync_needed] Hashed String of domains: {}".format(domain_name_str_hash))
-            if domain_name_str_hash == pbx_domain_list_hash:
-                # Sync not needed.  Will update the syncstatus=2 to denote a domain change was not detected
-                kam_curs.execute("""update dsip_multidomain_mapping set syncstatus=2, lastsync=NOW()""")
-                kam_conn.commit()
-                need_sync = False
-        else:
-            # No domains yet, so no need to sync
-            kam_curs.execute("""update dsip_multidomain_mapping set syncstatus=3, lastsync=NOW()""")
-            kam_conn.commit()
-            need_sync = False
-
-        return need_sync
-
-    except Exception as e:
-        error = str(e)
-        print(error)
-        try:
-            kam_conn.rollback()
-            kam_curs.execute("update dsip_multidomain_mapping set syncstatus=4, lastsync=NOW(),syncerror='{}'".format())
-            kam_conn.commit()
-        except:
-            pass
-    finally:
-        if fpbx_conn is not None:
-            fpbx_conn.close()
-        if fpbx_curs is not None:
-            fpbx_curs.close()
-        if kam_curs is not None:
-            kam_curs.close()
-        if kam_conn is not None:
-            kam_conn.close()
-
 def run_sync(settings):
-    try:
-        # Set the system where sync'd data will be stored.
-        # The Kamailio DB in our case
+    # Set the system where sync'd data will be stored.
+    # The Kamailio DB in our case, shared by the sync workers through the engine's connection pool
+    start = time.perf_counter()
+    changed = False
 
+    with getDBEngine().connect() as conn:
         # If already running - don't run
-        if os.path.isfile("./.sync-lock"):
+        if conn.execute(text('SELECT GET_LOCK(:name, 0)'), {'name': FUSIONPBX_SYNC_LOCK}).scalar() != 1:
             print("Already running")
             return
-        else:
-            f = open("./.sync-lock", "w+")
-            f.close()
-
-        # need to decrypt password if encrypted
-        if isinstance(settings.KAM_DB_PASS, bytes):
-            kam_password = AES_CTR.decrypt(settings.KAM_DB_PASS)
-        else:
-            kam_password = settings.KAM_DB_PASS
-
-        dest = {}
-        dest['hostname'] = settings.KAM_DB_HOST
-        dest['username'] = settings.KAM_DB_USER
-        dest['password'] = kam_password
-        dest['database'] = settings.KAM_DB_NAME
-
-        # Get the list of FusionPBX's that needs to be sync'd
-        sources = get_sources(dest)
-
-        # Loop thru each FusionPBX system and start the sync
-        for key in sources:
-            if sync_needed(sources[key], dest):
-                #drop_fusionpbx_domains(sources[key], dest)
-                sync_db(sources[key], dest)
-            else:
-                print("[run_sync] No changes - no sync needed for source: {}".format(sources[key][1]))
+        conn.commit()
 
-        # Reload Kamailio
-        reloadkam(settings.KAM_KAMCMD_PATH)
-
-        # Update Nginx configuration file for HTTP Provisioning and start docker container if we have FusionPBX systems
-        # update_nginx(sources[key])
-        if sources is not None and len(sources) > 0:
-            sources = list(sources.keys())
-            update_nginx(sources)
-    except Exception as e:
-        print(str(e))
-    finally:
-        # Remove lock file
-        os.remove("./.sync-lock")
+        try:
+            conn.execute(text(SYNC_TRACKING_TABLE_SQL))
+
+            # Get the list of FusionPBX's that needs to be sync'd
+            sources = get_sources(conn)
+            conn.commit()
+
+            # Sync the FusionPBX systems concurrently, a failed source does not stop the others
+            if len(sources) > 0:
+                with ThreadPoolExecutor(max_workers=min(FUSIONPBX_SYNC_WORKERS, len(sources))) as executor:
+                    futures = {executor.submit(sync_source, source): key for key, source in sources.items()}
+                    for future in as_completed(futures):
+                        try:
+                            stats = future.result()
+                        except Exception as e:
+                            print("[run_sync] Sync failed for source {}: {}".format(futures[future], str(e)))
+                            continue
+                        if stats['added'] > 0 or stats['removed'] > 0:
+                            changed = True
+                            print("[run_sync] Synced source {} ({} fetch): {} domains added, {} removed in {:.3f}s".format(
+                                futures[future], 'full' if stats['full'] else 'incremental', stats['added'], stats['removed'], stats['elapsed']))
+                        else:
+                            print("[run_sync] No changes - no sync needed for source: {}".format(futures[future]))
+
+            # Reload Kamailio once for all the sources
+            if changed:
+                reloadkam(settings.KAM_KAMCMD_PATH)
+
+            # Update Nginx configuration file for HTTP Provisioning if we have FusionPBX systems
+            if len(sources) > 0:
+                update_nginx(list(sources.keys()))
+
+            print("[run_sync] Synced {} sources in {:.3f}s".format(len(sources), time.perf_counter() - start))
+        except Exception as e:
+            print(str(e))
+        finally:
+            conn.execute(text('SELECT RELEASE_LOCK(:name)'), {'name': FUSIONPBX_SYNC_LOCK})
+            conn.commit()
@@ -141,6 +141,8 @@ MAIL_PASSWORD = ''
 MAIL_ASCII_ATTACHMENTS = False
 MAIL_DEFAULT_SENDER = 'dSIPRouter <donotreply@sip.dsiprouter.org>'
 MAIL_DEFAULT_SUBJECT = 'dSIPRouter System Notification'
+# seconds repeats of an endpoint group alert are collected for before one digest email is sent
+NOTIFICATION_DIGEST_WINDOW = 300
 
 # dSIPRouter licensing
 DSIP_CORE_LICENSE = ''
@@ -169,6 +171,12 @@ CLOUD_PLATFORM = ''
 # backup settings
 BACKUP_FOLDER = '/var/backups/dsiprouter'
 
+# CDR retention settings
+# number of months of cdrs / acc records kept in the database, 0 keeps them forever
+# older months are archived to CDR_ARCHIVE_FOLDER and then dropped by: dsiprouter_cron.py cdr lifecycle
+CDR_RETENTION_MONTHS = 0
+CDR_ARCHIVE_FOLDER = '/var/backups/dsiprouter/cdrs'
+
 # TransNexus Settings
 # TODO: marked for review, these settings should be synced across cluster in the DB
 TRANSNEXUS_AUTHSERVICE_ENABLED = 0
@@ -5,10 +5,11 @@ if sys.path[0] != '/etc/dsiprouter/gui':
 
 import os, re, json, socket, logging, traceback, inspect, ssl
 from calendar import monthrange
-from importlib import reload
 from flask import request, render_template, make_response
 from werkzeug.utils import escape
 from werkzeug.urls import iri_to_uri
+from util.ipc import SETTINGS_SHMEM_NAME, updateSharedMemoryDict
+from util.settings_store import getSettingsStore
 import settings
 
 
@@ -77,30 +78,27 @@ def dictToStrFields(fields_dict):
 def updateConfig(config_obj, field_dict, hot_reload=False):
     """
     Update a python config module
-    :param config_obj:
-    :param field_dict:
-    :return:
+
+    :param config_obj:      the config module
+    :type config_obj:       module
+    :param field_dict:      the new values, by setting name
+    :type field_dict:       dict
+    :param hot_reload:      whether to update the loaded module as well as the file
+    :type hot_reload:       bool
+    :return:                the fields whose value changed in the loaded module
+    :rtype:                 dict
     """
     config_file = "<no filepath available>"
     try:
         config_file = config_obj.__file__
-
-        with open(config_file, 'r+') as config:
-            config_str = config.read()
-            for key, val in field_dict.items():
-                regex = r"^(?!#)(?:" + re.escape(key) + \
-                        r")[ \t]*=[ \t]*(?:\w+\(.*\)[ \t\v]*$|[\w\d\.]+[ \t]*$|\{.*\}|\[.*\][ \t]*$|\(.*\)[ \t]*$|b?\"\"\".*\"\"\"[ \t]*$|b?'''.*'''[ \v]*$|b?\".*\"[ \t]*$|b?'.*')"
-                replace_str = "{} = {}".format(key, repr(val))
-                config_str = re.sub(regex, replace_str, config_str, flags=re.MULTILINE)
-
-            config.seek(0)
-            config.write(config_str)
-            config.truncate()
-
+        changed = getSettingsStore(config_obj).update(field_dict, apply=hot_reload)
+        # the other processes read the settings from shared memory
         if hot_reload:
-            globals()[config_obj.__name__] = reload(config_obj)
+            updateSharedMemoryDict(SETTINGS_SHMEM_NAME, changed)
+        return changed
     except:
         IO.logerr('Problem updating the {0} configuration file'.format(config_file))
+        return {}
 
 def stripDictVals(d):
     for key, val in d.items():
@@ -58,6 +58,53 @@
     )
   }
 
+  /**
+   * @global script scope
+   * @type {String}
+   */
+  var EDIT_BUTTON_HTML = '<p data-placement="top" data-toggle="tooltip" title="Edit">' +
+    '<button id="open-Update" class="open-Update btn btn-primary btn-xs" data-title="Edit" data-toggle="modal" data-target="#edit">' +
+    '<span class="glyphicon glyphicon-pencil"></span></button></p>';
+  var DELETE_BUTTON_HTML = '<p data-placement="top" data-toggle="tooltip" title="Delete">' +
+    '<button id="open-Delete" class="open-Delete btn btn-danger btn-xs" data-title="Delete" data-toggle="modal" data-target="#delete">' +
+    '<span class="glyphicon glyphicon-trash"></span></button></p>';
+
+  /**
+   * Convert a nullable value from the API to the text shown in the forms
+   * @param value
+   * @returns {String}
+   */
+  function toText(value) {
+    return (value === null || value === undefined) ? '' : String(value);
+  }
+
+  /**
+   * Escape a value for display in a table cell
+   * @param value
+   * @returns {String}
+   */
+  function escapeText(value) {
+    return $('<div>').text(toText(value)).html();
+  }
+
+  /**
+   * Render the endpoint group of a rule, flagging load balanced and multi group rules
+   * @param data    the gwgroup description
+   * @param type    the DataTables render type
+   * @param row     the rule
+   * @returns {String}
+   */
+  function renderGwgroupName(data, type, row) {
+    var name = escapeText(attrFilter(data, 'name'));
+    if (attrFilter(row.rule_description, 'lb_enabled') === '1') {
+      return name + ' <small>(Load Balancing)</small>';
+    }
+    if (toText(row.gwlist).split(',').length > 1) {
+      return name + '<sup> +1</sup>';
+    }
+    return name;
+  }
+
   /* any handlers depending on DOM elems go here */
   $(document).ready(function() {
     /* only created if we have DID's */
@@ -67,11 +114,41 @@
       comboboxInit('#edit .modal-body');
     }
 
-    /* init datatable */
-    $('#inboundmapping').DataTable({
+    /* init datatable, the rules are paged, sorted and searched server side */
+    var table = $('#inboundmapping').DataTable({
+      "serverSide": true,
+      "processing": true,
+      "searchDelay": 500,
+      "ajax": rowsEndpointAjax(API_BASE_URL + "inboundmapping/rows"),
+      "language": {
+        "searchPlaceholder": "DID prefix"
+      },
+      "columns": [
+        {"data": null, "orderable": false, "defaultContent": '<input type="checkbox" class="checkthis" value="1"/>'},
+        {"data": "ruleid", "name": "ruleid", "className": "ruleid"},
+        {"data": "prefix", "name": "prefix", "className": "prefix", "render": escapeText},
+        {"data": "gwgroupid", "orderable": false, "className": "gwgroupid hidden"},
+        {"data": "gwgroup_description", "name": "gwgroupid", "className": "gwgroupname", "render": renderGwgroupName},
+        {"data": "rule_description", "orderable": false, "className": "rulename", "render": function(data) {
+          return escapeText(attrFilter(data, 'name'));
+        }},
+        {"data": "gwlist", "orderable": false, "className": "gwlist hidden", "render": escapeText},
+        {"data": "rule_description", "orderable": false, "className": "lb_enabled hidden", "render": function(data) {
+          return escapeText(attrFilter(data, 'lb_enabled'));
+        }},
+        {"data": null, "orderable": false, "defaultContent": EDIT_BUTTON_HTML},
+        {"data": null, "orderable": false, "defaultContent": DELETE_BUTTON_HTML},
+        {"data": "hf_ruleid", "orderable": false, "className": "hf_ruleid hidden"},
+        {"data": "hf_groupid", "orderable": false, "className": "hf_groupid hidden"},
+        {"data": "hf_gwgroupid", "orderable": false, "className": "hf_gwgroupid hidden"},
+        {"data": "hf_fwddid", "orderable": false, "className": "hf_fwddid hidden", "render": escapeText},
+        {"data": "ff_ruleid", "orderable": false, "className": "ff_ruleid hidden"},
+        {"data": "ff_groupid", "orderable": false, "className": "ff_groupid hidden"},
+        {"data": "ff_gwgroupid", "orderable": false, "className": "ff_gwgroupid hidden"},
+        {"data": "ff_fwddid", "orderable": false, "className": "ff_fwddid hidden", "render": escapeText}
+      ],
       "columnDefs": [
-        {"orderable": true, "targets": [1, 2, 3, 4, 5]},
-        {"orderable": false, "targets": [0, 6, 7]},
+        {"targets": "_all", "defaultContent": ""}
       ],
       "order": [[1, 'asc']]
     });
@@ -98,23 +175,20 @@
     });
 
     $('#inboundmapping').on('click', '#open-Update', function() {
-      var row_index = $(this).parent().parent().parent().index() + 1;
-      var c = document.getElementById('inboundmapping');
-      var ruleid = $(c).find('tr:eq(' + row_index + ') td.ruleid').text();
-      var prefix = $(c).find('tr:eq(' + row_index + ') td.prefix').text();
-      var gwgroupid = $(c).find('tr:eq(' + row_index + ') td.gwgroupid').text();
-      var gwgroupname = $(c).find('tr:eq(' + row_index + ') td.gwgroupname').text();
-      var rulename = $(c).find('tr:eq(' + row_index + ') td.rulename').text();
-      var gwlistid = $(c).find('tr:eq(' + row_index + ') td.gwlistid').text().replace('#', '');
-      var lb_enabled = $(c).find('tr:eq(' + row_index + ') td.lb_enabled').text() === '1';
-      var hf_ruleid = $(c).find('tr:eq(' + row_index + ') td.hf_ruleid').text();
-      var hf_groupid = $(c).find('tr:eq(' + row_index + ') td.hf_groupid').text();
-      var hf_gwgroupid = $(c).find('tr:eq(' + row_index + ') td.hf_gwgroupid').text();
-      var hf_fwddid = $(c).find('tr:eq(' + row_index + ') td.hf_fwddid').text();
-      var ff_ruleid = $(c).find('tr:eq(' + row_index + ') td.ff_ruleid').text();
-      var ff_groupid = $(c).find('tr:eq(' + row_index + ') td.ff_groupid').text();
-      var ff_gwgroupid = $(c).find('tr:eq(' + row_index + ') td.ff_gwgroupid').text();
-      var ff_fwddid = $(c).find('tr:eq(' + row_index + ') td.ff_fwddid').text();
+      var row = table.row($(this).closest('tr')).data();
+      var ruleid = String(row.ruleid);
+      var prefix = row.prefix;
+      var gwgroupid = toText(row.gwgroupid);
+      var rulename = attrFilter(row.rule_description, 'name');
+      var lb_enabled = attrFilter(row.rule_description, 'lb_enabled') === '1';
+      var hf_ruleid = toText(row.hf_ruleid);
+      var hf_groupid = toText(row.hf_groupid);
+      var hf_gwgroupid = toText(row.hf_gwgroupid);
+      var hf_fwddid = toText(row.hf_fwddid);
+      var ff_ruleid = toText(row.ff_ruleid);
+      var ff_groupid = toText(row.ff_groupid);
+      var ff_gwgroupid = toText(row.ff_gwgroupid);
+      var ff_fwddid = toText(row.ff_fwddid);
 
       /** Clear out the modal */
       var modal_body = $('#edit .modal-body');
@@ -167,13 +241,12 @@
     });
 
     $('#inboundmapping').on('click', '#open-Delete', function() {
-      var row_index = $(this).parent().parent().parent().index() + 1;
-      var c = document.getElementById('inboundmapping');
-      var ruleid = $(c).find('tr:eq(' + row_index + ') td:eq(1)').text();
-      var hf_ruleid = $(c).find('tr:eq(' + row_index + ') td:eq(9)').text();
-      var hf_groupid = $(c).find('tr:eq(' + row_index + ') td:eq(10)').text();
-      var ff_ruleid = $(c).find('tr:eq(' + row_index + ') td:eq(13)').text();
-      var ff_groupid = $(c).find('tr:eq(' + row_index + ') td:eq(14)').text();
+      var row = table.row($(this).closest('tr')).data();
+      var ruleid = String(row.ruleid);
+      var hf_ruleid = toText(row.hf_ruleid);
+      var hf_groupid = toText(row.hf_groupid);
+      var ff_ruleid = toText(row.ff_ruleid);
+      var ff_groupid = toText(row.ff_groupid);
 
       /* update modal fields */
       var modal_body = $('#delete .modal-body');
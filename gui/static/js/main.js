@@ -229,7 +229,8 @@ $(document).ready(function() {
 
     $.ajax({
       type: "POST",
-      url: API_BASE_URL + "reload/kamailio",
+      // only reload what changed since the last reload
+      url: API_BASE_URL + "reload/kamailio?incremental=true",
       dataType: "json",
       global: false,
       success: function(response, text_status, xhr) {
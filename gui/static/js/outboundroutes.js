@@ -1,12 +1,66 @@
 ;(function(window, document) {
   'use strict';
 
+  /**
+   * @global script scope
+   * @type {String}
+   */
+  var EDIT_BUTTON_HTML = '<p data-placement="top" data-toggle="tooltip" title="Edit">' +
+    '<button id="open-Update" class="open-Update btn btn-primary btn-xs" data-title="Edit" data-toggle="modal" data-target="#edit">' +
+    '<span class="glyphicon glyphicon-pencil"></span></button></p>';
+  var DELETE_BUTTON_HTML = '<p data-placement="top" data-toggle="tooltip" title="Delete">' +
+    '<button id="open-Delete" class="open-Delete btn btn-danger btn-xs" data-title="Delete" data-toggle="modal" data-target="#delete">' +
+    '<span class="glyphicon glyphicon-trash"></span></button></p>';
+
+  /**
+   * Convert a nullable value from the API to the text shown in the forms
+   * @param value
+   * @returns {String}
+   */
+  function toText(value) {
+    return (value === null || value === undefined) ? '' : String(value);
+  }
+
+  /**
+   * Escape a value for display in a table cell
+   * @param value
+   * @returns {String}
+   */
+  function escapeText(value) {
+    return $('<div>').text(toText(value)).html();
+  }
+
   $(document).ready(function () {
-    /* data tables init */
-    $('#outboundmapping').DataTable({
+    /* data tables init, the routes are paged, sorted and searched server side */
+    var table = $('#outboundmapping').DataTable({
+      "serverSide": true,
+      "processing": true,
+      "searchDelay": 500,
+      "ajax": rowsEndpointAjax(API_BASE_URL + "outboundroutes/rows"),
+      "language": {
+        "searchPlaceholder": "To prefix"
+      },
+      "columns": [
+        {"data": null, "orderable": false, "defaultContent": '<input type="checkbox" class="checkthis" value="1"/>'},
+        {"data": "ruleid", "name": "ruleid", "className": "ruleid"},
+        {"data": "dr_groupid", "orderable": false, "className": "groupid hidden"},
+        {"data": "from_prefix", "orderable": false, "className": "from_prefix", "render": escapeText},
+        {"data": "prefix", "name": "prefix", "className": "prefix", "render": escapeText},
+        {"data": "timerec", "orderable": false, "className": "timerec", "render": escapeText},
+        {"data": "priority", "name": "priority", "className": "priority"},
+        {"data": "routeid", "name": "routeid", "className": "routeid", "render": escapeText},
+        {"data": "gwgroupid", "orderable": false, "className": "gwgroupid hidden"},
+        {"data": "gwgroup_description", "name": "gwgroupid", "className": "gwgroupname", "render": function(data) {
+          return escapeText(attrFilter(data, 'name'));
+        }},
+        {"data": "description", "orderable": false, "className": "description", "render": function(data) {
+          return escapeText(attrFilter(data, 'name'));
+        }},
+        {"data": null, "orderable": false, "defaultContent": EDIT_BUTTON_HTML},
+        {"data": null, "orderable": false, "defaultContent": DELETE_BUTTON_HTML}
+      ],
       "columnDefs": [
-        {"orderable": true, "targets": [1, 3, 4, 5, 6, 7, 8, 9]},
-        {"orderable": false, "targets": [0, 2, 10, 11]},
+        {"targets": "_all", "defaultContent": ""}
       ],
       "order": [[1, 'asc']]
     });
@@ -25,18 +79,16 @@
 
     /* listeners */
     $('#outboundmapping').on('click', '#open-Update', function () {
-      var row_index = $(this).parent().parent().parent().index() + 1;
-      var c = document.getElementById('outboundmapping');
-
-      var ruleid = $(c).find('tr:eq(' + row_index + ') > td.ruleid').text();
-      var groupid = $(c).find('tr:eq(' + row_index + ') > td.groupid').text();
-      var prefix = $(c).find('tr:eq(' + row_index + ') > td.prefix').text();
-      var from_prefix = $(c).find('tr:eq(' + row_index + ') > td.from_prefix').text();
-      var timerec = $(c).find('tr:eq(' + row_index + ') > td.timerec').text();
-      var priority = $(c).find('tr:eq(' + row_index + ') > td.priority').text();
-      var routeid = $(c).find('tr:eq(' + row_index + ') > td.routeid').text();
-      var gwgroupid = $(c).find('tr:eq(' + row_index + ') > td.gwgroupid').text();
-      var name = $(c).find('tr:eq(' + row_index + ') > td.description').text();
+      var row = table.row($(this).closest('tr')).data();
+      var ruleid = String(row.ruleid);
+      var groupid = toText(row.dr_groupid);
+      var prefix = row.prefix;
+      var from_prefix = toText(row.from_prefix);
+      var timerec = toText(row.timerec);
+      var priority = toText(row.priority);
+      var routeid = toText(row.routeid);
+      var gwgroupid = toText(row.gwgroupid);
+      var name = attrFilter(row.description, 'name');
 
       /** Clear out the modal */
       var modal_body = $('#edit .modal-body');
@@ -65,9 +117,8 @@
     });
 
     $('#outboundmapping').on('click','#open-Delete', function () {
-      var row_index = $(this).parent().parent().parent().index() + 1;
-      var c = document.getElementById('outboundmapping');
-      var ruleid = $(c).find('tr:eq(' + row_index + ') td:eq(1)').text();
+      var row = table.row($(this).closest('tr')).data();
+      var ruleid = String(row.ruleid);
 
       /* update modal fields */
       var modal_body = $('#delete .modal-body');
@@ -329,4 +329,70 @@
     }, interval);
   }
 
+  /**
+   * Get the value of a field in a description string, such as "name:foo,type:8"
+   * @param {String} description  The description to parse
+   * @param {String} field        The field to get the value of
+   * @return {String}             The field value, the description itself when it has no fields
+   */
+  window.attrFilter = function(description, field) {
+    if (description === null || description === undefined) {
+      return '';
+    }
+    if (description.indexOf(':') === -1) {
+      return description;
+    }
+    var items = description.split(',');
+    for (var i = 0; i < items.length; i++) {
+      var item = items[i].split(':');
+      if (item[0] === field) {
+        return item[1];
+      }
+    }
+    return '';
+  };
+
+  /**
+   * Create the ajax function of a DataTable paged by one of the API's /rows endpoints<br>
+   * The columns named in the DataTable are the sort columns the endpoint accepts,
+   * the search box is passed as the search arg of the endpoint
+   * @param {String} url              The endpoint URL
+   * @return {Function}               The function to set as the ajax option of the DataTable
+   */
+  window.rowsEndpointAjax = function(url) {
+    return function(data, callback, settings) {
+      var args = {
+        offset: data.start,
+        limit: data.length
+      };
+      if (data.order.length > 0 && data.columns[data.order[0].column].name) {
+        args.sort = data.columns[data.order[0].column].name;
+        args.order = data.order[0].dir;
+      }
+      if (data.search.value.length > 0) {
+        args.search = data.search.value;
+      }
+
+      $.ajax({
+        type: "GET",
+        url: url + '?' + $.param(args),
+        dataType: "json",
+        success: function(response, text_status, xhr) {
+          var page = response.data[0];
+          callback({
+            draw: data.draw,
+            recordsTotal: page.total,
+            recordsFiltered: page.total,
+            data: page.rows
+          });
+        },
+        error: function(xhr, text_status, error_msg) {
+          var msg = xhr.responseJSON ? xhr.responseJSON.msg : error_msg;
+          showNotification("Could not load the table: " + msg, true);
+          callback({draw: data.draw, recordsTotal: 0, recordsFiltered: 0, data: []});
+        }
+      });
+    };
+  };
+
 })(window, document);
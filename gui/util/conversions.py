@@ -1,3 +1,5 @@
+import itertools
+
 number_alphabet = '0123456789'
 lc_letter_alphabet = 'abcdefghijklmnopqrstuvwxyz'
 uc_letter_alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
@@ -65,7 +67,175 @@ def expand_prefixs(prefixs):
     for p in prefixs:
         yield sorted(list(expand_prefix(p)))
 
+
+# characters matched by the ASTERISK-like wildcards
+prefix_wildcards = {
+    'X': frozenset('0123456789'),
+    'Z': frozenset('123456789'),
+    'N': frozenset('23456789'),
+}
+# a position matching every digit adds nothing to the prefix before it
+# because dr_rules matches from the longest to the shortest prefix
+full_digit_set = frozenset(number_alphabet)
+
+
+def parse_prefix_pattern(pattern):
+    """
+    Parse an ASTERISK-like prefix pattern into the set of characters matched at each position
+
+    '.' and '!' end the pattern, like in expand_prefix() they only match the rest of the number.
+    Trailing positions matching every digit are dropped.
+
+    :param pattern:     the pattern, ex: 1NXXNXXXXXX or 1[2-4]5
+    :type pattern:      str
+    :return:            the characters matched at each position
+    :rtype:             list[frozenset]
+    :raises:            ValueError
+    """
+    positions = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c in '.!':
+            break
+        elif c in prefix_wildcards:
+            positions.append(prefix_wildcards[c])
+        elif c == '[':
+            end = pattern.find(']', i)
+            if end == -1 or end == i + 1:
+                raise ValueError('unterminated or empty character class in prefix pattern {}'.format(pattern))
+            chars = set()
+            body = pattern[i+1:end]
+            j = 0
+            while j < len(body):
+                if j + 2 < len(body) and body[j+1] == '-':
+                    for alphabet in (number_alphabet, lc_letter_alphabet, uc_letter_alphabet):
+                        if body[j] in alphabet and body[j+2] in alphabet and alphabet.index(body[j]) <= alphabet.index(body[j+2]):
+                            chars.update(alphabet[alphabet.index(body[j]):alphabet.index(body[j+2])+1])
+                            break
+                    else:
+                        raise ValueError('invalid range {} in prefix pattern {}'.format(body[j:j+3], pattern))
+                    j += 3
+                else:
+                    chars.add(body[j])
+                    j += 1
+            positions.append(frozenset(chars))
+            i = end
+        elif c == ']':
+            raise ValueError('unexpected ] in prefix pattern {}'.format(pattern))
+        else:
+            positions.append(frozenset(c))
+        i += 1
+
+    while len(positions) > 0 and positions[-1] >= full_digit_set:
+        positions.pop()
+    return positions
+
+
+def _covers(shorter, longer):
+    # every prefix of the longer pattern starts with a prefix of the shorter one
+    return len(shorter) <= len(longer) and all(a >= b for a, b in zip(shorter, longer))
+
+
+def compile_prefix_patterns(patterns):
+    """
+    Compile prefix patterns into the minimal list of patterns matching the same numbers
+
+    The patterns covered by a shorter one are dropped and the patterns differing only in their
+    last position are merged, so ['1[0-4]', '1[5-9]'] compiles to ['1'].
+
+    :param patterns:    the ASTERISK-like patterns
+    :type patterns:     collections.abc.Iterable[str]
+    :return:            the compiled patterns, each the characters matched at each position
+    :rtype:             list[list[frozenset]]
+    :raises:            ValueError
+    """
+    compiled = [parse_prefix_pattern(pattern) for pattern in patterns]
+
+    merged = True
+    while merged:
+        merged = False
+        by_parent = {}
+        for positions in compiled:
+            if len(positions) == 0:
+                return [[]]
+            by_parent.setdefault(tuple(positions[:-1]), []).append(positions[-1])
+        compiled = []
+        for parent, lasts in by_parent.items():
+            last = frozenset().union(*lasts)
+            merged = merged or len(lasts) > 1
+            positions = list(parent) + [last]
+            while len(positions) > 0 and positions[-1] >= full_digit_set:
+                positions.pop()
+            compiled.append(positions)
+
+    compiled.sort(key=len)
+    minimal = []
+    for positions in compiled:
+        if not any(_covers(shorter, positions) for shorter in minimal):
+            minimal.append(positions)
+    return minimal
+
+
+def estimate_prefix_count(patterns):
+    """
+    Estimate the number of literal prefixes the patterns expand to, without expanding them
+
+    :param patterns:    the ASTERISK-like patterns
+    :type patterns:     collections.abc.Iterable[str]
+    :return:            upper bound of the number of prefixes yielded by iter_prefixes()
+    :rtype:             int
+    :raises:            ValueError
+    """
+    count = 0
+    for positions in compile_prefix_patterns(patterns):
+        size = 1
+        for chars in positions:
+            size *= len(chars)
+        count += size
+    return count
+
+
+def iter_prefixes(patterns):
+    """
+    Lazily expand prefix patterns into the minimal set of literal prefixes
+
+    The prefixes are yielded from the shortest to the longest and a prefix is skipped
+    when a shorter prefix already yielded matches the same numbers.
+
+    :param patterns:    the ASTERISK-like patterns
+    :type patterns:     collections.abc.Iterable[str]
+    :return:            the literal prefixes
+    :rtype:             collections.abc.Iterator[str]
+    :raises:            ValueError
+    """
+    compiled = compile_prefix_patterns(patterns)
+    # only needed to de-duplicate prefixes produced by overlapping patterns
+    yielded = set() if len(compiled) > 1 else None
+    for positions in compiled:
+        for chars in itertools.product(*[sorted(chars) for chars in positions]):
+            prefix = ''.join(chars)
+            if yielded is not None:
+                if any(prefix[:i] in yielded for i in range(len(prefix) + 1)):
+                    continue
+                yielded.add(prefix)
+            yield prefix
+
+def escape_like(value):
+    """
+    Escape the LIKE wildcards of a value, so it is matched literally
+
+    :param value:   the value to match
+    :type value:    str
+    :return:        the escaped value, the default LIKE escape character is used
+    :rtype:         str
+    """
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
 #### Example Usage:
 #example_prefixs = ['[0-9]', '[a-z]', '[A-Z]', '[01]N']
 #for p in expand_prefixs(example_prefixs):
 #    print(p)
+#print(estimate_prefix_count(['1NXXNXXXXXX']))
+#for p in iter_prefixes(['1NXXNXXXXXX']):
+#    print(p)
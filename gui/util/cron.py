@@ -1,3 +1,4 @@
+from datetime import timedelta
 from crontab import CronTab, CronSlices
 from cron_descriptor import ExpressionDescriptor
 
@@ -133,6 +134,20 @@ def deleteTaggedCronjob(tag):
     except:
         return False
 
+def isValidCronInterval(interval):
+    """
+    Check whether a crontab interval is valid
+
+    :param interval:        crontab interval
+    :type interval:         str
+    :return:                whether it is valid
+    :rtype:                 bool
+    """
+    try:
+        return CronSlices.is_valid(interval)
+    except:
+        return False
+
 def cronIntervalToDescription(interval):
     """
     Convert a crontab interval to a human readable format
@@ -147,3 +162,116 @@ def cronIntervalToDescription(interval):
         return descriptor.get_description()
     except:
         return None
+
+# (min, max) of the crontab interval fields
+_CRON_FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+_CRON_SPECIALS = {
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *',
+    '@monthly': '0 0 1 * *',
+    '@weekly': '0 0 * * 0',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@hourly': '0 * * * *',
+}
+# names accepted in the month and day of week fields
+_CRON_NAMES = dict(
+    [(name, i + 1) for i, name in enumerate(('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'))] +
+    [(name, i) for i, name in enumerate(('sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat'))]
+)
+
+def _cronValue(value):
+    return _CRON_NAMES[value] if value in _CRON_NAMES else int(value)
+
+def _cronFieldValues(field, low, high):
+    values = set()
+    for part in field.lower().split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = int(step)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (_cronValue(x) for x in part.split('-', 1))
+        else:
+            start = _cronValue(part)
+            end = high if step > 1 else start
+        values.update(range(start, end + 1, step))
+    return values
+
+def _parseCronInterval(interval):
+    interval = _CRON_SPECIALS.get(interval.strip(), interval)
+    fields = interval.split()
+    if len(fields) != 5:
+        raise ValueError('invalid crontab interval: {}'.format(interval))
+    minute, hour, dom, month, dow = (
+        _cronFieldValues(field, low, high) for field, (low, high) in zip(fields, _CRON_FIELD_RANGES)
+    )
+    # sunday is both 0 and 7
+    if 7 in dow:
+        dow.add(0)
+    # as in cron, when both day of month and day of week are restricted either may match
+    either_day = not fields[2].startswith('*') and not fields[4].startswith('*')
+    return minute, hour, dom, month, dow, either_day
+
+def _cronDayMatches(parsed, dt):
+    minute, hour, dom, month, dow, either_day = parsed
+    if dt.month not in month:
+        return False
+    dom_match = dt.day in dom
+    dow_match = dt.isoweekday() % 7 in dow
+    if either_day:
+        return dom_match or dow_match
+    return dom_match and dow_match
+
+def cronIntervalMatches(interval, dt):
+    """
+    Check whether a crontab interval is due at a point in time
+
+    Supports lists, ranges, steps, month / day names and the @yearly..@hourly shortcuts.
+    As in cron, when both day of month and day of week are restricted either may match.
+
+    :param interval:    crontab interval
+    :type interval:     str
+    :param dt:          the time to check, seconds are ignored
+    :type dt:           datetime.datetime
+    :return:            whether the interval matches, False if it is invalid
+    :rtype:             bool
+    """
+    try:
+        parsed = _parseCronInterval(interval)
+        return dt.minute in parsed[0] and dt.hour in parsed[1] and _cronDayMatches(parsed, dt)
+    except (ValueError, AttributeError):
+        return False
+
+def cronNextTime(interval, dt, max_days=1830):
+    """
+    Get the first time a crontab interval is due after a point in time
+
+    :param interval:    crontab interval
+    :type interval:     str
+    :param dt:          the time to search after, the result is always a later minute
+    :type dt:           datetime.datetime
+    :param max_days:    days searched before giving up, intervals such as 30 February never match
+    :type max_days:     int
+    :return:            the next due minute, None if the interval is invalid or never due
+    :rtype:             datetime.datetime|None
+    """
+    try:
+        parsed = _parseCronInterval(interval)
+    except (ValueError, AttributeError):
+        return None
+    minutes, hours = sorted(parsed[0]), sorted(parsed[1])
+
+    start = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    day = start.replace(hour=0, minute=0)
+    for _ in range(max_days):
+        if _cronDayMatches(parsed, day):
+            for hour in hours:
+                for minute in minutes:
+                    candidate = day.replace(hour=hour, minute=minute)
+                    if candidate >= start:
+                        return candidate
+        day += timedelta(days=1)
+    return None
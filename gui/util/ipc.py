@@ -3,7 +3,7 @@ import sys
 if sys.path[0] != '/etc/dsiprouter/gui':
     sys.path.insert(0, '/etc/dsiprouter/gui')
 
-import inspect, os, signal
+import os, signal, threading
 from UltraDict import UltraDict, Exceptions as shmem_exceptions
 import settings
 
@@ -11,29 +11,53 @@ import settings
 SETTINGS_SHMEM_NAME = 'shmem_settings'
 STATE_SHMEM_NAME = 'shmem_state'
 
+# handles to the shared memory dicts this process created or attached to, keyed by name
+_shmem_registry = {}
+_shmem_registry_lock = threading.Lock()
 
-def createSharedMemoryDict(val, name):
-    # globals from the top-level module
-    caller_globals = dict(inspect.getmembers(inspect.stack()[-1][0]))["f_globals"]
 
-    try:
-        caller_globals[name] = UltraDict(val, name=name, create=True, auto_unlink=False, recurse=True)
-    except shmem_exceptions.AlreadyExists:
-        # we always want fresh memory, even if the memory was not deallocated properly
-        UltraDict(name=name, create=False).unlink()
-        caller_globals[name] = UltraDict(val, name=name, create=True, auto_unlink=False, recurse=True)
+def createSharedMemoryDict(val, name):
+    with _shmem_registry_lock:
+        try:
+            shmem = UltraDict(val, name=name, create=True, auto_unlink=False, recurse=True)
+        except shmem_exceptions.AlreadyExists:
+            # we always want fresh memory, even if the memory was not deallocated properly
+            UltraDict(name=name, create=False).unlink()
+            shmem = UltraDict(val, name=name, create=True, auto_unlink=False, recurse=True)
+        _shmem_registry[name] = shmem
 
-    return caller_globals[name]
+    return shmem
 
 def getSharedMemoryDict(name):
-    # globals from the top-level module
-    caller_globals = dict(inspect.getmembers(inspect.stack()[-1][0]))["f_globals"]
+    shmem = _shmem_registry.get(name, None)
+    if shmem is not None:
+        return shmem
 
-    if name in caller_globals:
-        return caller_globals[name]
+    with _shmem_registry_lock:
+        if name not in _shmem_registry:
+            _shmem_registry[name] = UltraDict(name=name, create=False)
+        return _shmem_registry[name]
+
+def updateSharedMemoryDict(name, fields):
+    """
+    Set keys of a shared memory dict this process created or attached to
+
+    Only the given keys are written, so other processes see the changes without the dict being recreated.
+
+    :param name:    name of the shared memory dict
+    :type name:     str
+    :param fields:  the new values, by key
+    :type fields:   dict
+    :return:        whether the dict was updated, False if this process has no handle to it
+    :rtype:         bool
+    """
+    shmem = _shmem_registry.get(name, None)
+    if shmem is None:
+        return False
 
-    caller_globals[name] = UltraDict(name=name, create=False)
-    return caller_globals[name]
+    for key, val in fields.items():
+        shmem[key] = val
+    return True
 
 
 def sendSyncSettingsSignal(pid_file=settings.DSIP_PID_FILE, load_shared_settings=False):
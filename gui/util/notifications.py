@@ -3,21 +3,38 @@ import sys
 if sys.path[0] != '/etc/dsiprouter/gui':
     sys.path.insert(0, '/etc/dsiprouter/gui')
 
-import os, smtplib
-from email import encoders
+import os, re, time, queue, base64, smtplib, threading, uuid
+from collections import deque
 from email.mime.base import MIMEBase
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from util.pyasync import thread
+from email.policy import SMTP as SMTP_POLICY
 from util.security import AES_CTR
-from shared import debugException
+from shared import IO, debugException
 import settings
 
-@thread
-def sendEmail(recipients, text_body, html_body=None, subject=settings.MAIL_DEFAULT_SUBJECT,
-               sender=settings.MAIL_DEFAULT_SENDER, data=None, attachments=[]):
+# max number of emails waiting to be sent, further emails are dropped until the queue drains
+EMAIL_QUEUE_SIZE = 1000
+# number of threads sending emails, each keeps its own SMTP connection
+EMAIL_WORKERS = 2
+# seconds an unused SMTP connection is kept open
+EMAIL_SMTP_IDLE_TIMEOUT = 60
+# bytes of an attachment read and encoded at a time, a multiple of 57 so the base64 lines stay whole
+EMAIL_ATTACHMENT_CHUNK_SIZE = 57 * 1024
+# number of sent emails the latency metrics are computed over
+EMAIL_LATENCY_SAMPLES = 1000
+
+# lines starting with a dot must be escaped in the SMTP DATA stream
+_SMTP_DOT_LINE = re.compile(rb'^\.', re.MULTILINE)
+
+
+def iterEmailMessage(recipients, text_body, html_body=None, subject=settings.MAIL_DEFAULT_SUBJECT,
+                     sender=settings.MAIL_DEFAULT_SENDER, data=None, attachments=[]):
     """
-    Send an Email asynchronously to recipients
+    Render an email in chunks, with the attachments encoded as they are read
+
+    The attachments are never held in memory as a whole, so large reports
+    can be sent without loading them.
 
     :param recipients:      email addresses we are sending to
     :type recipients:       list|tuple
@@ -31,65 +48,329 @@ def sendEmail(recipients, text_body, html_body=None, subject=settings.MAIL_DEFAU
     :type sender:           str
     :param data:            key, value pairs to add to message
     :type data:             dict
-    :param attachments:     list|tuple
-    :type attachments:      files to attach to email
-    :return:                no return value
-    :rtype:                 None
+    :param attachments:     files to attach to email
+    :type attachments:      list|tuple
+    :return:                the message, in chunks ending on a line break
+    :rtype:                 collections.abc.Generator[bytes]
     """
+    if data is not None:
+        text_body += "\r\n\n"
+        for key, value in data.items():
+            text_body += "{}: {}\n".format(str(key),str(value))
+        text_body += "\n"
 
-    try:
-        if data is not None:
-            text_body += "\r\n\n"
-            for key, value in data.items():
-                text_body += "{}: {}\n".format(str(key),str(value))
-            text_body += "\n"
-
-        # print("Creating email")
-        msg_root = MIMEMultipart('alternative')
-        msg_root['From'] = sender
-        msg_root['To'] = ", ".join(recipients)
-        msg_root['Subject'] = subject
-        msg_root.preamble = "|-------------------MULTIPART_BOUNDARY-------------------|\n"
-
-        # print("Adding text body to email")
-        msg_root.attach(MIMEText(text_body, 'plain'))
-
-        if html_body is not None and html_body != "":
-            # print("Adding html body to email")
-            msg_root.attach(MIMEText(html_body, 'html'))
-
-        if len(attachments) > 0:
-            # print("Adding attachments to email")
-            for file in attachments:
-                with open(file, 'rb') as fp:
-                    msg_attachments = MIMEBase('application', "octet-stream")
-                    msg_attachments.set_payload(fp.read())
-                encoders.encode_base64(msg_attachments)
-                msg_attachments.add_header('Content-Disposition', 'attachment', filename=os.path.basename(file))
-                msg_root.attach(msg_attachments)
-
-        # check environ vars if in debug mode
-        if settings.DEBUG:
-            settings.MAIL_USERNAME = os.getenv('MAIL_USERNAME', settings.MAIL_USERNAME)
-            settings.MAIL_PASSWORD = os.getenv('MAIL_PASSWORD', settings.MAIL_PASSWORD)
-
-        # need to decrypt password
-        if isinstance(settings.MAIL_PASSWORD, bytes):
-            mailpass = AES_CTR.decrypt(settings.MAIL_PASSWORD)
-        else:
-            mailpass = settings.MAIL_PASSWORD
+    msg_body = MIMEMultipart('alternative')
+    msg_body.attach(MIMEText(text_body, 'plain'))
+    if html_body is not None and html_body != "":
+        msg_body.attach(MIMEText(html_body, 'html'))
+
+    if len(attachments) == 0:
+        msg_root = msg_body
+    else:
+        boundary = '=============={}=='.format(uuid.uuid4().hex)
+        msg_root = MIMEMultipart('mixed', boundary=boundary)
+        msg_root.attach(msg_body)
+    msg_root['From'] = sender
+    msg_root['To'] = ", ".join(recipients)
+    msg_root['Subject'] = subject
+    msg_root.preamble = "|-------------------MULTIPART_BOUNDARY-------------------|\n"
+
+    msg_bytes = msg_root.as_bytes(policy=SMTP_POLICY)
+    if len(attachments) == 0:
+        yield msg_bytes
+        return
+
+    # the attachments are spliced in before the closing boundary
+    closing = '--{}--\r\n'.format(boundary).encode('ascii')
+    yield msg_bytes[:-len(closing)]
+    for file in attachments:
+        msg_attachment = MIMEBase('application', "octet-stream")
+        msg_attachment.add_header('Content-Transfer-Encoding', 'base64')
+        msg_attachment.add_header('Content-Disposition', 'attachment', filename=os.path.basename(file))
+        msg_attachment.set_payload('')
+        yield '--{}\r\n'.format(boundary).encode('ascii') + msg_attachment.as_bytes(policy=SMTP_POLICY)
+        with open(file, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(EMAIL_ATTACHMENT_CHUNK_SIZE), b''):
+                yield base64.encodebytes(chunk).replace(b'\n', b'\r\n')
+    yield closing
+
+
+def sendStreamedEmail(server, sender, recipients, chunks):
+    """
+    Send a message rendered by :func:`iterEmailMessage` without building it in memory
+
+    Equivalent to :meth:`smtplib.SMTP.sendmail`, except that the message is written
+    to the DATA stream chunk by chunk.
 
-        # print("sending email")
-        with smtplib.SMTP(settings.MAIL_SERVER, settings.MAIL_PORT) as server:
-            server.connect(settings.MAIL_SERVER, settings.MAIL_PORT)
+    :param server:      logged in connection, as returned by :func:`connectSMTP`
+    :type server:       smtplib.SMTP
+    :param sender:      email address we are sending from
+    :type sender:       str
+    :param recipients:  email addresses we are sending to
+    :type recipients:   list|tuple
+    :param chunks:      the message, in chunks ending on a line break
+    :type chunks:       collections.abc.Iterable[bytes]
+    :return:            the refused recipients, if some were accepted
+    :rtype:             dict
+    :raises:            smtplib.SMTPException
+    """
+    code, resp = server.mail(sender)
+    if code != 250:
+        server.rset()
+        raise smtplib.SMTPSenderRefused(code, resp, sender)
+
+    refused = {}
+    for recipient in recipients:
+        code, resp = server.rcpt(recipient)
+        if code not in (250, 251):
+            refused[recipient] = (code, resp)
+    if len(refused) == len(recipients):
+        server.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+
+    code, resp = server.docmd('data')
+    if code != 354:
+        server.rset()
+        raise smtplib.SMTPDataError(code, resp)
+    for chunk in chunks:
+        server.send(_SMTP_DOT_LINE.sub(b'..', chunk))
+    server.send(b'.\r\n')
+    code, resp = server.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, resp)
+    return refused
+
+
+def connectSMTP():
+    """
+    Open an authenticated connection to the configured mail server
+
+    The caller owns the connection and should quit() it when done,
+    it can be reused to send several messages.
+
+    :return:    the logged in connection
+    :rtype:     smtplib.SMTP
+    """
+    # check environ vars if in debug mode
+    if settings.DEBUG:
+        settings.MAIL_USERNAME = os.getenv('MAIL_USERNAME', settings.MAIL_USERNAME)
+        settings.MAIL_PASSWORD = os.getenv('MAIL_PASSWORD', settings.MAIL_PASSWORD)
+
+    # need to decrypt password
+    if isinstance(settings.MAIL_PASSWORD, bytes):
+        mailpass = AES_CTR.decrypt(settings.MAIL_PASSWORD)
+    else:
+        mailpass = settings.MAIL_PASSWORD
+
+    server = smtplib.SMTP(settings.MAIL_SERVER, settings.MAIL_PORT)
+    try:
+        server.ehlo()
+        if settings.MAIL_USE_TLS:
+            server.starttls()
             server.ehlo()
-            if settings.MAIL_USE_TLS:
-                server.starttls()
-                server.ehlo()
-            server.login(settings.MAIL_USERNAME, mailpass)
-            msg_root_str = msg_root.as_string()
-            server.sendmail(sender, recipients, msg_root_str)
+        server.login(settings.MAIL_USERNAME, mailpass)
+    except Exception:
+        server.close()
+        raise
+    return server
+
+
+class EmailDispatcher():
+    """
+    Sends the queued emails from a fixed pool of threads
+
+    Each worker keeps its SMTP connection open between emails, so a burst of emails costs
+    one connection and login per worker instead of one per email. The queue is bounded,
+    emails are dropped when it is full rather than piling up threads and memory.
+    The workers are started on first use in the process that sends.
+
+    Repeated alerts are coalesced before they get here, by
+    :data:`modules.api.notification.functions.alert_aggregator`.
+    """
+
+    def __init__(self, queue_size=EMAIL_QUEUE_SIZE, workers=EMAIL_WORKERS, idle_timeout=EMAIL_SMTP_IDLE_TIMEOUT):
+        """
+        :param queue_size:          max number of queued emails
+        :type queue_size:           int
+        :param workers:             number of sending threads
+        :type workers:              int
+        :param idle_timeout:        seconds an unused SMTP connection is kept open
+        :type idle_timeout:         int|float
+        """
+        self.queue_size = queue_size
+        self.workers = workers
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._counters = {'queued': 0, 'sent': 0, 'failed': 0, 'dropped': 0, 'connections': 0}
+        self._latencies = deque(maxlen=EMAIL_LATENCY_SAMPLES)
+
+    def _start(self):
+        # threads do not survive a fork, so (re)start them in the current process
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        for i in range(self.workers):
+            threading.Thread(target=self._work, name='email-dispatcher-{}'.format(i), daemon=True).start()
+
+    def submit(self, message):
+        """
+        Queue an email
+
+        :param message:     keyword arguments of :func:`iterEmailMessage`, plus delete_attachments
+        :type message:      dict
+        :return:            whether the email was queued, False when it was dropped
+        :rtype:             bool
+        """
+        with self._lock:
+            self._start()
+
+        try:
+            self._queue.put_nowait((time.monotonic(), message))
+        except queue.Full:
+            with self._lock:
+                self._counters['dropped'] += 1
+            IO.logwarn('email queue is full, dropping email "{}"'.format(message.get('subject', '')))
+            self._deleteAttachments(message)
+            return False
+        with self._lock:
+            self._counters['queued'] += 1
+        return True
+
+    def _deleteAttachments(self, message):
+        if not message.get('delete_attachments', False):
+            return
+        for file in message.get('attachments', []):
+            try:
+                os.remove(file)
+            except OSError:
+                pass
+
+    def _connect(self):
+        server = connectSMTP()
+        with self._lock:
+            self._counters['connections'] += 1
+        return server
+
+    def _close(self, server):
+        try:
             server.quit()
+        except Exception:
+            server.close()
+
+    def _deliver(self, server, message):
+        # a connection that was idle may have been dropped by the server, reconnect once
+        for attempt in range(2):
+            if server is None:
+                server = self._connect()
+            chunks = iterEmailMessage(**{k: v for k, v in message.items() if k != 'delete_attachments'})
+            try:
+                sendStreamedEmail(server, message['sender'], message['recipients'], chunks)
+                return server
+            except smtplib.SMTPServerDisconnected:
+                server.close()
+                server = None
+                if attempt > 0:
+                    raise
+
+    def _work(self):
+        server = None
+        last_used = 0.0
+        while True:
+            try:
+                enqueued, message = self._queue.get(timeout=1)
+            except queue.Empty:
+                if server is not None and time.monotonic() - last_used > self.idle_timeout:
+                    self._close(server)
+                    server = None
+                continue
+
+            start = time.monotonic()
+            try:
+                server = self._deliver(server, message)
+                last_used = time.monotonic()
+                with self._lock:
+                    self._counters['sent'] += 1
+                    self._latencies.append((last_used - enqueued, last_used - start))
+            except Exception as ex:
+                with self._lock:
+                    self._counters['failed'] += 1
+                IO.logerr('could not send email "{}": {}'.format(message.get('subject', ''), str(ex)))
+                debugException(ex)
+                # keep the connection if the server only rejected this email
+                if server is not None:
+                    try:
+                        server.rset()
+                    except Exception:
+                        server.close()
+                        server = None
+            finally:
+                self._deleteAttachments(message)
+                self._queue.task_done()
+
+    def getMetrics(self):
+        """
+        :return:    queue depth, counters and the queue / send latencies in seconds
+        :rtype:     dict
+        """
+        with self._lock:
+            metrics = dict(self._counters)
+            metrics['queue_depth'] = self._queue.qsize() if self._queue is not None else 0
+            metrics['queue_size'] = self.queue_size
+            metrics['workers'] = self.workers
+            latencies = list(self._latencies)
+
+        if len(latencies) > 0:
+            queue_latencies = sorted(latency for latency, _ in latencies)
+            send_times = [send_time for _, send_time in latencies]
+            metrics['latency_avg'] = sum(queue_latencies) / len(queue_latencies)
+            metrics['latency_p95'] = queue_latencies[int(len(queue_latencies) * 0.95)]
+            metrics['latency_max'] = queue_latencies[-1]
+            metrics['send_time_avg'] = sum(send_times) / len(send_times)
+        else:
+            metrics.update({'latency_avg': 0.0, 'latency_p95': 0.0, 'latency_max': 0.0, 'send_time_avg': 0.0})
+        return metrics
+
+
+email_dispatcher = EmailDispatcher()
+
+
+def sendEmail(recipients, text_body, html_body=None, subject=settings.MAIL_DEFAULT_SUBJECT,
+               sender=settings.MAIL_DEFAULT_SENDER, data=None, attachments=[], delete_attachments=False):
+    """
+    Send an Email asynchronously to recipients
+
+    The email is queued and sent by :data:`email_dispatcher`.
+
+    :param recipients:          email addresses we are sending to
+    :type recipients:           list|tuple
+    :param text_body:           email plain text message to send
+    :type text_body:            str
+    :param html_body:           email html message to send
+    :type html_body:            str
+    :param subject:             subject of the email
+    :type subject:              str
+    :param sender:              email address we are sending from
+    :type sender:               str
+    :param data:                key, value pairs to add to message
+    :type data:                 dict
+    :param attachments:         files to attach to email
+    :type attachments:          list|tuple
+    :param delete_attachments:  delete the attachments once the email was sent or discarded
+    :type delete_attachments:   bool
+    :return:                    whether the email was queued
+    :rtype:                     bool
+    """
 
-    except Exception as ex:
-        debugException(ex)
+    return email_dispatcher.submit({
+        'recipients': recipients,
+        'text_body': text_body,
+        'html_body': html_body,
+        'subject': subject,
+        'sender': sender,
+        'data': data,
+        'attachments': attachments,
+        'delete_attachments': delete_attachments,
+    })
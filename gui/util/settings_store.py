@@ -0,0 +1,174 @@
+# make sure the generated source files are imported instead of the template ones
+import sys
+if sys.path[0] != '/etc/dsiprouter/gui':
+    sys.path.insert(0, '/etc/dsiprouter/gui')
+
+import os, re, threading
+from importlib import reload
+
+# matches the top level assignments of a config module, the name of the setting is captured
+CONFIG_ASSIGNMENT_REGEX = re.compile(
+    r"^(?!#)(\w+)[ \t]*=[ \t]*(?:\w+\(.*\)[ \t\v]*$|[\w\d\.]+[ \t]*$|\{.*\}|\[.*\][ \t]*$|\(.*\)[ \t]*$|b?\"\"\".*\"\"\"[ \t]*$|b?'''.*'''[ \v]*$|b?\".*\"[ \t]*$|b?'.*')",
+    flags=re.MULTILINE
+)
+
+# stores of the config modules, keyed by module name
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class SettingsStore():
+    """
+    Read and update the settings of a python config module without re-importing it
+
+    The config module (settings.py) stays the file the settings are persisted in, as the CLI
+    reads and writes it as well. Updates are applied to the loaded module attribute by attribute,
+    only the fields that changed are applied and the file is rewritten in a single pass.
+    The module is only re-imported when the file was changed by another process.
+    """
+
+    def __init__(self, module):
+        """
+        :param module:  the config module
+        :type module:   module
+        """
+        self.module = module
+        self.path = module.__file__
+        self._lock = threading.RLock()
+        # (mtime, size) of the file when the module was last loaded or written by us
+        self._stat = None
+
+    def _fileStat(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def get(self, name, default=None, type=None):
+        """
+        Get a setting
+
+        :param name:        name of the setting
+        :type name:         str
+        :param default:     value returned when the setting does not exist
+        :type default:      object
+        :param type:        type the value is converted to, such as int or bool
+        :type type:         type|None
+        :return:            the value of the setting
+        :rtype:             object
+        """
+        value = getattr(self.module, name, default)
+        if type is None or value is None or isinstance(value, type):
+            return value
+        if type is bool and isinstance(value, str):
+            return value.lower() in ('true', '1', 'yes', 'on')
+        return type(value)
+
+    def isStale(self):
+        """
+        :return:    whether the file changed since the module was loaded or written by this store
+        :rtype:     bool
+        """
+        return self._stat is None or self._fileStat() != self._stat
+
+    def reload(self):
+        """
+        Re-import the config module from the file
+
+        :return:    None
+        :rtype:     None
+        """
+        with self._lock:
+            stat = self._fileStat()
+            reload(self.module)
+            self._stat = stat
+
+    def reloadIfStale(self):
+        """
+        Re-import the config module only if the file was changed by another process
+
+        :return:    whether the module was reloaded
+        :rtype:     bool
+        """
+        with self._lock:
+            if not self.isStale():
+                return False
+            self.reload()
+            return True
+
+    def update(self, fields, apply=True, persist=True):
+        """
+        Update settings
+
+        :param fields:      the new values, by setting name
+        :type fields:       dict
+        :param apply:       whether to update the loaded module
+        :type apply:        bool
+        :param persist:     whether to write the new values to the file
+        :type persist:      bool
+        :return:            the fields whose value changed in the loaded module
+        :rtype:             dict
+        """
+        missing = object()
+        with self._lock:
+            changed = {key: val for key, val in fields.items() if getattr(self.module, key, missing) != val}
+            if apply:
+                for key, val in changed.items():
+                    setattr(self.module, key, val)
+            # the loaded module must be reloaded from the file if it was not updated
+            if persist and self.writeFile(fields) and not apply:
+                self._stat = None
+        return changed
+
+    def writeFile(self, fields):
+        """
+        Replace the values of settings in the file
+
+        The settings are replaced in a single pass over the file and the file is left
+        untouched when none of the values change.
+
+        :param fields:  the new values, by setting name
+        :type fields:   dict
+        :return:        whether the file was written
+        :rtype:         bool
+        """
+        def replaceAssignment(match):
+            key = match.group(1)
+            if key not in fields:
+                return match.group(0)
+            return "{} = {}".format(key, repr(fields[key]))
+
+        with self._lock:
+            # our own write must not make the module look stale, unless it was already
+            stale = self.isStale()
+            with open(self.path, 'r+') as config:
+                config_str = config.read()
+                new_config_str = CONFIG_ASSIGNMENT_REGEX.sub(replaceAssignment, config_str)
+                if new_config_str == config_str:
+                    return False
+                config.seek(0)
+                config.write(new_config_str)
+                config.truncate()
+            if not stale:
+                self._stat = self._fileStat()
+            return True
+
+
+def getSettingsStore(module):
+    """
+    Get the store of a config module, the store is created on first use
+
+    :param module:  the config module
+    :type module:   module
+    :return:        the store
+    :rtype:         :class:`SettingsStore`
+    """
+    store = _stores.get(module.__name__, None)
+    if store is not None:
+        return store
+
+    with _stores_lock:
+        if module.__name__ not in _stores:
+            _stores[module.__name__] = SettingsStore(module)
+        return _stores[module.__name__]
@@ -1,3 +1,13 @@
 -- update dr_rules schema to fit our storage requirements
+-- safe to re-run, it is also applied by the v0.74 upgrade migration
 ALTER TABLE dr_rules
-  MODIFY description varchar(255) NOT NULL DEFAULT '';
\ No newline at end of file
+  MODIFY description varchar(255) NOT NULL DEFAULT '';
+-- the group a rule routes to, normalized so dr_gw_lists can be joined on an indexed column
+-- instead of REPLACE(gwlist, '#', ''), NULL when the first gwlist entry is not a group (#<id>) or a number
+-- for a multi entry gwlist (#5,#6) it is the first group, the inbound mapping view shows it as "<name> +1"
+ALTER TABLE dr_rules
+  ADD COLUMN IF NOT EXISTS gwgroupid int(10) unsigned GENERATED ALWAYS AS (
+    IF(SUBSTRING_INDEX(gwlist, ',', 1) REGEXP '^#?[0-9]+$', CAST(REPLACE(SUBSTRING_INDEX(gwlist, ',', 1), '#', '') AS UNSIGNED), NULL)
+  ) STORED,
+  ADD KEY IF NOT EXISTS dr_rules_gwgroupid_idx (gwgroupid),
+  ADD KEY IF NOT EXISTS dr_rules_groupid_prefix_idx (groupid, prefix);
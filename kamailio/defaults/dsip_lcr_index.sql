@@ -0,0 +1,9 @@
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8 */;
+CREATE TABLE IF NOT EXISTS `dsip_lcr_index` (
+    `key_name` varchar(128) NOT NULL DEFAULT '',
+    `key_value` varchar(512) NOT NULL DEFAULT '',
+    PRIMARY KEY (`key_name`)
+) ENGINE = InnoDB
+  DEFAULT CHARSET = utf8;
+/*!40101 SET character_set_client = @saved_cs_client */;
@@ -193,6 +193,13 @@ if (( $REINSTALL_KAMAILIO == 1 )); then
     }
 fi
 
+# the restored database predates the schema changes of this release
+printdbg 'migrating kamailio database'
+${DSIP_PROJECT_DIR}/resources/upgrade/v0.74/scripts/schema.sh || {
+    printerr 'failed migrating kamailio database'
+    exit 1
+}
+
 if (( $REINSTALL_DSIPROUTER == 1 )); then
     printdbg 'updating dSIPRouter version'
     setConfigAttrib 'VERSION' '0.74' ${DSIP_SYSTEM_CONFIG_DIR}/gui/settings.py -q || {
@@ -0,0 +1,50 @@
+#!/usr/bin/env bash
+#
+# idempotent database and cron migrations of the v0.74 release
+# run by migrate.sh once the database is restored, can be re-run on an install already at v0.74:
+#   /opt/dsiprouter/resources/upgrade/v0.74/scripts/schema.sh
+#
+
+# set project dir where the repo is located
+export DSIP_PROJECT_DIR=${DSIP_PROJECT_DIR:-/opt/dsiprouter}
+# import dsip_lib utility / shared functions if not already
+if [[ "$DSIP_LIB_IMPORTED" != "1" ]]; then
+    . ${DSIP_PROJECT_DIR}/dsiprouter/dsip_lib.sh
+fi
+
+export PYTHON_CMD=${PYTHON_CMD:-python3}
+DSIP_SYSTEM_CONFIG_DIR=${DSIP_SYSTEM_CONFIG_DIR:-/etc/dsiprouter}
+DSIP_CONFIG_FILE=${DSIP_SYSTEM_CONFIG_DIR}/gui/settings.py
+DSIP_LIB_DIR=${DSIP_LIB_DIR:-/var/lib/dsiprouter}
+export ROOT_DB_PASS=${ROOT_DB_PASS:-$(decryptConfigAttrib 'ROOT_DB_PASS' ${DSIP_CONFIG_FILE})}
+export ROOT_DB_HOST=${ROOT_DB_HOST:-$(getConfigAttrib 'ROOT_DB_HOST' ${DSIP_CONFIG_FILE})}
+export ROOT_DB_PORT=${ROOT_DB_PORT:-$(getConfigAttrib 'ROOT_DB_PORT' ${DSIP_CONFIG_FILE})}
+export ROOT_DB_USER=${ROOT_DB_USER:-$(getConfigAttrib 'ROOT_DB_USER' ${DSIP_CONFIG_FILE})}
+export ROOT_DB_NAME=${ROOT_DB_NAME:-$(getConfigAttrib 'ROOT_DB_NAME' ${DSIP_CONFIG_FILE})}
+export KAM_DB_NAME=${KAM_DB_NAME:-$(getConfigAttrib 'KAM_DB_NAME' ${DSIP_CONFIG_FILE})}
+
+# every file must be safe to apply more than once
+MIGRATION_SQL_FILES=(
+    # dr_rules.gwgroupid
+    ${DSIP_PROJECT_DIR}/kamailio/defaults/dr_rules.sql
+    # acc / cdrs indexes
+    ${DSIP_PROJECT_DIR}/gui/modules/cdr/cdrs_upgrade.sql
+)
+
+printdbg 'migrating database schema'
+for SQL_FILE in ${MIGRATION_SQL_FILES[@]}; do
+    withRootDBConn --db="$KAM_DB_NAME" mysql <${SQL_FILE} || {
+        printerr "failed applying ${SQL_FILE}"
+        exit 1
+    }
+done
+
+# the reflected schema cached by the GUI no longer matches
+rm -f ${DSIP_LIB_DIR}/schema.cache
+
+# kamailio no longer calls kamailio_cdrs(), without the cron job no cdrs are created
+printdbg 'migrating cron jobs'
+cronRemove 'dsiprouter_cron.py cdr consolidate'
+cronAppend "*/5 * * * * ${PYTHON_CMD} ${DSIP_PROJECT_DIR}/gui/dsiprouter_cron.py cdr consolidate"
+
+exit 0
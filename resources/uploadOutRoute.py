@@ -1,71 +1,69 @@
-import requests
+#!/usr/bin/env python3
+# bulk load outbound routes
+# must be run on the dSIPRouter host, the DB connection settings are taken from the GUI settings
+#
+# usage:
+#   uploadOutRoute.py import <csv file> [-g GWGROUPID] [-n NAME] [--no-reload]
+#       import a carrier rate deck, see modules/api/outboundroutes/functions.py for the csv format
+#   uploadOutRoute.py patterns <pattern> [<pattern>...] -g GWGROUPID [-n NAME] [-m MAX_PREFIXES] [--no-reload]
+#       route ASTERISK-like prefix patterns to a carrier group, see gui/util/conversions.py for the patterns
+import argparse, csv, json, sys
+sys.path.insert(0, '/etc/dsiprouter/gui')
 
-# set per your own configs (get prefixs from gui/util/conversions.py)
-processed_prefixs = [
-'011',
-]
-name = 'Test Calling'
-gwlist = '#9'
+from database import startSession
+from modules.api.outboundroutes.functions import importOutboundRoutes, writeOutboundRoutes, reloadOutboundRoutes
+from modules.api.kamailio.functions import markKamailioReloadRequired
+from util.conversions import estimate_prefix_count, iter_prefixes
 
-# set per your own configs
-host = "10.10.10.154"
-username = 'admin'
-password = 'admin'
+parser = argparse.ArgumentParser(description='bulk load outbound routes')
+commands = parser.add_subparsers(dest='command', required=True)
+import_parser = commands.add_parser('import', help='import a carrier rate deck csv')
+import_parser.add_argument('file', help='the csv file, - for stdin')
+import_parser.add_argument('-g', '--gwgroupid', help='carrier group to route all the prefixes to')
+import_parser.add_argument('-n', '--name', help='name of the routes without a name')
+import_parser.add_argument('--no-reload', action='store_true', help='only mark kamailio for reload')
+patterns_parser = commands.add_parser('patterns', help='route prefix patterns to a carrier group')
+patterns_parser.add_argument('patterns', nargs='+', help='the prefix patterns')
+patterns_parser.add_argument('-g', '--gwgroupid', required=True, help='carrier group to route the prefixes to')
+patterns_parser.add_argument('-n', '--name', help='name of the routes')
+# a pattern can expand to millions of prefixes
+patterns_parser.add_argument('-m', '--max-prefixes', type=int, default=100000, help='refuse to write more prefixes than this')
+patterns_parser.add_argument('--no-reload', action='store_true', help='only mark kamailio for reload')
+args = parser.parse_args()
 
-# auth for session cookie
-URL = 'http://{}:5000/login'.format(host)
-payload = {
-    'username': username,
-    'password': password,
-    'nextpage': ''
-}
-headers = {
-    'Accept':'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8',
-    'Accept-Encoding':'gzip, deflate',
-    'Accept-Language':'en-US,en;q=0.9',
-    'Cache-Control':'max-age=0',
-    'Connection':'keep-alive',
-    'Content-Type':'application/x-www-form-urlencoded',
-    'DNT':'1',
-    'Host':'{}:5000'.format(host),
-    'Origin':'http://{}:5000'.format(host),
-    'Referer':'http://{}:5000/'.format(host),
-    'Upgrade-Insecure-Requests':'1',
-    'User-Agent':'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/71.0.3578.98 Safari/537.36'
-}
+db = startSession()
+try:
+    if args.command == 'import':
+        with (open(args.file, 'r', newline='') if args.file != '-' else sys.stdin) as fp:
+            stats = importOutboundRoutes(csv.reader(fp), db, args.gwgroupid, args.name)
+        changed = stats['inserted'] + stats['updated']
+        print("OUTBOUNDROUTES: {} inserted, {} updated, {} rejected".format(stats['inserted'], stats['updated'], stats['rejected']))
+        for reject in stats['rejects']:
+            print(json.dumps(reject))
+    else:
+        count = estimate_prefix_count(args.patterns)
+        print("PREFIXES: {} (estimated)".format(count))
+        if count > args.max_prefixes:
+            print("refusing to write more than {} prefixes, use shorter patterns or raise --max-prefixes".format(args.max_prefixes))
+            exit(1)
+        stats = writeOutboundRoutes(iter_prefixes(args.patterns), db, '#{}'.format(args.gwgroupid.lstrip('#')), name=args.name)
+        changed = stats['inserted']
+        print("OUTBOUNDROUTES: {} inserted, {} already existed".format(stats['inserted'], stats['skipped']))
+    db.commit()
+except Exception:
+    db.rollback()
+    raise
+finally:
+    db.close()
 
-r1 = requests.post(URL, data=payload, headers=headers)
-print("LOGIN: {}\n".format(r1.status_code))
-
-
-# add outbound routes
-URL = 'http://{}:5000/outboundroutes'.format(host)
-payloads = [{
-    'ruleid': '',
-    'from_prefix': '',
-    'timerec': '',
-    'priority': '',
-    'prefix': prefix,
-    'name': name,
-    'gwlist': gwlist
-} for prefix in processed_prefixs]
-headers = {
-    'Host':'{}:5000'.format(host),
-    'Connection':'keep-alive',
-    'Cache-Control':'max-age=0',
-    'Origin':'http://{}:5000'.format(host),
-    'Upgrade-Insecure-Requests':'1',
-    'DNT':'1',
-    'Content-Type':'application/x-www-form-urlencoded',
-    'User-Agent':'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/71.0.3578.98 Safari/537.36',
-    'Accept':'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8',
-    'Referer':'http://{}:5000/outboundroutes'.format(host),
-    'Accept-Encoding':'gzip, deflate',
-    'Accept-Language':'en-US,en;q=0.9'
-}
-
-for payload in payloads:
-    r = requests.post(URL, data=payload, headers=headers, cookies=r1.cookies)
-    print("OUTBOUNDROUTES: {}".format(r.status_code))
+if changed > 0:
+    if not args.no_reload and reloadOutboundRoutes():
+        print("KAMAILIO: reloaded")
+    else:
+        try:
+            markKamailioReloadRequired('drouting', 'dr_rules', 'tofromprefix')
+        except Exception:
+            pass
+        print("KAMAILIO: reload required, reload kamailio from the GUI")
 
 exit(0)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark of the CDR consolidation job
+
+Generates an acc table with answered calls (INVITE + BYE) and unanswered INVITEs in a
+scratch database cloned from the kamailio schema, then runs consolidateCDRS() against it.
+The scratch database is dropped afterwards, the kamailio tables are never touched.
+
+Must be run on a dSIPRouter host, the DB connection settings are taken from the GUI settings.
+
+Usage: python3 cdr_consolidation.py [-c CALLS] [-u UNANSWERED] [-b BATCH_SIZE]
+"""
+
+import argparse, os, random, sys, uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'gui'))
+
+from sqlalchemy.sql import text
+from database import getDBEngine
+from modules.cdr.functions import consolidateCDRS
+
+BENCH_DB_NAME = 'dsip_bench_cdrs'
+INSERT_CHUNK_SIZE = 10000
+
+
+def generateAcc(calls, unanswered):
+    now = datetime.now()
+    for i in range(calls + unanswered):
+        callid = uuid.uuid4().hex
+        from_tag, to_tag = uuid.uuid4().hex[:16], uuid.uuid4().hex[:16]
+        start = now - timedelta(seconds=random.randint(60, 3600))
+        invite = {
+            'method': 'INVITE', 'from_tag': from_tag, 'to_tag': to_tag, 'callid': callid, 'sip_code': '200',
+            'sip_reason': 'OK', 'time': start, 'src_ip': '10.0.0.{}'.format(i % 250 + 1), 'dst_ouser': '1555{:07d}'.format(i),
+            'dst_user': '1555{:07d}'.format(i), 'dst_domain': 'example.com', 'src_user': '1444{:07d}'.format(i),
+            'src_domain': 'example.com', 'calltype': 'inbound', 'src_gwgroupid': str(i % 50), 'dst_gwgroupid': str(i % 7)
+        }
+        yield invite
+        if i < calls:
+            bye = dict(invite, method='BYE', time=start + timedelta(seconds=random.randint(1, 600)))
+            # half of the calls are hung up by the callee
+            if i % 2 == 1:
+                bye['from_tag'], bye['to_tag'] = to_tag, from_tag
+            yield bye
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the cdr consolidation job')
+    parser.add_argument('-c', '--calls', type=int, default=100000, help='number of answered calls')
+    parser.add_argument('-u', '--unanswered', type=int, default=20000, help='number of INVITEs without a BYE')
+    parser.add_argument('-b', '--batch-size', type=int, default=5000, help='INVITEs consolidated per transaction')
+    args = parser.parse_args()
+
+    engine = getDBEngine()
+    kam_db_name = engine.url.database
+
+    with engine.connect() as conn:
+        conn.execute(text('DROP DATABASE IF EXISTS {}'.format(BENCH_DB_NAME)))
+        conn.execute(text('CREATE DATABASE {}'.format(BENCH_DB_NAME)))
+        try:
+            conn.execute(text('USE {}'.format(BENCH_DB_NAME)))
+            conn.execute(text('CREATE TABLE acc LIKE {}.acc'.format(kam_db_name)))
+            conn.execute(text('CREATE TABLE cdrs LIKE {}.cdrs'.format(kam_db_name)))
+
+            insert = text("""INSERT INTO acc (method, from_tag, to_tag, callid, sip_code, sip_reason, time, src_ip,
+                    dst_ouser, dst_user, dst_domain, src_user, src_domain, calltype, src_gwgroupid, dst_gwgroupid)
+                VALUES (:method, :from_tag, :to_tag, :callid, :sip_code, :sip_reason, :time, :src_ip,
+                    :dst_ouser, :dst_user, :dst_domain, :src_user, :src_domain, :calltype, :src_gwgroupid, :dst_gwgroupid)""")
+            chunk = []
+            for row in generateAcc(args.calls, args.unanswered):
+                chunk.append(row)
+                if len(chunk) >= INSERT_CHUNK_SIZE:
+                    conn.execute(insert, chunk)
+                    chunk = []
+            if len(chunk) > 0:
+                conn.execute(insert, chunk)
+            conn.commit()
+
+            stats = consolidateCDRS(conn, batch_size=args.batch_size)
+            print('acc rows:          {}'.format(args.calls * 2 + args.unanswered))
+            print('invites scanned:   {}'.format(stats['invites']))
+            print('cdrs created:      {}'.format(stats['cdrs']))
+            print('batches:           {}'.format(stats['batches']))
+            print('elapsed:           {:.3f}s'.format(stats['elapsed']))
+            print('throughput:        {:.0f} cdrs/s'.format(stats['cdrs'] / stats['elapsed'] if stats['elapsed'] > 0 else 0))
+        finally:
+            conn.execute(text('DROP DATABASE IF EXISTS {}'.format(BENCH_DB_NAME)))
+
+
+if __name__ == '__main__':
+    main()
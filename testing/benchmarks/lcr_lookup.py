@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Call setup CPU benchmark of the LCR lookup against the number of LCR rules
+
+Replays the per INVITE work of route[NEXTHOP] for random calls against generated dsip_lcr rules:
+  - scan:   the previous lookup, iterating the whole tofromprefix htable and building,
+            compiling and matching a regex for every rule
+  - index:  the lookup through the lcrindex htable built by database.lcr.buildLCRIndex()
+
+Both lookups are done in python, the numbers are relative, but the work per call is the same
+as in kamailio: one regex per rule for the scan, one htable get per candidate prefix for the index.
+The calls are routed by both lookups and the mismatches are reported, the scan does not anchor
+its regex so it can match in the middle of a number where the index only matches prefixes.
+
+Usage: python3 lcr_lookup.py [-r RULES [RULES ...]] [-c CALLS]
+"""
+
+import argparse, os, random, re, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'gui'))
+
+from database.lcr import buildLCRIndex, lookupLCRIndex
+
+ESCAPE_REGEX = re.compile(r'(\+|\*|\#)')
+
+
+def generateRules(count):
+    rules = {}
+    while len(rules) < count:
+        from_prefix = str(random.randint(200, 999)) + ''.join(random.choice('0123456789') for _ in range(random.randint(0, 4)))
+        to_prefix = '1' + str(random.randint(200, 999)) + ''.join(random.choice('0123456789') for _ in range(random.randint(0, 3)))
+        rules['{}-{}'.format(from_prefix, to_prefix)] = (from_prefix, str(10000 + len(rules)))
+    return rules
+
+
+def generateCalls(rules, count):
+    patterns = list(rules)
+    calls = []
+    for i in range(count):
+        # half of the calls match a rule, the others most likely do not
+        if i % 2 == 0:
+            from_prefix, to_prefix = random.choice(patterns).split('-', 1)
+        else:
+            from_prefix, to_prefix = str(random.randint(200, 999)), '1' + str(random.randint(200, 999))
+        from_user = (from_prefix + ''.join(random.choice('0123456789') for _ in range(10)))[:10]
+        to_user = (to_prefix + ''.join(random.choice('0123456789') for _ in range(11)))[:11]
+        calls.append((from_user, to_user))
+    return calls
+
+
+def scanLookup(table, from_user, to_user):
+    lookup = from_user + '-' + to_user
+    match, match_diff = None, 1000
+    for key, value in table.items():
+        regex = ESCAPE_REGEX.sub(r'\\\1', key.split('-')[0]) + '([0-9])*-' + ESCAPE_REGEX.sub(r'\\\1', key.split('-')[-1]) + '([0-9])*'
+        # kamailio compiles the regex of every rule on each call, re's cache would hide that cost
+        re.purge()
+        if re.compile(regex).search(lookup) is not None:
+            diff = abs(len(lookup) - len(key))
+            if diff < match_diff:
+                match, match_diff = value, diff
+    return match
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the LCR lookup per call against the number of rules')
+    parser.add_argument('-r', '--rules', type=int, nargs='+', default=[100, 1000, 5000, 10000], help='numbers of LCR rules')
+    parser.add_argument('-c', '--calls', type=int, default=200, help='calls routed per number of rules')
+    args = parser.parse_args()
+
+    print('{:>8} {:>16} {:>16} {:>10} {:>12}'.format('rules', 'scan us/call', 'index us/call', 'speedup', 'mismatches'))
+    for count in args.rules:
+        rules = generateRules(count)
+        table = {pattern: groupid for pattern, (_, groupid) in rules.items()}
+        index = buildLCRIndex((pattern, from_prefix) for pattern, (from_prefix, _) in rules.items())
+        calls = generateCalls(rules, args.calls)
+
+        start = time.perf_counter()
+        scan_results = [scanLookup(table, from_user, to_user) for from_user, to_user in calls]
+        scan_time = (time.perf_counter() - start) / len(calls)
+
+        start = time.perf_counter()
+        index_results = [lookupLCRIndex(index, table, from_user, to_user) for from_user, to_user in calls]
+        index_time = (time.perf_counter() - start) / len(calls)
+
+        mismatches = sum(1 for scan, indexed in zip(scan_results, index_results) if scan != indexed)
+        print('{:>8} {:>16.1f} {:>16.1f} {:>9.0f}x {:>12}'.format(
+            count, scan_time * 1e6, index_time * 1e6, scan_time / index_time if index_time > 0 else 0, mismatches))
+
+
+if __name__ == '__main__':
+    main()
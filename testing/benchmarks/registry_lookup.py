@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the per-request cost of looking up the process-wide singletons
+
+Compares the old lookup used by startSession() / getSharedMemoryDict(), which walked the
+call stack with inspect.stack() to find the top-level module globals, against the real
+database.getDBEngine() and util.ipc.getSharedMemoryDict() that replaced it.
+
+The DB engine is not created, a placeholder is registered in its place so no DB is needed,
+the shared state is a real shared memory dict created for the run.
+
+Each request looks up the DB engine and the shared state a few times, the lookups
+are made from a nested call stack to mimic the depth of a request handled by flask.
+
+Usage: python3 registry_lookup.py [-n ITERATIONS] [-d STACK_DEPTH] [-l LOOKUPS_PER_REQUEST]
+"""
+
+import argparse, inspect, os, sys, timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'gui'))
+
+import database
+from database import DB_ENGINE_NAME, getDBEngine
+from util.ipc import STATE_SHMEM_NAME, createSharedMemoryDict, getSharedMemoryDict
+
+SHMEM_NAME = 'registry_lookup_bench'
+
+
+def inspectLookup(name):
+    caller_globals = dict(inspect.getmembers(inspect.stack()[-1][0]))["f_globals"]
+    if name in caller_globals:
+        return caller_globals[name]
+    caller_globals[name] = object()
+    return caller_globals[name]
+
+
+def previousRequest():
+    inspectLookup(DB_ENGINE_NAME)
+    inspectLookup(STATE_SHMEM_NAME)
+
+
+def registryRequest():
+    getDBEngine()
+    getSharedMemoryDict(SHMEM_NAME)
+
+
+def atDepth(depth, func):
+    if depth <= 0:
+        return func()
+    return atDepth(depth - 1, func)
+
+
+def request(lookup, depth, lookups):
+    for _ in range(lookups):
+        atDepth(depth, lookup)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark singleton lookups per request')
+    parser.add_argument('-n', '--iterations', type=int, default=200, help='number of simulated requests')
+    parser.add_argument('-d', '--depth', type=int, default=30, help='call stack depth of each lookup')
+    parser.add_argument('-l', '--lookups', type=int, default=3, help='lookups per simulated request')
+    args = parser.parse_args()
+
+    # stand in for the engine, getDBEngine() only creates one when none is registered
+    database._db_registry[DB_ENGINE_NAME] = object()
+    shmem = createSharedMemoryDict({'kam_reload_required': False}, SHMEM_NAME)
+    try:
+        for name, lookup in (('inspect.stack()', previousRequest), ('registry', registryRequest)):
+            total = timeit.timeit(lambda: request(lookup, args.depth, args.lookups), number=args.iterations)
+            print('{:<16} {:>12.2f} us/request'.format(name, total / args.iterations * 1e6))
+    finally:
+        shmem.unlink()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Latency benchmark of the settings sync against a copy of gui/settings.py
+
+Replays the settings work of the GUI on a temporary copy of the settings module:
+  - previous:   shared.updateConfig() before the settings store, one regex substitution over
+                the whole file per field, then the module is re-imported
+  - store:      util.settings_store.SettingsStore, only the changed fields are applied to the
+                loaded module, the file is rewritten in a single pass and only re-imported
+                when it changed on disk
+
+Scenarios:
+  - startup sync:   syncSettings() on startup or on SIGUSR1, every setting is synced and none changed
+  - change 1:       a sync after 1 setting changed
+  - change 10:      a sync after 10 settings changed
+
+The dsip_settings table round trip is not replayed, syncSettings() now skips it when the synced
+fields did not change, which is the case of every sync but the first one after a change.
+
+Usage: python3 settings_sync.py [-i ITERATIONS]
+"""
+
+import argparse, importlib, os, re, shutil, sys, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'gui'))
+
+from util.settings_store import CONFIG_ASSIGNMENT_REGEX, SettingsStore
+
+SETTINGS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'gui', 'settings.py')
+MODULE_NAME = 'settings_sync_bench'
+
+
+def previousUpdateConfig(config_obj, field_dict):
+    with open(config_obj.__file__, 'r+') as config:
+        config_str = config.read()
+        for key, val in field_dict.items():
+            regex = r"^(?!#)(?:" + re.escape(key) + \
+                    r")[ \t]*=[ \t]*(?:\w+\(.*\)[ \t\v]*$|[\w\d\.]+[ \t]*$|\{.*\}|\[.*\][ \t]*$|\(.*\)[ \t]*$|b?\"\"\".*\"\"\"[ \t]*$|b?'''.*'''[ \v]*$|b?\".*\"[ \t]*$|b?'.*')"
+            replace_str = "{} = {}".format(key, repr(val))
+            config_str = re.sub(regex, replace_str, config_str, flags=re.MULTILINE)
+
+        config.seek(0)
+        config.write(config_str)
+        config.truncate()
+
+    importlib.reload(config_obj)
+
+
+def previousSync(module, fields):
+    # syncSettings() re-imported the module before merging, then updateConfig() re-imported it again
+    importlib.reload(module)
+    previousUpdateConfig(module, fields)
+
+
+def storeSync(store, fields):
+    store.reloadIfStale()
+    store.update(fields)
+
+
+def changedFields(fields, count, iteration):
+    changed = {}
+    for key, val in fields.items():
+        if len(changed) == count:
+            break
+        if isinstance(val, str):
+            changed[key] = '{}-{}'.format(val.split('-bench')[0], 'bench{}'.format(iteration))
+    return changed
+
+
+def timeIt(func, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        func(i)
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the settings sync latency')
+    parser.add_argument('-i', '--iterations', type=int, default=200, help='syncs per scenario')
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        sys.path.insert(0, tmp_dir)
+        sys.dont_write_bytecode = True
+        shutil.copy(SETTINGS_FILE, os.path.join(tmp_dir, MODULE_NAME + '.py'))
+        module = importlib.import_module(MODULE_NAME)
+        store = SettingsStore(module)
+
+        with open(module.__file__, 'r') as f:
+            names = [match.group(1) for match in CONFIG_ASSIGNMENT_REGEX.finditer(f.read())]
+        fields = {name: getattr(module, name) for name in names if name.isupper()}
+
+        scenarios = [
+            ('startup sync', lambda i: fields),
+            ('change 1', lambda i: changedFields(fields, 1, i)),
+            ('change 10', lambda i: changedFields(fields, 10, i)),
+        ]
+
+        print('{} settings'.format(len(fields)))
+        print('{:>14} {:>16} {:>16} {:>10}'.format('scenario', 'previous ms', 'store ms', 'speedup'))
+        for name, getFields in scenarios:
+            previous_time = timeIt(lambda i: previousSync(module, dict(fields, **getFields(i))), args.iterations)
+            store_time = timeIt(lambda i: storeSync(store, dict(fields, **getFields(i))), args.iterations)
+            print('{:>14} {:>16.3f} {:>16.3f} {:>9.0f}x'.format(
+                name, previous_time * 1e3, store_time * 1e3, previous_time / store_time if store_time > 0 else 0))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()